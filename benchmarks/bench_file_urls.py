@@ -0,0 +1,79 @@
+"""
+    Times building the file urls of a list page: 500 blogs with 3 files each,
+    one ``get_file_url`` call per file against one ``add_file_urls_to_models``
+    call for the whole result set.
+
+    Run from the repository root::
+
+        python -m benchmarks.bench_file_urls
+"""
+import timeit
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from flask_file_upload import FileUpload
+
+
+MODELS = 500
+FILENAMES = ["my_image", "my_video", "my_placeholder"]
+REPEAT = 5
+NUMBER = 10
+
+app = Flask(__name__)
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["UPLOAD_FOLDER"] = "static/uploads"
+app.config["ALLOWED_EXTENSIONS"] = ["jpg", "png", "mp4"]
+db = SQLAlchemy(app)
+file_upload = FileUpload(app, db)
+
+
+@file_upload.Model
+class BenchBlogModel(db.Model):
+    __tablename__ = "bench_blogs"
+    id = db.Column(db.Integer, primary_key=True)
+    my_image = file_upload.Column()
+    my_video = file_upload.Column()
+    my_placeholder = file_upload.Column()
+
+
+def create_blogs():
+    return [
+        BenchBlogModel(
+            id=i,
+            my_image__file_name="my_image.png",
+            my_video__file_name="my_video.mp4",
+            my_placeholder__file_name="my_placeholder.jpg",
+        )
+        for i in range(1, MODELS + 1)
+    ]
+
+
+def get_file_url_per_file(blogs):
+    for blog in blogs:
+        for filename in FILENAMES:
+            setattr(blog, f"{filename}_url", file_upload.get_file_url(blog, filename=filename))
+
+
+def add_file_urls_to_models(blogs):
+    file_upload.add_file_urls_to_models(blogs, filenames=FILENAMES)
+
+
+def bench(fn, blogs):
+    """
+    :return float: The best time per call in milliseconds
+    """
+    with app.test_request_context():
+        return min(timeit.repeat(lambda: fn(blogs), repeat=REPEAT, number=NUMBER)) / NUMBER * 1000
+
+
+def main():
+    blogs = create_blogs()
+    print(f"{MODELS} models x {len(FILENAMES)} files")
+    for fn in (get_file_url_per_file, add_file_urls_to_models):
+        print(f"{fn.__name__:<28}{bench(fn, blogs):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
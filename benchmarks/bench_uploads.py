@@ -0,0 +1,410 @@
+"""
+    Times ``save_files``, ``update_files``, ``stream_file``, ``delete_files``,
+    ``get_file_url`` & ``add_file_urls_to_models`` through the Flask test client,
+    sweeping the file size, the files per request, the rows per url request &
+    the backref fan-out. Each axis is swept on its own with the other axes at
+    their first value, so a 1 GB file is not uploaded 16 times per request.
+
+    Run from the repository root::
+
+        python -m benchmarks.bench_uploads
+        python -m benchmarks.bench_uploads --sizes 1K,1M,64M,1G --json results.json
+
+    Results are written as JSON with ``--json``. To gate an upgrade, save the
+    results of the current release & compare the new one against them. The
+    run exits with status 1 if the median of any case is more than
+    ``--max-regression`` slower than in the baseline::
+
+        python -m benchmarks.bench_uploads --json baseline.json
+        pip install -U flask-file-upload
+        python -m benchmarks.bench_uploads --compare baseline.json --max-regression 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timezone
+
+import flask
+import sqlalchemy
+import werkzeug
+from flask import Flask, request
+from flask_sqlalchemy import SQLAlchemy
+
+from flask_file_upload import FileUpload
+
+
+SIZES = "1K,64K,1M,16M"
+FILES = "1,4,16"
+ROWS = "10,100,1000"
+FANOUT = "1,10,50"
+REPEAT = 5
+
+#: The file columns declared on ``BenchPostModel``, the largest files per request
+MAX_FILES = 16
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+WORK_DIR = tempfile.mkdtemp(prefix="flask-file-upload-bench-")
+
+app = Flask(__name__)
+app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["UPLOAD_FOLDER"] = os.path.join(WORK_DIR, "uploads")
+app.config["ALLOWED_EXTENSIONS"] = ["bin", "png"]
+app.config["MAX_CONTENT_LENGTH"] = None
+db = SQLAlchemy(app)
+file_upload = FileUpload(app, db)
+
+FILENAMES = [f"file_{i}" for i in range(MAX_FILES)]
+
+BenchPostModel = file_upload.Model(type("BenchPostModel", (db.Model,), {
+    "__tablename__": "bench_posts",
+    "id": db.Column(db.Integer, primary_key=True),
+    "comments": db.relationship("BenchCommentModel", backref="post"),
+    **{filename: file_upload.Column() for filename in FILENAMES},
+}))
+
+
+@file_upload.Model
+class BenchCommentModel(db.Model):
+    __tablename__ = "bench_comments"
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("bench_posts.id"))
+    comment_image = file_upload.Column()
+
+
+def _request_files(count):
+    return {filename: request.files[filename] for filename in FILENAMES[:count]}
+
+
+@app.route("/posts", methods=["POST"])
+def create_post():
+    post = file_upload.save_files(BenchPostModel(), files=_request_files(len(request.files)))
+    return {"id": post.id}, 201
+
+
+@app.route("/posts/<int:post_id>", methods=["PUT"])
+def update_post(post_id):
+    post = db.session.get(BenchPostModel, post_id)
+    file_upload.update_files(post, files=_request_files(len(request.files)))
+    return {"id": post_id}
+
+
+@app.route("/posts/<int:post_id>", methods=["DELETE"])
+def delete_post(post_id):
+    post = db.session.get(BenchPostModel, post_id)
+    file_upload.delete_files(post, files=FILENAMES[:int(request.args["files"])])
+    return {"id": post_id}
+
+
+@app.route("/posts/<int:post_id>/file_0")
+def stream_post_file(post_id):
+    return file_upload.stream_file(db.session.get(BenchPostModel, post_id), filename="file_0")
+
+
+@app.route("/urls/get_file_url")
+def get_file_urls():
+    posts = BenchPostModel.query.order_by(BenchPostModel.id).limit(int(request.args["rows"])).all()
+    return {"urls": [
+        [file_upload.get_file_url(post, filename="file_0")]
+        + [file_upload.get_file_url(comment, filename="comment_image") for comment in post.comments]
+        for post in posts
+    ]}
+
+
+@app.route("/urls/add_file_urls_to_models")
+def add_file_urls():
+    query = BenchPostModel.query.order_by(BenchPostModel.id).limit(int(request.args["rows"]))
+    posts = file_upload.add_file_urls_to_models(query, filenames=["file_0"], backref={
+        "name": "comments",
+        "filenames": ["comment_image"],
+    })
+    return {"urls": [
+        [post.file_0_url] + [comment.comment_image_url for comment in post.comments]
+        for post in posts
+    ]}
+
+
+def parse_size(value):
+    """
+    :param value: e.g. ``"64K"``, ``"1G"`` or ``"512"``
+    :return int: The size in bytes
+    """
+    value = value.strip().upper().rstrip("B")
+    if value[-1:] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]}{unit}"
+    return str(size)
+
+
+def create_payload(size):
+    """
+    Writes a file of ``size`` bytes once, in 1 MiB chunks
+    :return str: The file path
+    """
+    path = os.path.join(WORK_DIR, f"payload-{size}.bin")
+    if not os.path.exists(path):
+        block = os.urandom(min(size, UNITS["M"]))
+        with open(path, "wb") as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:size - offset])
+    return path
+
+
+def seed(rows, fanout):
+    """
+    Replaces the posts & comments used by the url cases. No files are written,
+    the urls are built from the file name columns.
+    """
+    BenchCommentModel.query.delete()
+    BenchPostModel.query.delete()
+    db.session.bulk_insert_mappings(BenchPostModel, [
+        {"id": i, "file_0__file_name": "file_0.bin", "file_0__mime_type": "application/octet-stream",
+         "file_0__ext": "bin"}
+        for i in range(1, rows + 1)
+    ])
+    db.session.bulk_insert_mappings(BenchCommentModel, [
+        {"post_id": i, "comment_image__file_name": "comment_image.png",
+         "comment_image__mime_type": "image/png", "comment_image__ext": "png"}
+        for i in range(1, rows + 1)
+        for _ in range(fanout)
+    ])
+    db.session.commit()
+
+
+def summarize(name, params, timings, amount, unit):
+    """
+    :param timings: The seconds each repeat took
+    :param amount: The bytes or rows handled by one repeat
+    :param unit: ``"MB/s"`` or ``"rows/s"``
+    :return dict:
+    """
+    median = statistics.median(timings)
+    return {
+        "name": name,
+        "params": params,
+        "repeat": len(timings),
+        "min_ms": min(timings) * 1000,
+        "median_ms": median * 1000,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "stdev_ms": statistics.stdev(timings) * 1000 if len(timings) > 1 else 0.0,
+        "throughput": amount / median / (1000 * 1000 if unit == "MB/s" else 1) if median else None,
+        "throughput_unit": unit,
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    rv = fn()
+    elapsed = time.perf_counter() - start
+    if rv.status_code >= 400:
+        raise RuntimeError(f"{request_line(rv)} answered {rv.status_code}: {rv.get_data(as_text=True)[:200]}")
+    return elapsed, rv
+
+
+def request_line(rv):
+    return f"{rv.request.method} {rv.request.path}"
+
+
+def bench_upload(client, size, files, repeat):
+    """
+    Runs the save, update, stream & delete requests ``repeat`` times after
+    one warm up round.
+    :return list: One result per method
+    """
+    path = create_payload(size)
+    timings = {"save_files": [], "update_files": [], "stream_file": [], "delete_files": []}
+
+    def data():
+        return {filename: (open(path, "rb"), f"{filename}.bin") for filename in FILENAMES[:files]}
+
+    def stream(post_id):
+        rv = client.get(f"/posts/{post_id}/file_0", buffered=False)
+        try:
+            received = sum(len(chunk) for chunk in rv.response)
+        finally:
+            rv.close()
+        if received != size:
+            raise RuntimeError(f"stream_file returned {received} of {size} bytes")
+        return rv
+
+    for i in range(repeat + 1):
+        elapsed = {}
+        elapsed["save_files"], rv = timed(lambda: client.post("/posts", data=data()))
+        post_id = rv.get_json()["id"]
+        elapsed["update_files"], _ = timed(lambda: client.put(f"/posts/{post_id}", data=data()))
+        elapsed["stream_file"], _ = timed(lambda: stream(post_id))
+        elapsed["delete_files"], _ = timed(lambda: client.delete(f"/posts/{post_id}?files={files}"))
+        if i:
+            for name, seconds in elapsed.items():
+                timings[name].append(seconds)
+
+    params = {"size": size, "files": files}
+    return [
+        summarize(name, params, seconds, size * (1 if name == "stream_file" else files), "MB/s")
+        for name, seconds in timings.items()
+    ]
+
+
+def bench_urls(client, rows, fanout, repeat):
+    """
+    :return list: One result for ``get_file_url`` per file & one for ``add_file_urls_to_models``
+    """
+    seed(rows, fanout)
+    results = []
+    for name in ("get_file_url", "add_file_urls_to_models"):
+        timings = []
+        for i in range(repeat + 1):
+            seconds, rv = timed(lambda: client.get(f"/urls/{name}?rows={rows}"))
+            if len(rv.get_json()["urls"]) != rows:
+                raise RuntimeError(f"{name} returned the urls of {len(rv.get_json()['urls'])} of {rows} rows")
+            if i:
+                timings.append(seconds)
+        results.append(summarize(name, {"rows": rows, "fanout": fanout}, timings, rows, "rows/s"))
+    return results
+
+
+def run(sizes, files, rows, fanout, repeat, log=print):
+    """
+    :return list: The result of each case
+    """
+    cases = []
+    for size in sizes:
+        cases.append(("upload", size, files[0]))
+    for count in files[1:]:
+        cases.append(("upload", sizes[0], count))
+    for count in rows:
+        cases.append(("urls", count, fanout[0]))
+    for count in fanout[1:]:
+        cases.append(("urls", rows[0], count))
+
+    results = []
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for kind, a, b in cases:
+            if kind == "upload":
+                case_results = bench_upload(client, a, b, repeat)
+            else:
+                case_results = bench_urls(client, a, b, repeat)
+            for result in case_results:
+                log(format_result(result))
+            results.extend(case_results)
+    return results
+
+
+def format_result(result):
+    params = " ".join(
+        f"{k}={format_size(v) if k == 'size' else v}" for k, v in result["params"].items()
+    )
+    return (f"{result['name']:<26}{params:<22}{result['median_ms']:10.2f} ms"
+            f"{result['throughput']:12.1f} {result['throughput_unit']}")
+
+
+def result_key(result):
+    return result["name"], tuple(sorted(result["params"].items()))
+
+
+def compare(results, baseline, max_regression):
+    """
+    :param results:
+    :param baseline: The ``results`` of an earlier run
+    :param max_regression: e.g. ``0.2`` fails a case more than 20% slower
+    :return list: A message for each case that regressed
+    """
+    baseline = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = baseline.get(result_key(result))
+        if not before or not before["median_ms"]:
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1
+        if change > max_regression:
+            regressions.append(
+                f"{format_result(result)} is {change:.0%} slower than {before['median_ms']:.2f} ms"
+            )
+    return regressions
+
+
+def environment():
+    try:
+        from importlib.metadata import version
+        ffu_version = version("flask-file-upload")
+    except Exception:
+        ffu_version = "unknown"
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "flask": flask.__version__,
+        "werkzeug": werkzeug.__version__,
+        "sqlalchemy": sqlalchemy.__version__,
+        "flask_file_upload": ffu_version,
+    }
+
+
+def parse_args(argv=None):
+    def ints(value):
+        return [int(v) for v in value.split(",")]
+
+    def sizes(value):
+        return [parse_size(v) for v in value.split(",")]
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_uploads", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=sizes, default=sizes(SIZES),
+                        help=f"File sizes, e.g. 1K,1M,1G (default {SIZES})")
+    parser.add_argument("--files", type=ints, default=ints(FILES),
+                        help=f"Files per request, at most {MAX_FILES} (default {FILES})")
+    parser.add_argument("--rows", type=ints, default=ints(ROWS),
+                        help=f"Rows per url request (default {ROWS})")
+    parser.add_argument("--fanout", type=ints, default=ints(FANOUT),
+                        help=f"Backref rows per row (default {FANOUT})")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help=f"Timed runs per case (default {REPEAT})")
+    parser.add_argument("--json", metavar="PATH", help="Write the results to PATH, - for stdout")
+    parser.add_argument("--compare", metavar="PATH", help="A --json file to compare the results against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="The slowdown of a median that fails --compare (default 0.2)")
+    args = parser.parse_args(argv)
+    if max(args.files) > MAX_FILES:
+        parser.error(f"--files can not be larger than {MAX_FILES}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log = print if args.json != "-" else (lambda line: print(line, file=sys.stderr))
+    try:
+        results = run(args.sizes, args.files, args.rows, args.fanout, args.repeat, log)
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    output = {"environment": environment(), "repeat": args.repeat, "results": results}
+    if args.json == "-":
+        json.dump(output, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.max_regression)
+        for message in regressions:
+            log(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+    Flask CLI commands, registered by ``FileUpload.init_app``
+    under ``flask file-upload``
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from .layout import get_layout, migrate_layout
+from .storage import LocalStorage, directory_cache
+
+
+file_upload_cli = AppGroup("file-upload", help="Flask-File-Upload commands.")
+
+
+@file_upload_cli.command("migrate-layout")
+@click.option("--source", default="flat", show_default=True, help="The layout the files are stored in now.")
+@click.option("--target", default=None, help="The layout to move the files to. Defaults to FILE_UPLOAD_LAYOUT.")
+def migrate_layout_command(source, target):
+    """Moves the files in UPLOAD_FOLDER to a new directory layout.
+    If the command is stopped, run it again to carry on where it stopped."""
+    config = current_app.extensions["file_upload"]["config"]
+    if not isinstance(config.storage, LocalStorage):
+        raise click.ClickException("Flask-File-Upload: migrate-layout only supports LocalStorage")
+    try:
+        source_layout = get_layout(source)
+        target_layout = get_layout(target) if target else config.layout
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+    def progress(done, total, prefix):
+        if done % 1000 == 0 or done == total:
+            click.echo(f"{done}/{total} directories migrated")
+
+    moved = migrate_layout(config.storage.root, source_layout, target_layout, progress)
+    # The source directories were moved or removed
+    directory_cache.discard(config.storage.root)
+    click.echo(f"Moved {moved} directories to the {target_layout.name} layout")
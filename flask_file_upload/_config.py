@@ -1,6 +1,21 @@
-from typing import List
+from typing import List, Any, FrozenSet
 from warnings import warn
 
+from .layout import FlatLayout, get_layout
+from ._model_utils import compile_extensions
+
+
+#: The header set by ``stream_file`` for each ``FILE_UPLOAD_SENDFILE`` server
+SENDFILE_HEADERS = {
+    "nginx": "X-Accel-Redirect",
+    "apache": "X-Sendfile",
+    "lighttpd": "X-Sendfile",
+    "litespeed": "X-LiteSpeed-Location",
+}
+
+#: The servers whose header takes an internal uri rather than a file path,
+#: so ``FILE_UPLOAD_SENDFILE_PREFIX`` must be set
+SENDFILE_URI_SERVERS = ("nginx", "litespeed")
 
 class Config:
 
@@ -8,20 +23,140 @@ class Config:
 
     server_name: str = ""
 
-    allowed_extensions: List = []
+    _allowed_extensions: List = []
+
+    #: ``allowed_extensions`` compiled to lower case extensions without a dot
+    allowed_extension_set: FrozenSet[str] = frozenset()
 
     max_content_length: int = 0
 
+    #: If set to True, file parts are written straight into a staging
+    #: directory inside ``upload_folder`` while the request is parsed.
+    stream_uploads: bool = False
+
+    #: The directory streamed file parts are staged in. Defaults to
+    #: ``<upload_folder>/.staging``. It should be on the same filesystem as
+    #: ``upload_folder`` so files are saved with a rename. Setting it turns
+    #: ``stream_uploads`` on.
+    staging_folder: str = None
+
+    #: Streamed file parts up to this many bytes are kept in memory & only
+    #: written to ``staging_folder`` once they grow past it.
+    spool_threshold: int = 0
+
+    #: The number of threads used to write the files of a single
+    #: ``save_files``, ``add_files`` or ``update_files`` call concurrently.
+    #: Files are written one after another if this is not greater than 1.
+    max_workers: int = 0
+
+    #: The size of the thread pool the ``async_`` methods of ``FileUpload``
+    #: run their blocking filesystem work on.
+    async_max_workers: int = 4
+
+    #: The number of models ``save_files_bulk`` flushes & commits at a time.
+    bulk_batch_size: int = 1000
+
+    #: The storage backend files are written to & read from.
+    #: Defaults to :class:`~flask_file_upload.storage.LocalStorage`
+    storage: Any = None
+
+    #: The directory layout files are stored in.
+    #: See :class:`~flask_file_upload.layout`
+    layout: FlatLayout = FlatLayout()
+
+    #: If set to True, ``LocalStorage`` keeps one copy of each distinct file
+    #: & hardlinks it into every model directory it is saved to.
+    deduplicate: bool = False
+
+    #: When files written by ``LocalStorage`` are flushed to disk. One of
+    #: ``"none"`` (default), ``"file"`` or ``"full"``.
+    #: See :data:`~flask_file_upload.storage.FSYNC_POLICIES`
+    fsync: str = "none"
+
+    #: If set, ``stream_file`` returns an empty response with the header in
+    #: :data:`SENDFILE_HEADERS` & the front end server sends the file.
+    sendfile: str = None
+
+    #: The internal location the front end server serves ``UPLOAD_FOLDER``
+    #: from, e.g. ``"/protected"``. Required by nginx & LiteSpeed. If not set,
+    #: the absolute file path is sent, which only Apache & lighttpd accept.
+    sendfile_prefix: str = None
+
+    #: If set to True, ``get_file_url`` adds a ``?v=`` token to each url taken
+    #: from the file's digest or upload time column.
+    versioned_urls: bool = False
+
+    #: If set to True, multipart requests are checked while they are parsed &
+    #: answered with a 413 or 415 as soon as the request is over
+    #: ``max_content_length`` or a file part has a disallowed extension or is
+    #: over its Column's ``max_size``. The checks are looked up by form field
+    #: name, so they apply to every endpoint posting a Column's name & file
+    #: parts with any other name are only limited by ``max_content_length``.
+    #: Needs Werkzeug 2.0's form parser, ``init_app`` raises a ``RuntimeError`` otherwise.
+    reject_early: bool = False
+
+    #: If set to True, the mime type & extension stored for a file are sniffed
+    #: from its first bytes & files whose real type is not allowed are not saved.
+    #: See :class:`~flask_file_upload.sniff`
+    sniff_mime_types: bool = False
+
+    #: The scheme, host & optional path file urls start with, e.g.
+    #: ``"https://cdn.example.com"``. If set, urls are built from it with string
+    #: operations only, inside or outside of a request. Outside of a request
+    #: ``SERVER_NAME`` is used if this is not set.
+    base_url: str = None
+
+    @property
+    def allowed_extensions(self) -> List[str]:
+        return self._allowed_extensions
+
+    @allowed_extensions.setter
+    def allowed_extensions(self, extensions: List[str]) -> None:
+        self._allowed_extensions = extensions
+        self.allowed_extension_set = compile_extensions(extensions)
+
     def init_config(self, app, **kwargs):
         upload_folder = kwargs.get("upload_folder")
         allowed_extensions = kwargs.get("allowed_extensions")
         max_content_length = kwargs.get("max_content_length")
         sqlalchemy_database_uri = kwargs.get("sqlalchemy_database_uri")
+        stream_uploads = kwargs.get("stream_uploads")
+        staging_folder = kwargs.get("staging_folder")
+        spool_threshold = kwargs.get("spool_threshold")
+        max_workers = kwargs.get("max_workers")
+        async_max_workers = kwargs.get("async_max_workers")
+        bulk_batch_size = kwargs.get("bulk_batch_size")
+        storage = kwargs.get("storage")
+        layout = kwargs.get("layout")
+        deduplicate = kwargs.get("deduplicate")
+        fsync = kwargs.get("fsync")
+        sendfile = kwargs.get("sendfile")
+        sendfile_prefix = kwargs.get("sendfile_prefix")
+        versioned_urls = kwargs.get("versioned_urls")
+        base_url = kwargs.get("base_url")
+        reject_early = kwargs.get("reject_early")
+        sniff_mime_types = kwargs.get("sniff_mime_types")
 
         app.config["UPLOAD_FOLDER"] = upload_folder or app.config.get("UPLOAD_FOLDER")
         app.config["ALLOWED_EXTENSIONS"] = allowed_extensions or app.config.get("ALLOWED_EXTENSIONS")
         app.config["MAX_CONTENT_LENGTH"] = max_content_length or app.config.get("MAX_CONTENT_LENGTH")
         app.config["SQLALCHEMY_DATABASE_URI"] = sqlalchemy_database_uri or app.config.get("SQLALCHEMY_DATABASE_URI")
+        app.config["FILE_UPLOAD_STREAM_UPLOADS"] = stream_uploads or app.config.get("FILE_UPLOAD_STREAM_UPLOADS")
+        app.config["FILE_UPLOAD_STAGING_FOLDER"] = staging_folder or app.config.get("FILE_UPLOAD_STAGING_FOLDER")
+        app.config["FILE_UPLOAD_SPOOL_THRESHOLD"] = spool_threshold or app.config.get("FILE_UPLOAD_SPOOL_THRESHOLD")
+        app.config["FILE_UPLOAD_MAX_WORKERS"] = max_workers or app.config.get("FILE_UPLOAD_MAX_WORKERS")
+        app.config["FILE_UPLOAD_ASYNC_MAX_WORKERS"] = async_max_workers or app.config.get("FILE_UPLOAD_ASYNC_MAX_WORKERS")
+        app.config["FILE_UPLOAD_BULK_BATCH_SIZE"] = bulk_batch_size or app.config.get("FILE_UPLOAD_BULK_BATCH_SIZE")
+        app.config["FILE_UPLOAD_STORAGE"] = storage or app.config.get("FILE_UPLOAD_STORAGE")
+        app.config["FILE_UPLOAD_LAYOUT"] = layout or app.config.get("FILE_UPLOAD_LAYOUT")
+        app.config["FILE_UPLOAD_DEDUPLICATE"] = deduplicate or app.config.get("FILE_UPLOAD_DEDUPLICATE")
+        app.config["FILE_UPLOAD_FSYNC"] = fsync or app.config.get("FILE_UPLOAD_FSYNC")
+        app.config["FILE_UPLOAD_SENDFILE"] = sendfile or app.config.get("FILE_UPLOAD_SENDFILE")
+        app.config["FILE_UPLOAD_SENDFILE_PREFIX"] = sendfile_prefix or app.config.get("FILE_UPLOAD_SENDFILE_PREFIX")
+        app.config["FILE_UPLOAD_VERSIONED_URLS"] = versioned_urls or app.config.get("FILE_UPLOAD_VERSIONED_URLS")
+        app.config["FILE_UPLOAD_BASE_URL"] = base_url or app.config.get("FILE_UPLOAD_BASE_URL")
+        app.config["FILE_UPLOAD_REJECT_EARLY"] = reject_early or app.config.get("FILE_UPLOAD_REJECT_EARLY")
+        app.config["FILE_UPLOAD_SNIFF_MIME_TYPES"] = sniff_mime_types or app.config.get("FILE_UPLOAD_SNIFF_MIME_TYPES")
 
         self.server_name = app.config["SERVER_NAME"]
         try:
@@ -35,3 +170,31 @@ class Config:
             warn("Flask-File-Uploads: ALLOWED_EXTENSIONS is not set."
                  f"Defaulting to: {self.allowed_extensions}")
         self.max_content_length = app.config.get("MAX_CONTENT_LENGTH")
+        self.staging_folder = app.config.get("FILE_UPLOAD_STAGING_FOLDER")
+        self.spool_threshold = app.config.get("FILE_UPLOAD_SPOOL_THRESHOLD") or 0
+        self.stream_uploads = bool(app.config.get("FILE_UPLOAD_STREAM_UPLOADS") or self.staging_folder)
+        self.max_workers = app.config.get("FILE_UPLOAD_MAX_WORKERS") or 0
+        self.async_max_workers = app.config.get("FILE_UPLOAD_ASYNC_MAX_WORKERS") or 4
+        self.bulk_batch_size = app.config.get("FILE_UPLOAD_BULK_BATCH_SIZE") or 1000
+        self.deduplicate = bool(app.config.get("FILE_UPLOAD_DEDUPLICATE"))
+        # Imported here as the storage module depends on this module
+        from .storage import LocalStorage, FSYNC_POLICIES
+        self.fsync = app.config.get("FILE_UPLOAD_FSYNC") or "none"
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Flask-File-Upload: FILE_UPLOAD_FSYNC must be one of {FSYNC_POLICIES}")
+        self.sendfile = app.config.get("FILE_UPLOAD_SENDFILE")
+        if self.sendfile and self.sendfile not in SENDFILE_HEADERS:
+            raise ValueError(f"Flask-File-Upload: FILE_UPLOAD_SENDFILE must be one of {list(SENDFILE_HEADERS)}")
+        self.sendfile_prefix = app.config.get("FILE_UPLOAD_SENDFILE_PREFIX")
+        if self.sendfile in SENDFILE_URI_SERVERS and not self.sendfile_prefix:
+            raise ValueError(
+                f"Flask-File-Upload: FILE_UPLOAD_SENDFILE = '{self.sendfile}' needs FILE_UPLOAD_SENDFILE_PREFIX, "
+                "the internal location UPLOAD_FOLDER is served from"
+            )
+        self.versioned_urls = bool(app.config.get("FILE_UPLOAD_VERSIONED_URLS"))
+        self.base_url = app.config.get("FILE_UPLOAD_BASE_URL")
+        self.reject_early = bool(app.config.get("FILE_UPLOAD_REJECT_EARLY"))
+        self.sniff_mime_types = bool(app.config.get("FILE_UPLOAD_SNIFF_MIME_TYPES"))
+        self.storage = app.config.get("FILE_UPLOAD_STORAGE") or LocalStorage()
+        self.storage.init_config(self)
+        self.layout = get_layout(app.config.get("FILE_UPLOAD_LAYOUT"))
@@ -10,3 +10,13 @@ class FlaskInstanceOrSqlalchemyIsNone(Exception):
 
     def __init__(self, err=""):
         super(FlaskInstanceOrSqlalchemyIsNone, self).__init__(f"{err}\n{self.message}")
+
+
+class SaveFilesError(Exception):
+    message = "Flask-File-Upload: One or more files could not be saved. " \
+              "The files already written by this call have been removed."
+
+    def __init__(self, errors=None):
+        #: A dict of the filenames that failed to save & their exception
+        self.errors = errors or {}
+        super(SaveFilesError, self).__init__(f"{self.message} Errors: {self.errors}")
@@ -0,0 +1,207 @@
+"""
+    Early rejection - the multipart body is checked while Werkzeug parses it.
+    A request that is too large, or a file part breaking the ``allowed_extensions``,
+    ``allowed_mime_types`` or ``max_size`` of its Column, is answered with a 413 or 415 as soon
+    as it is seen, without reading (or spooling) the rest of the body. With
+    ``sniff_mime_types`` a part's real type is also checked once its first
+    bytes have arrived.
+
+    The rules are looked up by form field name only, from every decorated model.
+    A Column's rules apply to every endpoint posting a field with its name. File
+    parts whose name is not a Column of any model are only limited by
+    ``max_content_length``, so other upload endpoints of the app are not affected.
+
+    This overrides parts of Werkzeug 2.0's form parser that are not public
+    (``FormDataParser.parse_functions`` & ``_parse_multipart`` and the
+    ``MultiPartParser(stream_factory, charset, errors, ...)`` signature), see
+    :func:`check_werkzeug`.
+"""
+import inspect
+from typing import Any, Dict, Tuple
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.formparser import FormDataParser, MultiPartParser
+
+from ._config import Config
+from ._model_utils import _ModelUtils, _FileRules, NO_RULES
+from .file_utils import FileUtils
+from .sniff import SNIFF_LENGTH, sniff, resolve
+
+
+class _LimitedFile:
+    """
+    Wraps the file a part is written to & raises a 413 once more than
+    ``max_size`` bytes (or more than the request's ``max_content_length``)
+    have been written. The wrapped file is closed, so a staged file is removed.
+    If ``filename`` is set, the first :data:`~flask_file_upload.sniff.SNIFF_LENGTH`
+    bytes are kept & the part is rejected with a 415 if its real type is not allowed.
+    """
+
+    def __init__(self, file: Any, parser: "_UploadMultiPartParser", rules: _FileRules = NO_RULES,
+                 filename: str = None):
+        self.file = file
+        self.parser = parser
+        self.rules = rules
+        self.max_size = rules.max_size
+        self.size = 0
+        self.filename = filename
+        self.head = b""
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.file, name)
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        self.parser.total_size += len(data)
+        if self.max_size and self.size > self.max_size:
+            self.file.close()
+            raise RequestEntityTooLarge(f"Flask-File-Upload: The file is larger than {self.max_size} bytes")
+        if self.parser.max_content_length and self.parser.total_size > self.parser.max_content_length:
+            self.file.close()
+            raise RequestEntityTooLarge()
+        if self.filename:
+            self.head += data[:SNIFF_LENGTH - len(self.head)]
+            if len(self.head) >= SNIFF_LENGTH:
+                self.check_type()
+        return self.file.write(data)
+
+    def check_type(self) -> None:
+        """
+        :return None:
+        """
+        filename, self.filename = self.filename, None
+        signature = sniff(self.head)
+        if not signature:
+            return
+        mime_type, ext = resolve(signature, filename)
+        if not self.rules.allows_extension(ext, self.parser.config.allowed_extension_set) \
+                or not self.rules.allows_mime_type(mime_type):
+            self.file.close()
+            raise UnsupportedMediaType(f"Flask-File-Upload: {filename} is a {mime_type} file")
+
+
+class _UploadMultiPartParser(MultiPartParser):
+
+    def __init__(self, *args, config: Config = None, max_content_length: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config = config
+        self.max_content_length = max_content_length
+        #: The bytes written to all file parts so far, so bodies sent without
+        #: a ``Content-Length`` are limited too
+        self.total_size = 0
+        #: Every part's file, closed if the request is rejected
+        self.files = []
+
+    def start_file_streaming(self, event: Any, total_content_length: int) -> Any:
+        """
+        Called with each file part's headers before any of its content is read.
+        :param event: Werkzeug's ``File`` event
+        :param total_content_length:
+        :return: The file the part's content is written to
+        """
+        rules = _ModelUtils.file_rules.get(event.name)
+        if rules is None:
+            file = _LimitedFile(super().start_file_streaming(event, total_content_length), self)
+            self.files.append(file)
+            return file
+        if event.filename and not FileUtils.allowed_file(event.filename, self.config, rules):
+            raise UnsupportedMediaType(f"Flask-File-Upload: {event.filename} is not an allowed file type")
+        content_type = event.headers.get("content-type")
+        if event.filename and not rules.allows_mime_type(content_type):
+            raise UnsupportedMediaType(f"Flask-File-Upload: {content_type} is not an allowed file type")
+        max_size = rules.max_size
+        try:
+            content_length = int(event.headers["content-length"])
+        except (KeyError, ValueError):
+            content_length = 0
+        if max_size and content_length > max_size:
+            raise RequestEntityTooLarge(f"Flask-File-Upload: The file is larger than {max_size} bytes")
+        filename = event.filename if self.config.sniff_mime_types else None
+        file = _LimitedFile(super().start_file_streaming(event, total_content_length), self, rules, filename)
+        self.files.append(file)
+        return file
+
+    def parse(self, stream: Any, boundary: bytes, content_length: int) -> Tuple[MultiDict, MultiDict]:
+        try:
+            form, files = super().parse(stream, boundary, content_length)
+            for file in self.files:
+                if file.filename:
+                    # Parts shorter than the sniffed length
+                    file.check_type()
+        except HTTPException:
+            # The parts already read are never handed to the request
+            for file in self.files:
+                file.file.close()
+            raise
+        for _, file in files.items(multi=True):
+            if isinstance(file.stream, _LimitedFile):
+                file.stream = file.stream.file
+        return form, files
+
+
+def create_form_data_parser_class(config: Config) -> Any:
+    #: We pass the config instance here so the checks always follow the
+    #: ``allowed_extensions`` set by ``init_app``.
+    class UploadFormDataParser(FormDataParser):
+
+        def parse(self, stream: Any, mimetype: str, content_length: int, options: Dict[str, str] = None) -> Any:
+            """
+            Werkzeug reads the whole body before raising a 413 for a request
+            over ``max_content_length``. It is raised straight away here.
+            """
+            if self.max_content_length is not None and content_length is not None \
+                    and content_length > self.max_content_length:
+                raise RequestEntityTooLarge()
+            return super().parse(stream, mimetype, content_length, options)
+
+        def _parse_multipart(self, stream: Any, mimetype: str, content_length: int, options: Dict[str, str]) -> Any:
+            parser = _UploadMultiPartParser(
+                self.stream_factory,
+                self.charset,
+                self.errors,
+                max_form_memory_size=self.max_form_memory_size,
+                cls=self.cls,
+                config=config,
+                max_content_length=self.max_content_length,
+            )
+            boundary = options.get("boundary", "").encode("ascii")
+            if not boundary:
+                raise ValueError("Missing boundary")
+            form, files = parser.parse(stream, boundary, content_length)
+            return stream, form, files
+
+        parse_functions = {**FormDataParser.parse_functions, "multipart/form-data": _parse_multipart}
+
+    return UploadFormDataParser
+
+
+def check_werkzeug() -> None:
+    """
+    Checks the Werkzeug form parser internals overridden here are still there.
+    :return None:
+    """
+    try:
+        parameters = inspect.signature(MultiPartParser.__init__).parameters
+    except (TypeError, ValueError):
+        parameters = {}
+    if not isinstance(FormDataParser.__dict__.get("parse_functions"), dict) \
+            or not hasattr(FormDataParser, "_parse_multipart") \
+            or not hasattr(MultiPartParser, "start_file_streaming") \
+            or list(parameters)[1:4] != ["stream_factory", "charset", "errors"]:
+        raise RuntimeError(
+            "Flask-File-Upload: FILE_UPLOAD_REJECT_EARLY needs the form parser of Werkzeug 2.0, "
+            "which is not the installed version"
+        )
+
+
+def create_reject_early_request_class(base: Any, config: Config) -> Any:
+    check_werkzeug()
+
+    class RejectEarlyRequest(base):
+
+        _file_upload_reject_early = True
+
+        form_data_parser_class = create_form_data_parser_class(config)
+
+    return RejectEarlyRequest
@@ -2,7 +2,7 @@
     Behaviours required by Model class _so we can keep SqlAlchemy Model
     free of methods & other members.
 """
-from typing import List, Any, Dict, Tuple, ClassVar, Callable
+from typing import List, Any, Dict, Tuple, ClassVar, Callable, Set, FrozenSet, NamedTuple, Optional, Iterable
 import inspect
 from warnings import warn
 from enum import Enum
@@ -17,12 +17,111 @@ class _ColumnSuffix(Enum):
     FILE_NAME = "file_name"
 
 
+def compile_extensions(extensions: Iterable[str]) -> FrozenSet[str]:
+    """
+    :param extensions: e.g. ``["jpg", ".PNG"]``
+    :return FrozenSet[str]: The lower case extensions without a leading dot
+    """
+    return frozenset(e.lower().lstrip(".") for e in extensions or ())
+
+
+class _FileRules(NamedTuple):
+    """
+    The upload rules of a Column, compiled when the model is decorated.
+    A ``None`` value means the rule is not set.
+    """
+    extensions: Optional[FrozenSet[str]] = None
+    mime_types: Optional[FrozenSet[str]] = None
+    max_size: Optional[int] = None
+    #: Set when rules with & without ``extensions`` are merged, so
+    #: ``ALLOWED_EXTENSIONS`` is accepted as well as ``extensions``
+    default_extensions: bool = False
+
+    def allows_extension(self, ext: str, default: FrozenSet[str]) -> bool:
+        """
+        :param ext: A lower case extension
+        :param default: The compiled ``ALLOWED_EXTENSIONS``
+        :return bool:
+        """
+        if self.extensions is None:
+            return ext in default
+        return ext in self.extensions or (self.default_extensions and ext in default)
+
+    def allows_mime_type(self, mime_type: Optional[str]) -> bool:
+        """
+        :param mime_type: e.g. ``"image/png"``. Parameters are ignored
+        :return bool:
+        """
+        if self.mime_types is None:
+            return True
+        mime_type = (mime_type or "").split(";", 1)[0].strip().lower()
+        return mime_type in self.mime_types or f"{mime_type.split('/', 1)[0]}/*" in self.mime_types
+
+    @staticmethod
+    def compile(column: Column) -> "_FileRules":
+        """
+        :param column:
+        :return _FileRules:
+        """
+        return _FileRules(
+            extensions=None if column.allowed_extensions is None else compile_extensions(column.allowed_extensions),
+            mime_types=None if column.allowed_mime_types is None else frozenset(
+                m.lower() for m in column.allowed_mime_types
+            ),
+            max_size=column.max_size,
+        )
+
+    def merge(self, other: "_FileRules") -> "_FileRules":
+        """
+        The rules accepting every file either rule accepts. ``ALLOWED_EXTENSIONS``
+        is only compiled by ``init_app``, so rules without ``extensions`` are kept
+        as :attr:`default_extensions`.
+        :param other:
+        :return _FileRules:
+        """
+        def union(a, b):
+            return None if a is None or b is None else a | b
+        if self.extensions is None or other.extensions is None:
+            extensions = self.extensions if other.extensions is None else other.extensions
+            default_extensions = extensions is not None
+        else:
+            extensions = self.extensions | other.extensions
+            default_extensions = self.default_extensions or other.default_extensions
+        return _FileRules(
+            extensions=extensions,
+            mime_types=union(self.mime_types, other.mime_types),
+            max_size=None if not self.max_size or not other.max_size else max(self.max_size, other.max_size),
+            default_extensions=default_extensions,
+        )
+
+
+#: The rules of a Column that sets none
+NO_RULES = _FileRules()
+
+
 class _ModelUtils:
 
     column_suffix = _ColumnSuffix
 
     keys = [e.value for e in _ColumnSuffix]
 
+    #: The suffix of the optional file size column, see :class:`~flask_file_upload.column.Column`
+    size_key = "size"
+
+    #: The suffix of the optional upload time column
+    uploaded_at_key = "uploaded_at"
+
+    #: The digest algorithms used by any decorated model's columns. Streamed
+    #: uploads compute these while the file is staged.
+    digests: Set[str] = set()
+
+    #: The rules of each file attribute name, used to check file parts while the
+    #: request is parsed. If models share a name, a part any of them accepts is accepted.
+    file_rules: Dict[str, _FileRules] = {}
+
+    #: The primary key name of each model class, see ``get_primary_key``
+    _primary_keys: Dict[Any, str] = {}
+
     sqlalchemy_attr: List[str] = [
         '__table__',
         '__tablename__',
@@ -54,16 +153,24 @@ class _ModelUtils:
     def get_primary_key(model):
         """
         This will always target the first primary key in
-        the list (in case there are multiple being used)
-        :param model:
+        the list (in case there are multiple being used).
+        The name is cached per model class.
+        :param model: A SqlAlchemy model instance or class
         :return str:
         """
+        model_class = model if isinstance(model, type) else type(model)
+        try:
+            return _ModelUtils._primary_keys[model_class]
+        except KeyError:
+            pass
         try:
-            return model.__mapper__.primary_key[0].name
+            primary_key = model.__mapper__.primary_key[0].name
         except AttributeError as err:
             raise AttributeError("[FLASK_FILE_UPLOADS_ERROR] You must pass a model instance"
                                  f"to the save_file method. Full error: {err}"
                                  )
+        _ModelUtils._primary_keys[model_class] = primary_key
+        return primary_key
 
     @staticmethod
     def get_table_name(model: Any) -> str:
@@ -82,12 +189,13 @@ class _ModelUtils:
         return getattr(model, _ModelUtils.get_primary_key(model), None)
 
     @staticmethod
-    def columns_dict(file_name: str, db) -> Dict[str, Any]:
+    def columns_dict(file_name: str, db, column: Column = None) -> Dict[str, Any]:
         """
         We must define the SqlAlchemy Column object with key & name kwargs
         otherwise sqlAlchemy will define these incorrectly if they are set to None
         :param file_name:
         :param db:
+        :param column: Adds the optional size & digest columns it declares
         :return Dict[str, Any]:
         """
         def create_col(key, name):
@@ -101,11 +209,20 @@ class _ModelUtils:
                 return db.Column(db.String(str_len), key=key, name=name)
             except AttributeError as err:
                 raise FlaskInstanceOrSqlalchemyIsNone(err)
-        return _ModelUtils.create_keys(
+        col_dict = _ModelUtils.create_keys(
             _ModelUtils.keys,
             file_name,
             create_col
         )
+        if column and column.size:
+            key = _ModelUtils.add_postfix(file_name, _ModelUtils.size_key)
+            col_dict[key] = db.Column(db.BigInteger, key=key, name=key)
+        if column and column.digest:
+            col_dict.update(_ModelUtils.create_keys((column.digest,), file_name, create_col))
+        if column and column.timestamp:
+            key = _ModelUtils.add_postfix(file_name, _ModelUtils.uploaded_at_key)
+            col_dict[key] = db.Column(db.DateTime, key=key, name=key)
+        return col_dict
 
     @staticmethod
     def set_columns(wrapped: ClassVar, new_cols: Tuple[Dict[str, Any]]) -> None:
@@ -137,10 +254,66 @@ class _ModelUtils:
         """
         for attr, value in wrapped.__dict__.items():
             if isinstance(value, Column):
-                new_cols.append(_ModelUtils.columns_dict(attr, db))
+                new_cols.append(_ModelUtils.columns_dict(attr, db, value))
                 file_names.append(str(attr))
         return new_cols, file_names
 
+    @staticmethod
+    def set_file_columns(wrapped: ClassVar, filenames: List[str]) -> None:
+        """
+        Keeps the Column declarations on the model class as
+        ``__file_upload_columns__`` before they are removed
+        :param wrapped:
+        :param filenames:
+        :return None:
+        """
+        if not filenames:
+            return
+        columns = {f: wrapped.__dict__[f] for f in filenames}
+        setattr(wrapped, "__file_upload_columns__", columns)
+        _ModelUtils.digests.update(c.digest for c in columns.values() if c.digest)
+        rules = {f: _FileRules.compile(c) for f, c in columns.items()}
+        setattr(wrapped, "__file_upload_rules__", rules)
+        for filename, file_rules in rules.items():
+            if filename in _ModelUtils.file_rules:
+                file_rules = file_rules.merge(_ModelUtils.file_rules[filename])
+            _ModelUtils.file_rules[filename] = file_rules
+
+    @staticmethod
+    def get_file_columns(model: Any) -> Dict[str, Column]:
+        """
+        :param model: A decorated SqlAlchemy model class or instance
+        :return Dict[str, Column]: The Column declared for each file attribute
+        """
+        return getattr(model, "__file_upload_columns__", None) or {}
+
+    @staticmethod
+    def get_file_rules(model: Any, filename: str) -> _FileRules:
+        """
+        :param model: A decorated SqlAlchemy model class or instance, or None
+        :param filename: The file attribute name
+        :return _FileRules: The Column's rules, or the rules of every model
+            declaring ``filename`` if ``model`` is None
+        """
+        if model is None:
+            return _ModelUtils.file_rules.get(filename, NO_RULES)
+        return (getattr(model, "__file_upload_rules__", None) or {}).get(filename, NO_RULES)
+
+    @staticmethod
+    def get_metadata_keys(column: Column) -> List[str]:
+        """
+        :param column:
+        :return List[str]: The suffixes of the optional size, digest & upload time columns
+        """
+        keys = []
+        if column and column.size:
+            keys.append(_ModelUtils.size_key)
+        if column and column.digest:
+            keys.append(column.digest)
+        if column and column.timestamp:
+            keys.append(_ModelUtils.uploaded_at_key)
+        return keys
+
     @staticmethod
     def add_postfix(filename: str, postfix: str) -> str:
         """
@@ -150,6 +323,26 @@ class _ModelUtils:
         """
         return f"{filename}__{postfix}"
 
+    @staticmethod
+    def get_url_key(filename: str) -> str:
+        """
+        :param filename:
+        :return str: The name of the attribute holding the file's url
+        """
+        return f"{filename}_url"
+
+    @staticmethod
+    def clear_file_url(model: Any, filename: str) -> None:
+        """
+        Removes the url kept on the model instance, so the next read of
+        ``<filename>_url`` builds it again from the new file
+        :param model:
+        :param filename:
+        :return None:
+        """
+        if not isinstance(model, type):
+            model.__dict__.pop(_ModelUtils.get_url_key(filename), None)
+
     @staticmethod
     def get_original_file_name(filename: str, model: Any) -> str:
         """
@@ -0,0 +1,239 @@
+"""
+    Streaming uploads - Werkzeug writes each multipart file part straight into
+    a staging directory inside ``UPLOAD_FOLDER`` (or ``FILE_UPLOAD_STAGING_FOLDER``,
+    which should be on the same filesystem), so saving the file later on is a
+    rename rather than a second full copy.
+"""
+import io
+import os
+import shutil
+import hashlib
+import secrets
+from typing import Any, Dict, Iterable, Tuple
+
+from werkzeug.datastructures import FileStorage
+
+from ._config import Config
+from ._model_utils import _ModelUtils
+
+
+#: The staging directory name, created inside ``UPLOAD_FOLDER``
+STAGING_FOLDER = ".staging"
+
+
+def mkstemp(dir: str, prefix: str = "", suffix: str = "") -> Tuple[int, str]:
+    """
+    Like ``tempfile.mkstemp``, except the file is created with the permissions
+    ``open()`` would give it (0666 less the umask) rather than 0600, so it can
+    be published with a rename & no ``chmod``.
+    :param dir:
+    :param prefix:
+    :param suffix:
+    :return Tuple[int, str]: An open file descriptor & the absolute path of the file
+    """
+    flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0) | getattr(os, "O_NOFOLLOW", 0)
+    dir = os.path.abspath(dir)
+    while True:
+        path = os.path.join(dir, f"{prefix}{secrets.token_hex(8)}{suffix}")
+        try:
+            return os.open(path, flags, 0o666), path
+        except FileExistsError:
+            continue
+
+
+def get_staging_folder(config: Config) -> str:
+    """
+    :param config:
+    :return str:
+    """
+    return config.staging_folder or os.path.join(config.upload_folder, STAGING_FOLDER)
+
+
+class _StagingFile:
+    """
+    A readable & writable file object backed by a named file in the staging
+    directory. Werkzeug writes the part to it in chunks as the request body
+    is read, so memory use stays flat regardless of the file size.
+    Parts up to ``spool_threshold`` bytes are kept in memory & only written to
+    the staging directory once they grow past it.
+    If the file is never published, it is removed when the request closes
+    its files. The content is hashed with ``digests`` as it is written, so a
+    digest column or a content addressed backend never has to read the file again.
+    """
+
+    def __init__(self, staging_folder: str, digests: Iterable[str] = (), spool_threshold: int = 0):
+        self.staging_folder = staging_folder
+        self.spool_threshold = spool_threshold or 0
+        self._hashes = {d: hashlib.new(d) for d in set(digests)}
+        self.size = 0
+        self.published = False
+        #: The path of the staged file, None while the part is kept in memory
+        self.name = None
+        self._file = io.BytesIO()
+        if not self.spool_threshold:
+            self._rollover()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    @property
+    def on_disk(self) -> bool:
+        return self.name is not None
+
+    def _rollover(self) -> None:
+        """
+        Moves the content kept in memory to a file in the staging directory
+        :return None:
+        """
+        os.makedirs(self.staging_folder, exist_ok=True)
+        fd, self.name = mkstemp(self.staging_folder, suffix=".part")
+        staged = os.fdopen(fd, "w+b")
+        staged.write(self._file.getvalue())
+        staged.seek(self._file.tell())
+        self._file = staged
+
+    def write(self, data: bytes) -> int:
+        for content_hash in self._hashes.values():
+            content_hash.update(data)
+        self.size += len(data)
+        if not self.on_disk and self.size > self.spool_threshold:
+            self._rollover()
+        return self._file.write(data)
+
+    def hexdigest(self, digest: str = "sha256") -> str:
+        """
+        :param digest: A ``hashlib`` algorithm name
+        :return str: The hex digest of everything written so far
+        """
+        if digest not in self._hashes:
+            # The algorithm was not known when the file was staged
+            content_hash = hashlib.new(digest)
+            if self.on_disk:
+                self._file.flush()
+                with open(self.name, "rb") as f:
+                    for chunk in iter(lambda: f.read(64 * 1024), b""):
+                        content_hash.update(chunk)
+            else:
+                content_hash.update(self._file.getvalue())
+            self._hashes[digest] = content_hash
+        return self._hashes[digest].hexdigest()
+
+    def publish(self, file_path: str) -> None:
+        """
+        Moves the staged file to its final path. If the file has already
+        been published (the same file saved twice) it is hardlinked, or
+        copied if ``file_path`` is on another filesystem.
+        :param file_path:
+        :return None:
+        """
+        if not self.on_disk:
+            self._rollover()
+        self._file.flush()
+        if self.published:
+            tmp_path = os.path.join(os.path.dirname(file_path), f".{os.path.basename(self.name)}.tmp")
+            try:
+                os.link(self.name, tmp_path)
+            except OSError:
+                shutil.copyfile(self.name, tmp_path)
+            os.replace(tmp_path, file_path)
+            return
+        os.replace(self.name, file_path)
+        self.name = file_path
+        self.published = True
+
+    def close(self) -> None:
+        self._file.close()
+        if self.on_disk and not self.published:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+
+def create_request_class(base: Any, config: Config) -> Any:
+    #: We pass the config instance here so the staging directory always
+    #: follows the ``upload_folder`` set by ``init_app``.
+    class StreamingRequest(base):
+
+        _file_upload_streaming = True
+
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            """
+            Werkzeug's stream factory. Only file parts are staged, everything
+            else is handed back to Werkzeug's default implementation.
+            """
+            if not filename:
+                return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+            digests = _ModelUtils.digests
+            if getattr(config.storage, "deduplicate", False):
+                # The content addressed store is keyed by sha256
+                digests = {"sha256", *digests}
+            return _StagingFile(get_staging_folder(config), digests, config.spool_threshold)
+
+    return StreamingRequest
+
+
+def is_staged(file: Any) -> bool:
+    """
+    :param file: Werkzeug's FileStorage
+    :return bool:
+    """
+    return isinstance(getattr(file, "stream", None), _StagingFile)
+
+
+class _MeasuringStream:
+    """
+    Wraps a readable stream, counting & hashing the bytes as the storage
+    backend reads them, so the size & digests are known once the file is
+    written without a second read.
+    """
+
+    def __init__(self, stream: Any, digests: Iterable[str]):
+        self._stream = stream
+        self._digests = list(digests)
+        self._reset()
+
+    def _reset(self) -> None:
+        self.size = 0
+        self.hashes = {d: hashlib.new(d) for d in self._digests}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+    def read(self, *args) -> bytes:
+        data = self._stream.read(*args)
+        self.size += len(data)
+        for content_hash in self.hashes.values():
+            content_hash.update(data)
+        return data
+
+    def seek(self, offset: int, *args) -> int:
+        # A backend that rewinds the stream reads it again from the start
+        if offset == 0 and not args:
+            self._reset()
+        return self._stream.seek(offset, *args)
+
+    def metadata(self) -> Dict[str, Any]:
+        return {_ModelUtils.size_key: self.size, **{d: h.hexdigest() for d, h in self.hashes.items()}}
+
+
+def measure(file: Any, digests: Iterable[str]) -> Tuple[Any, Any]:
+    """
+    :param file: Werkzeug's FileStorage or any readable file object
+    :param digests: The ``hashlib`` algorithm names to compute
+    :return: The file to pass to the storage backend & a function returning
+        the ``size`` & each hex digest, keyed by the column suffix, once the
+        file has been written
+    """
+    if is_staged(file):
+        staged = file.stream
+        return file, lambda: {_ModelUtils.size_key: staged.size, **{d: staged.hexdigest(d) for d in digests}}
+    if isinstance(file, FileStorage):
+        stream = _MeasuringStream(file.stream, digests)
+        file = FileStorage(stream=stream, filename=file.filename, name=file.name, headers=file.headers)
+    else:
+        file = stream = _MeasuringStream(file, digests)
+    return file, stream.metadata
@@ -1,3 +1,5 @@
+import hashlib
+from typing import List
 from warnings import warn
 
 
@@ -10,8 +12,51 @@ class Column:
     constructor::
 
         my_video = file_upload.Column()
+
+    The file size & a digest of the file's content can also be stored. Both
+    are computed while the file is written, so the file is never read twice::
+
+        my_video = file_upload.Column(size=True, digest="sha256")
+
+    This adds the ``my_video__size`` & ``my_video__sha256`` columns.
+
+    ``file_upload.stream_file`` uses the digest as the file's ``ETag`` & the
+    upload time as its ``Last-Modified`` date, so conditional requests are
+    answered with a 304 without touching the file::
+
+        my_thumbnail = file_upload.Column(
+            digest="sha256",
+            timestamp=True,
+            cache_control="public, max-age=86400",
+        )
+
+    :param size: Adds a ``<name>__size`` column holding the file size in bytes
+    :param digest: A ``hashlib`` algorithm name. Adds a ``<name>__<digest>``
+        column holding the hex digest of the file
+    :param timestamp: Adds a ``<name>__uploaded_at`` column holding the time
+        the file was saved (UTC)
+    Each column can accept its own file types & sizes. ``allowed_extensions``
+    replaces the app's ``ALLOWED_EXTENSIONS`` for this column & ``allowed_mime_types``
+    may hold wildcards such as ``"image/*"``::
+
+        my_avatar = file_upload.Column(
+            allowed_extensions=["png", "jpg"],
+            allowed_mime_types=["image/*"],
+            max_size=2 * 1024 * 1024,
+        )
+
+    The rules are checked when the file is saved. With ``FILE_UPLOAD_REJECT_EARLY``
+    set, a file part sent with the same field name is answered with a 415 or 413
+    as soon as it breaks them, while the request is parsed.
+
+    :param cache_control: The ``Cache-Control`` header ``stream_file`` sends for this file
+    :param max_size: The largest file in bytes accepted for this column
+    :param allowed_extensions: The extensions accepted for this column instead of ``ALLOWED_EXTENSIONS``
+    :param allowed_mime_types: The mime types accepted for this column, e.g. ``["image/*", "application/pdf"]``
     """
-    def __init__(self, db=None):
+    def __init__(self, db=None, size: bool = False, digest: str = None, timestamp: bool = False,
+                 cache_control: str = None, max_size: int = None, allowed_extensions: List[str] = None,
+                 allowed_mime_types: List[str] = None):
         if db:
             warn(
                 DeprecationWarning(
@@ -19,3 +64,12 @@ class Column:
                     "not required. This will be removed in v0.1.0"
                 )
             )
+        if digest and (digest not in hashlib.algorithms_available or digest.startswith("shake_")):
+            raise ValueError(f"Flask-File-Upload: '{digest}' is not a supported digest algorithm")
+        self.size = size
+        self.digest = digest
+        self.timestamp = timestamp
+        self.cache_control = cache_control
+        self.max_size = max_size
+        self.allowed_extensions = allowed_extensions
+        self.allowed_mime_types = allowed_mime_types
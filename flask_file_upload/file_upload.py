@@ -3,17 +3,46 @@ FileUpload Class
 ================
 """
 import os
-import shutil
+import atexit
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from warnings import warn
-from flask import send_from_directory, Flask, request, url_for
+from flask import send_from_directory, Flask, request, url_for, Response, has_request_context
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.urls import url_quote
+import sqlalchemy
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
-from typing import Any, List, Dict, Union
+from typing import Any, Callable, Iterator, List, Dict, Union, Tuple
 
-from ._config import Config
+from ._config import Config, SENDFILE_HEADERS
 from .model import create_model
 from .column import Column
 from .file_utils import FileUtils
 from ._model_utils import _ModelUtils
+from ._stream import create_request_class
+from ._form_parser import create_reject_early_request_class
+from ._exceptions import SaveFilesError
+from .storage import LocalStorage
+from .sniff import sniff_file, resolve
+from ._cli import file_upload_cli
+
+
+#: The per call upload state. Each thread (& each asyncio task) sees its own
+#: values, so a single ``FileUpload`` instance can be shared by concurrent
+#: requests without a lock.
+_files: ContextVar = ContextVar("flask_file_upload_files", default=None)
+_file_data: ContextVar = ContextVar("flask_file_upload_file_data", default=None)
+_file_utils: ContextVar = ContextVar("flask_file_upload_file_utils", default=None)
+
+
+#: The number of digest characters used as the version token of a file url
+URL_VERSION_LENGTH = 12
 
 
 class _ModelStub:
@@ -29,6 +58,29 @@ class FileUpload:
     :key upload_folder: where the uploaded files are stored
     :key max_content_length: Limit the amount of file memory
     :key sqlalchemy_database_uri: The database URI that should be used for the connection
+    :key stream_uploads: Stream file parts straight into ``UPLOAD_FOLDER`` while the
+        request is read, so files are saved with a rename instead of a copy
+    :key staging_folder: The directory streamed file parts are staged in. It should be on
+        the same filesystem as ``UPLOAD_FOLDER``. Turns ``stream_uploads`` on
+    :key spool_threshold: Streamed file parts up to this many bytes are kept in memory
+    :key max_workers: The number of threads used to write the files of one call concurrently
+    :key async_max_workers: The size of the thread pool used by the ``async_`` methods
+    :key storage: The storage backend, see :class:`~flask_file_upload.storage`
+    :key layout: The directory layout, ``"flat"`` (default), ``"sharded"`` or a layout
+        instance, see :class:`~flask_file_upload.layout`
+    :key deduplicate: Store each distinct file once & hardlink it into every model directory
+    :key fsync: When written files are flushed to disk, ``"none"`` (default), ``"file"`` or ``"full"``
+    :key sendfile: Let the front end server send files from ``stream_file``. One of
+        ``"nginx"``, ``"apache"``, ``"lighttpd"`` or ``"litespeed"``
+    :key sendfile_prefix: The internal location ``UPLOAD_FOLDER`` is served from, e.g. ``"/protected"``
+    :key versioned_urls: Add a ``?v=`` token taken from the file's digest or upload time to file urls
+    :key base_url: The url file urls start with, e.g. ``"https://cdn.example.com"``. Lets file
+        urls be built outside of a request
+    :key reject_early: Answer multipart requests with a 413 or 415 while they are parsed, as
+        soon as a file part breaks ``allowed_extensions``, a Column's ``max_size`` or ``max_content_length``.
+        Column rules apply to every endpoint posting a field with the Column's name. Needs Werkzeug 2.0
+    :key sniff_mime_types: Store the mime type & extension sniffed from each file's first bytes
+        & do not save files whose real type is not in ``allowed_extensions``
     """
 
     #: Flask-File-Upload (**FFU**) requires Flask application configuration variables
@@ -78,24 +130,30 @@ class FileUpload:
     #: See :class:`~flask_file_upload._config` for more information.
     config: Config = Config()
 
-    #: All the file related model attributes & values are stored
-    #: here as a list of dicts.
-    file_data: List[Dict[str, str]] = []
+    #: The Flask-SQLAlchemy `SQLAlchemy()` instance`
+    _db = None
 
-    #: A record of the original filenames used when saving files
-    #: to the server.
-    files: Any = []
+    #: Writes the files of a single call concurrently when ``max_workers``
+    #: is greater than 1. See :class:`~flask_file_upload._config`
+    _executor: ThreadPoolExecutor = None
 
-    #: A class containing utility methods for working with files.
-    #: See :class:`~flask_file_upload.file_utils` for more information.
-    file_utils: FileUtils = None
+    #: The dedicated thread pool used by the ``async_`` methods for blocking
+    #: filesystem work. Its size is set by ``async_max_workers``.
+    _async_executor: ThreadPoolExecutor = None
 
-    #: The Flask-SQLAlchemy `SQLAlchemy()` instance`
-    _db = None
+    #: Set once :meth:`shutdown` is registered to run at interpreter exit
+    _shutdown_registered: bool = False
 
     #: See :class:`~flask_file_upload.Model`
     Model = _ModelStub
 
+    #: The url prefix of each ``UPLOAD_FOLDER`` built from ``FILE_UPLOAD_BASE_URL``
+    #: or ``SERVER_NAME``. Reset by ``init_app``.
+    _base_url_prefixes: Dict[str, str] = {}
+
+    #: The url builder of each model class used outside of a request
+    _url_builders: Dict[Any, Callable[[Any, str], str]] = {}
+
     def __init__(self, app=None, db=None, *args, **kwargs):
         """
         :param app: The Flask application instance: ``app = Flask(__name__, static_folder="uploads")``.
@@ -104,10 +162,33 @@ class FileUpload:
             :key upload_folder: where the uploaded files are stored
             :key max_content_length: Limit the amount of file memory
             :key sqlalchemy_database_uri: The database URI that should be used for the connection
+            :key stream_uploads: Stream file parts straight into ``UPLOAD_FOLDER`` while the
+                request is read, so files are saved with a rename instead of a copy
+            :key staging_folder: The directory streamed file parts are staged in. It should be on
+                the same filesystem as ``UPLOAD_FOLDER``. Turns ``stream_uploads`` on
+            :key spool_threshold: Streamed file parts up to this many bytes are kept in memory
+            :key max_workers: The number of threads used to write the files of one call concurrently
+            :key async_max_workers: The size of the thread pool used by the ``async_`` methods
+            :key storage: The storage backend, see :class:`~flask_file_upload.storage`
+            :key layout: The directory layout, ``"flat"`` (default), ``"sharded"`` or a layout
+                instance, see :class:`~flask_file_upload.layout`
+            :key deduplicate: Store each distinct file once & hardlink it into every model directory
+            :key fsync: When written files are flushed to disk, ``"none"`` (default), ``"file"`` or ``"full"``
+            :key sendfile: Let the front end server send files from ``stream_file``. One of
+                ``"nginx"``, ``"apache"``, ``"lighttpd"`` or ``"litespeed"``
+            :key sendfile_prefix: The internal location ``UPLOAD_FOLDER`` is served from, e.g. ``"/protected"``
+            :key versioned_urls: Add a ``?v=`` token taken from the file's digest or upload time to file urls
+            :key base_url: The url file urls start with, e.g. ``"https://cdn.example.com"``. Lets file
+                urls be built outside of a request
+            :key reject_early: Answer multipart requests with a 413 or 415 while they are parsed, as
+                soon as a file part breaks ``allowed_extensions``, a Column's ``max_size`` or ``max_content_length``.
+                Column rules apply to every endpoint posting a field with the Column's name. Needs Werkzeug 2.0
+            :key sniff_mime_types: Store the mime type & extension sniffed from each file's first bytes
+                & do not save files whose real type is not in ``allowed_extensions``
         """
         self.Column = Column
         if app and db:
-            self.Model = create_model(db)
+            self.Model = create_model(db, self._get_lazy_file_url)
             self.init_app(app, db, **kwargs)
 
     def add_file_urls_to_models(self, models, **kwargs):
@@ -181,15 +262,21 @@ class FileUpload:
                     "filenames": ["news_image", "news_video],
             })
 
-        WARNING: You must not set the relationship kwarg: `lazy="dynamic"`!
-        If `backref` is set to *"dynamic"* then back-referenced entity's
-        filenames will not get set. Example::
-
-            # This will work
-            blog_news = db.relationship("BlogNewsModel", backref="blog")
+        To set file urls on relationships at any depth, pass a tree of relationship
+        names to the `relationships` kwarg. Each relationship is loaded for all the
+        models of its level with one query & models shared by several parents are
+        only visited once. Example::
+
+            blogs = add_file_urls_to_models(blogs, filenames="blog_image",
+                relationships={
+                    "blog_news": {
+                        "filenames": ["news_image"],
+                        "relationships": {"attachments": {"filenames": ["attachment"]}},
+                    },
+            })
 
-            # this will NOT set filenames on your model class
-            blog_news = db.relationship("BlogNewsModel", backref="blog", lazy="dynamic")
+        A `lazy="dynamic"` relationship can not hold the models it loads, so they
+        are set on the parent as `<relationship>_models` e.g `news.attachments_models`.
 
 
         :param models: SQLAlchemy models (this must be many entities)
@@ -198,31 +285,19 @@ class FileUpload:
             - **name**: The name of the backref relation
             - **filenames**: The FFU attribute value assigned to this model This can be a \
             single string or a list of strings
+        :kwargs relationships: A dict of relationship names to dicts with the keys:
+            - **filenames**: The FFU attribute values of the related model
+            - **relationships**: (Optional) The related model's relationships, in the same form
 
         :return: A list or nested list of SQLAlchemy Model objects.
         """
-        filenames = kwargs.get("filenames")
-        backref = kwargs.get("backref")
-        backref_name = None
-        backref_filenames = None
+        filenames, relationships = self._get_url_spec(**kwargs)
         is_list = True
-        if backref:
-            try:
-                backref_name = backref["name"]
-                backref_filenames = backref["filenames"]
-                if not isinstance(filenames, list):
-                     filenames = [filenames]
-                if not isinstance(backref_filenames, list):
-                    backref_filenames = [backref_filenames]
-            except TypeError:
-                raise TypeError(
-                    "Flask-File_Upload Error: If `backref` kwarg is declared "
-                    "then you must include `filenames` & `name` keys. See "
-                    "https://github.com/joegasewicz/flask-file-upload"
-                )
 
         _models = []
         try:
+            if relationships:
+                models = self._eager_load(models, relationships)
             _models = models.all()
         except:
             if isinstance(models, list):
@@ -230,30 +305,296 @@ class FileUpload:
             else:
                 is_list = False
                 _models.append(models)
-        if not backref:
-            for model in _models:
-                for filename in filenames:
-                    model_img_url = self.get_file_url(model, filename=filename)
-                    setattr(model, f"{filename}_url", model_img_url)
-            if not is_list:
-                return _models[0]
-            else:
-                return _models
+
+        self._set_file_urls(_models, filenames, relationships, self._create_file_url_getter())
+        if not is_list:
+            return _models[0]
         else:
-            for model in _models:
+            return _models
+
+    def iter_file_urls(self, models: Any, **kwargs) -> Iterator[Any]:
+        """
+        A generator version of ``add_file_urls_to_models`` for exports of large
+        queries. The query is read ``chunk_size`` rows at a time with ``yield_per``
+        & the urls of each chunk (& of its relationships) are set before its models
+        are yielded, so memory use does not grow with the size of the result.
+        As urls are built from the request, wrap the generator with Flask's
+        ``stream_with_context``. Example::
+
+            @app.route("/blogs.json")
+            def export_blogs():
+                rows = file_upload.iter_file_urls(
+                    BlogModel.query,
+                    filenames=["blog_image"],
+                    relationships={"blog_news": {"filenames": ["news_image"]}},
+                    as_dict=True,
+                )
+                return Response(stream_with_context(json_lines(rows)), mimetype="application/x-ndjson")
+
+        :param models: A SqlAlchemy query or any iterable of models
+        :key filenames: The same as ``add_file_urls_to_models``
+        :key backref: The same as ``add_file_urls_to_models``
+        :key relationships: The same as ``add_file_urls_to_models``
+        :key chunk_size: The number of rows loaded & decorated at a time. Defaults to 1000
+        :key as_dict: If set to True, a dict of each model's columns, file urls &
+            relationships in the spec is yielded instead of the model
+        :return: A generator of models or dicts
+        """
+        filenames, relationships = self._get_url_spec(**kwargs)
+        chunk_size = kwargs.get("chunk_size") or 1000
+        as_dict = kwargs.get("as_dict", False)
+        if hasattr(models, "yield_per"):
+            if relationships:
+                models = self._eager_load(models, relationships)
+            models = models.yield_per(chunk_size)
+        get_file_url = self._create_file_url_getter()
+        chunk = []
+        for model in models:
+            chunk.append(model)
+            if len(chunk) < chunk_size:
+                continue
+            self._set_file_urls(chunk, filenames, relationships, get_file_url)
+            for m in chunk:
+                yield self._to_dict(m, filenames, relationships) if as_dict else m
+            chunk = []
+        if chunk:
+            self._set_file_urls(chunk, filenames, relationships, get_file_url)
+            for m in chunk:
+                yield self._to_dict(m, filenames, relationships) if as_dict else m
+
+    @staticmethod
+    def _get_url_spec(**kwargs) -> Tuple[List[str], Dict[str, Dict]]:
+        """
+        :key filenames:
+        :key backref:
+        :key relationships:
+        :return Tuple[List[str], Dict[str, Dict]]: The filenames of the models &
+            the relationship spec, with ``backref`` folded into it
+        """
+        filenames = kwargs.get("filenames") or []
+        backref = kwargs.get("backref")
+        relationships = kwargs.get("relationships") or {}
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        if backref:
+            try:
+                relationships = {backref["name"]: {"filenames": backref["filenames"]}, **relationships}
+            except TypeError:
+                raise TypeError(
+                    "Flask-File_Upload Error: If `backref` kwarg is declared "
+                    "then you must include `filenames` & `name` keys. See "
+                    "https://github.com/joegasewicz/flask-file-upload"
+                )
+        return filenames, relationships
+
+    def _create_file_url_getter(self) -> Callable[[Any, str], str]:
+        """
+        :return: A ``get_file_url(model, filename)`` function that looks up the
+            url builder of each model class once
+        """
+        builders = {}
+
+        def get_file_url(model, filename):
+            model_class = type(model)
+            if model_class not in builders:
+                builders[model_class] = self._get_file_url_builder(model_class)
+            return builders[model_class](model, filename)
+
+        return get_file_url
+
+    def _set_file_urls(self, models: List[Any], filenames: List[str], relationships: Dict[str, Dict],
+                       get_file_url: Callable[[Any, str], str]) -> None:
+        """
+        :param models:
+        :param filenames:
+        :param relationships:
+        :param get_file_url:
+        :return None:
+        """
+        for model in models:
+            for filename in filenames:
+                setattr(model, _ModelUtils.get_url_key(filename), get_file_url(model, filename))
+        if relationships:
+            self._add_file_urls_to_relationships(models, relationships, get_file_url)
+
+    def _to_dict(self, model: Any, filenames: List[str], relationships: Dict[str, Dict]) -> Dict[str, Any]:
+        """
+        :param model: A model decorated by ``_set_file_urls``
+        :param filenames:
+        :param relationships:
+        :return Dict[str, Any]: The model's column values, file urls & related models
+        """
+        mapper = sqlalchemy.inspect(model).mapper
+        data = {attr.key: getattr(model, attr.key) for attr in mapper.column_attrs}
+        for filename in filenames:
+            url_key = _ModelUtils.get_url_key(filename)
+            data[url_key] = getattr(model, url_key)
+        for name, spec in relationships.items():
+            filenames = spec.get("filenames") or []
+            if not isinstance(filenames, list):
+                filenames = [filenames]
+            nested = spec.get("relationships") or {}
+            prop = mapper.relationships.get(name)
+            if prop is not None and prop.lazy == "dynamic":
+                value = getattr(model, f"{name}_models", [])
+            else:
+                value = getattr(model, name)
+            if value is None or hasattr(value, "__table__"):
+                data[name] = value and self._to_dict(value, filenames, nested)
+            else:
+                data[name] = [self._to_dict(v, filenames, nested) for v in value]
+        return data
+
+    def _add_file_urls_to_relationships(self, models: List[Any], relationships: Dict[str, Dict],
+                                        get_file_url: Callable[[Any, str], str]) -> None:
+        """
+        Walks the relationship spec one level at a time. Each relationship of a
+        level is loaded for all of that level's models at once & each related
+        model is only visited once, even if it is shared by many parents.
+        :param models: The models of the current level
+        :param relationships: ``{name: {"filenames": [...], "relationships": {...}}}``
+        :param get_file_url:
+        :return None:
+        """
+        for name, spec in relationships.items():
+            filenames = spec.get("filenames") or []
+            if not isinstance(filenames, list):
+                filenames = [filenames]
+            nested = spec.get("relationships") or {}
+            seen = set()
+            children = []
+            for child in self._load_relationship(models, name, nested):
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    children.append(child)
+            for child in children:
                 for filename in filenames:
-                    model_img_url = self.get_file_url(model, filename=filename)
-                    setattr(model, f"{filename}_url", model_img_url)
-                    backref_models = getattr(model, backref_name)
-                    for backref_filename in backref_filenames:
-                        if backref and backref_models:
-                            for br_model in backref_models:
-                                br_model_img_url = self.get_file_url(br_model, filename=backref_filename)
-                                setattr(br_model, f"{backref_filename}_url", br_model_img_url)
-            if not is_list:
-                return _models[0]
+                    setattr(child, _ModelUtils.get_url_key(filename), get_file_url(child, filename))
+            if nested and children:
+                self._add_file_urls_to_relationships(children, nested, get_file_url)
+
+    def _load_relationship(self, models: List[Any], name: str, nested: Dict[str, Dict]) -> List[Any]:
+        """
+        Loads the ``name`` relationship of every model with one query:
+
+        - Relationships already loaded (e.g. by ``_eager_load``) cost nothing.
+        - Unloaded relationships are loaded for all models with ``selectinload``.
+        - ``lazy="dynamic"`` relationships are queried with eager options for
+          the ``nested`` relationships. The related models are set on each
+          model as ``<name>_models`` as a dynamic relationship can not hold them.
+
+        :param models:
+        :param name: The relationship name
+        :param nested: The relationship spec of the related models
+        :return List[Any]: The related models of every model
+        """
+        related = []
+        unloaded = {}
+        for model in models:
+            state = sqlalchemy.inspect(model)
+            prop = state.mapper.relationships.get(name)
+            if prop is not None and prop.lazy == "dynamic":
+                unloaded.setdefault((type(model), "dynamic"), []).append(model)
+            elif name in state.unloaded and state.session and not state.mapper.primary_key[1:]:
+                unloaded.setdefault((type(model), "lazy"), []).append(model)
             else:
-                return _models
+                related.extend(self._as_list(getattr(model, name)))
+
+        for (model_class, lazy), group in unloaded.items():
+            prop = sqlalchemy.inspect(model_class).relationships[name]
+            options = self._eager_options(prop.mapper.class_, nested)
+            if lazy == "lazy":
+                pk = sqlalchemy.inspect(model_class).primary_key[0]
+                session = sqlalchemy.inspect(group[0]).session
+                session.query(model_class).filter(pk.in_([getattr(m, pk.key) for m in group])) \
+                    .options(selectinload(getattr(model_class, name)).options(*options)).all()
+                for model in group:
+                    related.extend(self._as_list(getattr(model, name)))
+            else:
+                related.extend(self._load_dynamic(group, name, prop, options))
+        return related
+
+    def _load_dynamic(self, models: List[Any], name: str, prop: Any, options: List[Any]) -> List[Any]:
+        """
+        One to many relationships on a single foreign key are loaded for every
+        model with one ``IN`` query, anything else with one query per model.
+        :param models:
+        :param name:
+        :param prop: The relationship property
+        :param options: Loader options for the related models
+        :return List[Any]:
+        """
+        related = []
+        pairs = prop.local_remote_pairs
+        session = sqlalchemy.inspect(models[0]).session
+        if prop.direction is sqlalchemy.orm.interfaces.ONETOMANY and prop.secondary is None \
+                and len(pairs) == 1 and session is not None:
+            local_col, remote_col = pairs[0]
+            local_attr = prop.parent.get_property_by_column(local_col).key
+            remote_attr = prop.mapper.get_property_by_column(remote_col).key
+            by_key = {}
+            for model in models:
+                by_key.setdefault(getattr(model, local_attr), []).append(model)
+                setattr(model, f"{name}_models", [])
+            rows = session.query(prop.mapper.class_) \
+                .filter(getattr(prop.mapper.class_, remote_attr).in_(list(by_key))) \
+                .options(*options).all()
+            for row in rows:
+                for model in by_key.get(getattr(row, remote_attr), []):
+                    getattr(model, f"{name}_models").append(row)
+                related.append(row)
+            return related
+        for model in models:
+            rows = getattr(model, name).options(*options).all()
+            setattr(model, f"{name}_models", rows)
+            related.extend(rows)
+        return related
+
+    @staticmethod
+    def _as_list(value: Any) -> List[Any]:
+        """
+        :param value: A relationship value, a collection, a single model or None
+        :return List[Any]:
+        """
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple, set)) or hasattr(value, "__iter__") and not hasattr(value, "__table__"):
+            return list(value)
+        return [value]
+
+    def _eager_options(self, entity: Any, relationships: Dict[str, Dict]) -> List[Any]:
+        """
+        :param entity: A SqlAlchemy model class
+        :param relationships: The relationship spec
+        :return List[Any]: ``selectinload`` options for every relationship in the
+            spec that can be eager loaded. The walk stops at dynamic relationships.
+        """
+        options = []
+        for name, spec in relationships.items():
+            relationship = getattr(entity, name, None)
+            prop = getattr(relationship, "property", None)
+            if prop is None or not hasattr(prop, "mapper") or prop.lazy in ("dynamic", "noload", "raise"):
+                continue
+            loader = selectinload(relationship)
+            nested = self._eager_options(prop.mapper.class_, spec.get("relationships") or {})
+            options.append(loader.options(*nested) if nested else loader)
+        return options
+
+    def _eager_load(self, models: Any, relationships: Dict[str, Dict]) -> Any:
+        """
+        If ``models`` is a query, every relationship in the spec is loaded
+        with ``selectinload``, so the related models of all rows are fetched
+        with one extra query per relationship instead of one query per row.
+        :param models: A SqlAlchemy query or a list of models
+        :param relationships: The relationship spec
+        :return: The query with the loader options or ``models`` unchanged
+        """
+        try:
+            entity = models.column_descriptions[0]["entity"]
+        except (AttributeError, IndexError, KeyError, TypeError):
+            return models
+        options = self._eager_options(entity, relationships)
+        return models.options(*options) if options else models
 
     def delete_files(self, model: Any, db=None, **kwargs) -> Union[Any, None]:
         """
@@ -331,30 +672,64 @@ class FileUpload:
         self.file_utils = FileUtils(model, self.config)
 
         clean_up = kwargs.get("clean_up")
-        commit = kwargs.get("commit") or True
+        commit = kwargs.get("commit", True)
         parent = kwargs.get("parent") or False
 
-        primary_key = _ModelUtils.get_primary_key(model)
-        model_id = getattr(model, primary_key, None)
-
         try:
             files: List[str] = kwargs["files"]
         except KeyError:
-            raise("'files' is a Required Argument!")
+            raise TypeError("Flask-File-Upload: 'files' is a required argument")
+
+        self._remove_files(*self._get_delete_keys(model, files, clean_up, parent))
+        return self._clean_up_model(model, files, clean_up, commit)
+
+    def _get_delete_keys(self, model: Any, files: List[str], clean_up: Union[str, None],
+                         parent: bool) -> Tuple[Union[str, None], List[str]]:
+        """
+        Returns the storage key prefix to remove (if ``parent`` is set) & the
+        keys of the files to remove from the server.
+        :param model:
+        :param files:
+        :param clean_up:
+        :param parent:
+        :return Tuple[Union[str, None], List[str]]:
+        """
+        model_id = _ModelUtils.get_id_value(model)
 
         if parent:
-            file_path = self.file_utils.get_stream_path(model_id)
-            shutil.rmtree(file_path)
-        elif clean_up is None or clean_up is "files":
-            for f in files:
-                original_filename = _ModelUtils.get_original_file_name(f, model)
-                file_path = f"{self.file_utils.get_stream_path(model_id)}/{original_filename}"
-                os.remove(f"{file_path}")
-
-        if clean_up is None or clean_up is "model":
+            return self.file_utils.get_stream_key(model_id), []
+        elif clean_up is None or clean_up == "files":
+            return None, [
+                self.file_utils.get_file_key(model_id, _ModelUtils.get_original_file_name(f, model))
+                for f in files
+            ]
+        return None, []
+
+    def _remove_files(self, prefix: Union[str, None], keys: List[str]) -> None:
+        """
+        :param prefix: A key prefix to remove with all its contents
+        :param keys:
+        :return None:
+        """
+        if prefix:
+            self.config.storage.delete_prefix(prefix)
+        for key in keys:
+            self.config.storage.delete(key)
+
+    def _clean_up_model(self, model: Any, files: List[str], clean_up: Union[str, None], commit: bool) -> Any:
+        """
+        :param model:
+        :param files:
+        :param clean_up:
+        :param commit:
+        :return: SqlAlchemy model object
+        """
+        if clean_up is None or clean_up == "model":
+            columns = _ModelUtils.get_file_columns(model)
             for f_name in files:
-                for postfix in _ModelUtils.keys:
+                for postfix in _ModelUtils.keys + _ModelUtils.get_metadata_keys(columns.get(f_name)):
                     setattr(model, _ModelUtils.add_postfix(f_name, postfix), None)
+                _ModelUtils.clear_file_url(model, f_name)
             return _ModelUtils.commit_session(self.db, model, commit)
         else:
             return model
@@ -377,20 +752,35 @@ class FileUpload:
 
     def  _clean_up(self, error) -> None:
         """Clean list data & state"""
-        self.files.clear()
-        self.file_data.clear()
+        self.files = []
+        self.file_data = []
+        self.file_utils = None
 
-    def _create_file_dict(self, file, attr_name: str):
+    def _create_file_dict(self, file, attr_name: str, rules: Any = None):
         """
         :param file:
         :param attr_name:
+        :param rules: The Column's compiled rules, see ``_ModelUtils.get_file_rules``
         :return:
         """
-        if file.filename != "" and file and FileUtils.allowed_file(file.filename, self.config):
+        rules = rules or _ModelUtils.get_file_rules(None, attr_name)
+        if file.filename != "" and file and FileUtils.allowed_file(file.filename, self.config, rules):
             filename = file.filename
             filename_key = attr_name
             mime_type = file.content_type
-            file_ext = file.filename.split(".")[1]
+            file_ext = file.filename.rsplit(".", 1)[1]
+            signature = sniff_file(file) if self.config.sniff_mime_types else None
+            if signature:
+                mime_type, file_ext = resolve(signature, filename)
+                if not rules.allows_extension(file_ext, self.config.allowed_extension_set):
+                    warn(f"Flask-File-Upload: {filename} is a {mime_type} file. No files were saved")
+                    return {}
+            if not rules.allows_mime_type(mime_type):
+                warn(f"Flask-File-Upload: {filename} is a {mime_type} file. No files were saved")
+                return {}
+            if rules.max_size and (FileUtils.get_size(file) or 0) > rules.max_size:
+                warn(f"Flask-File-Upload: {filename} is larger than {rules.max_size} bytes. No files were saved")
+                return {}
             return {
                 f"{filename_key}__{_ModelUtils.column_suffix.FILE_NAME.value}": filename,
                 f"{filename_key}__{_ModelUtils.column_suffix.MIME_TYPE.value}": mime_type,
@@ -422,29 +812,174 @@ class FileUpload:
         """
         try:
             filename = kwargs["filename"]
-            self.file_utils = FileUtils(model, self.config)
+            return self._get_file_url_builder(type(model))(model, filename)
+        except AttributeError:
+            AttributeError("[FLASK_FILE_UPLOAD] You must declare a filename kwarg")
 
-            primary_key = _ModelUtils.get_primary_key(model)
-            model_id = getattr(model, primary_key, None)
-            file_name = _ModelUtils.get_by_postfix(model, filename, "file_name")
-            file_path = self.file_utils.postfix_file_path(model_id, file_name)
+    def _get_lazy_file_url(self, model: Any, filename: str) -> str:
+        """
+        Builds the url returned by a model's ``<filename>_url`` attribute.
+        The builder of each model class is kept for the rest of the request,
+        or until ``init_app`` is called again outside of a request.
+        :param model:
+        :param filename:
+        :return str:
+        """
+        if has_request_context():
+            builders = request.environ.setdefault("flask_file_upload.url_builders", {})
+        else:
+            builders = self._url_builders
+        key = (id(self), type(model))
+        try:
+            build = builders[key]
+        except KeyError:
+            build = builders[key] = self._get_file_url_builder(type(model))
+        return build(model, filename)
 
-            url_root = request.url_root
-            if url_root[-1] == "/":
-                url_root = url_root[:-1]
+    def _get_url_prefix(self) -> str:
+        """
+        The url every file url served from the static folder starts with, e.g.
+        ``http://localhost/static/uploads``. It is built once per request &
+        ``UPLOAD_FOLDER`` & kept in the request's WSGI environ. If ``base_url``
+        is set, or outside of a request, it is built from the configuration.
+        :return str:
+        """
+        if self.config.base_url or not has_request_context():
+            return self._get_base_url_prefix()
+        environ = request.environ
+        cache = environ.setdefault("flask_file_upload.url_prefixes", {})
+        try:
+            return cache[self.config.upload_folder]
+        except KeyError:
+            pass
+        url_root = request.url_root
+        if url_root[-1] == "/":
+            url_root = url_root[:-1]
+        upload_folder_list = self.config.upload_folder.split("static")
+        if len(upload_folder_list) == 2:
+            static_path = f"static{upload_folder_list[1]}"
+        else:
+            static_path = url_for("static", filename="")
+        static_path = static_path.replace("//", "/").strip("/")
+        prefix = f"{url_root}/{static_path}" if static_path else url_root
+        cache[self.config.upload_folder] = prefix
+        return prefix
 
-            upload_folder_list = self.config.upload_folder.split("static")
-            if len(upload_folder_list) == 2:
-                upload_folder = f"static{upload_folder_list[1]}"
-                image_path = f"{upload_folder}{file_path}".replace("//", "/")
-            else:
-                image_path = url_for("static", filename=file_path).replace("//", "/")
-            if image_path[0] == "/":
-                image_path = image_path[1:]
-            if filename:
-                return f"{url_root}/{image_path}"
-        except AttributeError:
-            AttributeError("[FLASK_FILE_UPLOAD] You must declare a filename kwarg")
+    def _get_base_url_prefix(self) -> str:
+        """
+        Builds the url prefix from ``base_url``, or else ``SERVER_NAME``,
+        ``PREFERRED_URL_SCHEME`` & ``APPLICATION_ROOT``, with string operations
+        only. The prefix is kept per ``UPLOAD_FOLDER``.
+        :return str:
+        """
+        upload_folder = self.config.upload_folder
+        try:
+            return self._base_url_prefixes[upload_folder]
+        except KeyError:
+            pass
+        base_url = self.config.base_url
+        if not base_url:
+            if not self.config.server_name:
+                raise RuntimeError(
+                    "Flask-File-Upload: Set FILE_UPLOAD_BASE_URL or SERVER_NAME "
+                    "to build file urls outside of a request"
+                )
+            scheme = self.app.config.get("PREFERRED_URL_SCHEME") or "http"
+            application_root = self.app.config.get("APPLICATION_ROOT") or "/"
+            base_url = f"{scheme}://{self.config.server_name}{application_root}"
+        base_url = base_url.rstrip("/")
+        upload_folder_list = upload_folder.split("static")
+        if len(upload_folder_list) == 2:
+            static_path = f"static{upload_folder_list[1]}"
+        else:
+            static_path = self.app.static_url_path or ""
+        static_path = static_path.replace("//", "/").strip("/")
+        prefix = f"{base_url}/{static_path}" if static_path else base_url
+        self._base_url_prefixes[upload_folder] = prefix
+        return prefix
+
+    def _get_file_url_builder(self, model_class: Any) -> Callable[[Any, str], str]:
+        """
+        Looks up everything the file urls of ``model_class`` instances share
+        (the primary key, table name, url prefix & config) once.
+        :param model_class: A decorated SqlAlchemy model class
+        :return: A function taking a model instance & an attribute name &
+            returning the file's url
+        """
+        primary_key = _ModelUtils.get_primary_key(model_class)
+        table_name = _ModelUtils.get_table_name(model_class)
+        layout = self.config.layout
+        storage = self.config.storage
+        versioned_urls = self.config.versioned_urls
+        url_prefix = None
+
+        def build(model: Any, filename: str) -> str:
+            nonlocal url_prefix
+            file_name = getattr(model, f"{filename}__file_name")
+            key = f"{layout.prefix(table_name, getattr(model, primary_key, None))}/{file_name}"
+            version = self._get_url_version(model, filename) if versioned_urls else None
+            query = f"?v={version}" if version else ""
+            storage_url = storage.url(key)
+            if storage_url:
+                return f"{storage_url}{query}"
+            if url_prefix is None:
+                url_prefix = self._get_url_prefix()
+            # Quoted like url_for("static", filename=key)
+            return f"{url_prefix}/{url_quote(key)}{query}"
+
+        return build
+
+    def _get_url_version(self, model: Any, filename: str) -> Union[str, None]:
+        """
+        The version token added to file urls when ``versioned_urls`` is set. It is
+        taken from the file's digest column or else its upload time column, so it
+        changes whenever the file is replaced.
+        :param model:
+        :param filename: The attribute name defined on your SqlAlchemy model
+        :return: The token or None if the Column stores neither value
+        """
+        column = _ModelUtils.get_file_columns(model).get(filename)
+        if column and column.digest:
+            digest = _ModelUtils.get_by_postfix(model, filename, column.digest)
+            if digest:
+                return digest[:URL_VERSION_LENGTH]
+        if column and column.timestamp:
+            uploaded_at = _ModelUtils.get_by_postfix(model, filename, _ModelUtils.uploaded_at_key)
+            if uploaded_at:
+                return uploaded_at.strftime("%Y%m%d%H%M%S%f")
+        return None
+
+    @staticmethod
+    def _resize_executor(executor: Union[ThreadPoolExecutor, None], max_workers: int,
+                         thread_name_prefix: str) -> Union[ThreadPoolExecutor, None]:
+        """
+        Keeps ``executor`` if it already has ``max_workers`` threads, otherwise
+        shuts it down (letting the work already submitted finish) & creates a new one.
+        :param executor: The current thread pool or None
+        :param max_workers: The pool size, 0 for no pool
+        :param thread_name_prefix:
+        :return: The thread pool to use or None
+        """
+        if executor is not None and executor._max_workers == max_workers:
+            return executor
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if not max_workers:
+            return None
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shuts the thread pools down. Called at interpreter exit, or call it when
+        the ``FileUpload`` instance is no longer used. ``init_app`` creates new pools.
+        :param wait: Wait for the files being written
+        :return None:
+        """
+        for executor in (self._executor, self._async_executor):
+            if executor is not None:
+                executor.shutdown(wait=wait)
+        self._executor = None
+        self._async_executor = None
 
     def init_app(self, app, db=None, **kwargs) -> None:
         """
@@ -469,13 +1004,36 @@ class FileUpload:
 
         db = db or self.db
         self.app = app
-        self.Model = create_model(db)
+        self.Model = create_model(db, self._get_lazy_file_url)
         self.config.init_config(app, **kwargs)
+        self._base_url_prefixes = {}
+        self._url_builders = {}
+        if self.config.base_url or self.config.server_name:
+            # Built once here so background workers only join strings
+            self._get_base_url_prefix()
+        if self.config.stream_uploads and not getattr(app.request_class, "_file_upload_streaming", False):
+            app.request_class = create_request_class(app.request_class, self.config)
+        if self.config.reject_early and not getattr(app.request_class, "_file_upload_reject_early", False):
+            app.request_class = create_reject_early_request_class(app.request_class, self.config)
+        self._executor = self._resize_executor(
+            self._executor,
+            self.config.max_workers if self.config.max_workers > 1 else 0,
+            "flask_file_upload",
+        )
+        self._async_executor = self._resize_executor(
+            self._async_executor,
+            self.config.async_max_workers,
+            "flask_file_upload_async",
+        )
+        if not self._shutdown_registered:
+            atexit.register(self.shutdown)
+            self._shutdown_registered = True
         self._db = db
-        if db:
-            app.extensions["file_upload"] = {
-                "db": db,
-            }
+        app.extensions["file_upload"] = {
+            "db": db,
+            "config": self.config,
+        }
+        app.cli.add_command(file_upload_cli)
 
     def add_files(self, model, **kwargs) -> Any:
         """
@@ -522,10 +1080,11 @@ class FileUpload:
         """
         # Warning: These methods need to set members on the Model class
         # before we instantiate FileUtils()
-        self._set_file_data(**kwargs)
+        self._set_file_data(model, **kwargs)
+        previous_attrs = self._get_model_attrs(model)
         self._set_model_attrs(model)
         self.file_utils = FileUtils(model, self.config)
-        self._save_files_to_dir(model)
+        self._save_files_to_dir(model, previous_attrs)
         return model
 
     def save_files(self, model, **kwargs) -> Any:
@@ -572,36 +1131,271 @@ class FileUpload:
         """
         # Warning: These methods need to set members on the Model class
         # before we instantiate FileUtils()
-        self._set_file_data(**kwargs)
+        self._set_file_data(model, **kwargs)
+        previous_attrs = self._get_model_attrs(model)
         self._set_model_attrs(model)
 
         self.file_utils = FileUtils(model, self.config)
 
         commit_session = kwargs.get("commit_session") or True
         model = _ModelUtils.commit_session(self.db, model, commit_session)
-        self._save_files_to_dir(model)
+        try:
+            self._save_files_to_dir(model, previous_attrs)
+        except SaveFilesError:
+            # Persist the restored file attributes so the db matches the disk
+            _ModelUtils.commit_session(self.db, model, commit_session)
+            raise
+        self._commit_file_metadata(model, commit_session)
         return model
 
-    def _save_files_to_dir(self, model: Any) -> None:
+    def _commit_file_metadata(self, model: Any, commit_session: bool) -> None:
         """
+        The size, digest & upload time columns are only set once the files are
+        written, which is after the model was committed to get its primary key
         :param model:
+        :param commit_session:
+        :return None:
+        """
+        if commit_session and self.db and sqlalchemy.inspect(model).modified:
+            _ModelUtils.commit_session(self.db, model, commit_session)
+
+    def save_files_bulk(self, models_and_files, **kwargs) -> Tuple[List[Any], List[Tuple[Any, Exception]]]:
+        """
+        Saves files for many models at once. Each batch of models is added to
+        the session & flushed once to obtain the primary keys, then all the files
+        of the batch are written concurrently & the batch is committed.
+        A failing item does not abort the batch, instead it is reported back
+        in the returned errors list. Example::
+
+            saved, errors = file_upload.save_files_bulk([
+                (BlogModel(title="one"), {"blog_image": image_one}),
+                (BlogModel(title="two"), {"blog_image": image_two}),
+            ], batch_size=500)
+
+            for model, err in errors:
+                print(f"{model} failed: {err}")
+
+        :param models_and_files: An iterable of ``(model, files)`` tuples, where
+            ``files`` is the same dict you would pass to ``file_upload.save_files``
+        :key batch_size: The number of models committed at a time. Defaults
+            to ``bulk_batch_size``
+        :return: A tuple of the saved models & a list of ``(model, exception)`` tuples
+        """
+        batch_size = kwargs.get("batch_size") or self.config.bulk_batch_size
+        executor = self._executor or ThreadPoolExecutor(thread_name_prefix="flask_file_upload_bulk")
+        saved = []
+        errors = []
+        batch = []
+        try:
+            for item in models_and_files:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    self._save_bulk_batch(batch, executor, saved, errors)
+                    batch = []
+            if batch:
+                self._save_bulk_batch(batch, executor, saved, errors)
+        finally:
+            if executor is not self._executor:
+                executor.shutdown()
+        return saved, errors
+
+    def _save_bulk_batch(self, batch: List[Tuple[Any, Dict[str, Any]]], executor: ThreadPoolExecutor,
+                         saved: List[Any], errors: List[Tuple[Any, Exception]]) -> None:
+        """
+        The batch is flushed in a savepoint, so a failing model never rolls back
+        other state pending in the session. The rows of new models whose files
+        fail are removed again, so a failed item can be retried without creating
+        a duplicate. If the commit fails, the files written for the batch are
+        removed & every model of the batch is reported in ``errors``.
+        :param batch: A list of ``(model, files)`` tuples
+        :param executor:
+        :param saved: The saved models are appended here
+        :param errors: The failed ``(model, exception)`` tuples are appended here
         :return None:
         """
-        for f in self.files:
+        session = self.db.session
+        items = []
+        for model, files in batch:
+            try:
+                is_new = not sqlalchemy.inspect(model).has_identity
+                self._set_file_data(model, files=files)
+                previous_attrs = self._get_model_attrs(model)
+                self._set_model_attrs(model)
+                items.append((model, self.files, self.file_data, previous_attrs, is_new))
+            except Exception as err:
+                errors.append((model, err))
+
+        try:
+            with session.begin_nested():
+                session.add_all([item[0] for item in items])
+        except Exception:
+            # Find the failing models by flushing each model in its own savepoint
+            flushed = []
+            for item in items:
+                model, _, file_data, _, _ = item
+                try:
+                    with session.begin_nested():
+                        # A rolled back savepoint expires the attributes set on persistent models
+                        for k, v in {k: v for d in file_data for k, v in d.items()}.items():
+                            setattr(model, k, v)
+                        session.add(model)
+                except Exception as err:
+                    errors.append((model, err))
+                else:
+                    flushed.append(item)
+            items = flushed
+
+        futures = []
+        for model, files, file_data, previous_attrs, is_new in items:
+            file_utils = FileUtils(model, self.config)
             id_val = _ModelUtils.get_id_value(model)
-            self.file_utils.save_file(f, id_val)
+            futures.append((
+                model, files, file_data, previous_attrs, is_new, file_utils, id_val,
+                [executor.submit(file_utils.save_file, f, id_val) for f in files],
+            ))
+
+        batch_saved = []
+        for model, files, file_data, previous_attrs, is_new, file_utils, id_val, item_futures in futures:
+            item_errors = {f.filename: future.exception() for f, future in zip(files, item_futures)
+                           if future.exception()}
+            written = [f for f, future in zip(files, item_futures) if not future.exception()]
+            if not item_errors:
+                self.file_data = file_data
+                self._set_file_metadata(model, [future.result() for future in item_futures])
+                batch_saved.append((model, file_utils, id_val, written, is_new))
+                continue
+            if is_new:
+                # The row was only flushed to get its primary key
+                session.delete(model)
+            self._remove_bulk_files(file_utils, id_val, written, is_new)
+            for k, v in previous_attrs.items():
+                setattr(model, k, v)
+            errors.append((model, SaveFilesError(item_errors)))
+        try:
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            for model, file_utils, id_val, written, is_new in batch_saved:
+                self._remove_bulk_files(file_utils, id_val, written, is_new)
+                errors.append((model, err))
+            return
+        saved.extend(item[0] for item in batch_saved)
+
+    def _remove_bulk_files(self, file_utils: FileUtils, id_val: Any, files: List[Any], is_new: bool) -> None:
+        """
+        :param file_utils:
+        :param id_val:
+        :param files: The files written by ``save_files_bulk`` for one model
+        :param is_new: Removes the model's whole directory, as no other file is stored in it
+        :return None:
+        """
+        if is_new:
+            try:
+                self.config.storage.delete_prefix(file_utils.get_stream_key(id_val))
+            except FileNotFoundError:
+                pass
+            return
+        for f in files:
+            try:
+                self.config.storage.delete(file_utils.get_file_key(id_val, f.filename))
+            except FileNotFoundError:
+                pass
 
-    def _set_file_data(self, **file_data) -> List[Dict[str, str]]:
+    def _save_files_to_dir(self, model: Any, previous_attrs: Dict[str, Any] = None) -> None:
+        """
+        Writes every file of the current call to the server. If ``max_workers``
+        is greater than 1 the files are written concurrently. If any file fails,
+        the files already written are removed, the model's file attributes are
+        set back to ``previous_attrs`` & a single ``SaveFilesError`` is raised.
+        Partially written files are removed as well.
+        :param model:
+        :param previous_attrs: The model's file attributes before this call
+        :return None:
         """
-        Adds items to files & file_data
+        id_val = _ModelUtils.get_id_value(model)
+        file_utils = self.file_utils
+        attempted = self.files
+        errors = {}
+        results = []
+        if self._executor and len(self.files) > 1:
+            futures = [(f, self._executor.submit(file_utils.save_file, f, id_val)) for f in self.files]
+            for f, future in futures:
+                err = future.exception()
+                if err:
+                    errors[f.filename] = err
+                else:
+                    results.append(future.result())
+        else:
+            for i, f in enumerate(self.files):
+                try:
+                    results.append(file_utils.save_file(f, id_val))
+                except Exception as err:
+                    errors[f.filename] = err
+                    attempted = self.files[:i + 1]
+                    break
+        if errors:
+            # Files are replaced atomically, so a file with the same name as
+            # one of the model's current files still holds the current file
+            current_file_names = {
+                v for k, v in (previous_attrs or {}).items() if k.endswith("__file_name")
+            }
+            for f in attempted:
+                if f.filename in current_file_names:
+                    continue
+                try:
+                    self.config.storage.delete(file_utils.get_file_key(id_val, f.filename))
+                except FileNotFoundError:
+                    pass
+            for k, v in (previous_attrs or {}).items():
+                setattr(model, k, v)
+            raise SaveFilesError(errors)
+        self._set_file_metadata(model, results)
+
+    def _set_file_metadata(self, model: Any, results: List[Dict[str, Any]]) -> None:
+        """
+        Adds the size & digests computed while the files were written to
+        file_data & sets them on the model
+        :param model:
+        :param results: The values returned by ``FileUtils.save_file`` for each file
+        :return None:
+        """
+        columns = _ModelUtils.get_file_columns(model)
+        file_name_postfix = f"__{_ModelUtils.column_suffix.FILE_NAME.value}"
+        for file_dict, metadata in zip(self.file_data, results):
+            attr = next((k[:-len(file_name_postfix)] for k in file_dict if k.endswith(file_name_postfix)), None)
+            if not attr or not metadata:
+                continue
+            for key in _ModelUtils.get_metadata_keys(columns.get(attr)):
+                file_dict[_ModelUtils.add_postfix(attr, key)] = metadata[key]
+        self._set_model_attrs(model)
+
+    def _get_model_attrs(self, model: Any) -> Dict[str, Any]:
+        """
+        Returns the model's current values for the attributes in file_data
+        :param model:
+        :return Dict[str, Any]:
+        """
+        return {k: getattr(model, k, None) for d in self.file_data for k in d}
+
+    def _set_file_data(self, model: Any = None, **file_data) -> List[Dict[str, str]]:
+        """
+        Adds items to files & file_data. Each call starts a new batch
+        so files from an earlier call are never saved twice.
+        :param model: The files are checked against the rules of its Columns
         :key files: Dict[str: Any] Key is the filename & Value
         is the file.
         :return:  List[Dict[str, str]]
         """
+        self.files = []
+        self.file_data = []
         for k, v in file_data.get("files").items():
             setattr(v, "filename", secure_filename(getattr(v, "filename")))
+            file_dict = self._create_file_dict(v, k, _ModelUtils.get_file_rules(model, k))
+            if not file_dict:
+                # Files that are not allowed are never written
+                continue
             self.files.append(v)
-            self.file_data.append(self._create_file_dict(v, k))
+            self.file_data.append(file_dict)
         return self.file_data
 
     def _set_model_attrs(self, model: Any) -> None:
@@ -613,6 +1407,7 @@ class FileUpload:
             for k, v in d.items():
                 self._check_attrs(model, k)
                 setattr(model, k, v)
+                _ModelUtils.clear_file_url(model, k.rsplit("__", 1)[0])
 
     def stream_file(self, model, **kwargs) -> Any:
         """
@@ -649,13 +1444,100 @@ class FileUpload:
             return None
 
         self.file_utils = FileUtils(model, self.config)
-        primary_key = _ModelUtils.get_primary_key(model)
-        model_id = getattr(model, primary_key, None)
-        return send_from_directory(
-            self.file_utils.get_stream_path(model_id),
-            _ModelUtils.get_original_file_name(filename, model),
-            conditional=True,
-        )
+        return self._send_file(model, filename)
+
+    def _send_file(self, model: Any, filename: str) -> Any:
+        """
+        If the Column declares a digest or upload time column, conditional
+        requests are answered from the model's values with a 304 before the
+        storage backend is touched. The ``ETag``, ``Last-Modified`` &
+        ``Cache-Control`` headers are set from the model & the Column.
+        :param model: SqlAlchemy model instance.
+        :param filename: The attribute name defined on your SqlAlchemy model
+        :return: Flask response object
+        """
+        column = _ModelUtils.get_file_columns(model).get(filename)
+        etag = _ModelUtils.get_by_postfix(model, filename, column.digest) if column and column.digest else None
+        last_modified = None
+        if column and column.timestamp:
+            last_modified = _ModelUtils.get_by_postfix(model, filename, _ModelUtils.uploaded_at_key)
+        if (etag or last_modified) and request.method in ("GET", "HEAD") \
+                and not is_resource_modified(request.environ, etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            response = self._get_file_response(model, filename)
+        if etag:
+            response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        if column and column.cache_control:
+            response.headers["Cache-Control"] = column.cache_control
+        return response
+
+    def _get_file_response(self, model: Any, filename: str) -> Any:
+        """
+        If ``sendfile`` is set the front end server sends the file. Files stored by
+        :class:`~flask_file_upload.storage.LocalStorage` are sent with
+        ``send_from_directory``. Files stored by any other backend are streamed
+        from the backend with support for range requests.
+        :param model: SqlAlchemy model instance.
+        :param filename: The attribute name defined on your SqlAlchemy model
+        :return: Flask response object
+        """
+        storage = self.config.storage
+        model_id = _ModelUtils.get_id_value(model)
+        original_file_name = _ModelUtils.get_original_file_name(filename, model)
+        if self.config.sendfile and (self.config.sendfile_prefix or isinstance(storage, LocalStorage)):
+            return self._offload_file(model, filename, original_file_name)
+        if isinstance(storage, LocalStorage):
+            return send_from_directory(
+                storage.path(self.file_utils.get_stream_key(model_id)),
+                original_file_name,
+                conditional=True,
+            )
+
+        key = self.file_utils.get_file_key(model_id, original_file_name)
+        try:
+            size = storage.size(key)
+        except FileNotFoundError:
+            raise NotFound()
+        mimetype = _ModelUtils.get_by_postfix(model, filename, "mime_type") or "application/octet-stream"
+        byte_range = request.range.range_for_length(size) if request.range else None
+        if request.range and byte_range is None:
+            raise RequestedRangeNotSatisfiable(length=size)
+        if byte_range:
+            start, end = byte_range
+            response = Response(storage.get(key, start, end), 206, mimetype=mimetype, direct_passthrough=True)
+            response.content_range = ContentRange("bytes", start, end, size)
+            response.content_length = end - start
+        else:
+            response = Response(storage.get(key), mimetype=mimetype, direct_passthrough=True)
+            response.content_length = size
+        response.accept_ranges = "bytes"
+        return response
+
+    def _offload_file(self, model: Any, filename: str, original_file_name: str) -> Response:
+        """
+        Returns an empty response with an ``X-Accel-Redirect``, ``X-Sendfile``
+        or ``X-LiteSpeed-Location`` header. The file is not opened or stat'ed,
+        the front end server sends it & handles range & conditional requests.
+        :param model: SqlAlchemy model instance.
+        :param filename: The attribute name defined on your SqlAlchemy model
+        :param original_file_name:
+        :return: Flask response object
+        """
+        key = self.file_utils.get_file_key(_ModelUtils.get_id_value(model), original_file_name)
+        if self.config.sendfile_prefix:
+            location = f"{self.config.sendfile_prefix.rstrip('/')}/{key}"
+        else:
+            # Apache & lighttpd, ``init_config`` requires a prefix for the other servers
+            location = os.path.abspath(self.config.storage.path(key))
+        mimetype = _ModelUtils.get_by_postfix(model, filename, "mime_type") or "application/octet-stream"
+        response = Response(mimetype=mimetype)
+        response.headers[SENDFILE_HEADERS[self.config.sendfile]] = location
+        # The front end server sets the length of the file it sends
+        response.automatically_set_content_length = False
+        return response
 
     def update_files(self, model: Any, db=None, **kwargs):
         """
@@ -702,7 +1584,7 @@ class FileUpload:
             warn("'files' is a Required Argument")
             return None
 
-        commit = kwargs.get("commit") or True
+        commit = kwargs.get("commit", True)
 
         if db:
             warn(
@@ -720,28 +1602,258 @@ class FileUpload:
             original_file_names.append(value)
 
         # Set file_data
-        self._set_file_data(**kwargs)
+        self._set_file_data(model, **kwargs)
+        previous_attrs = self._get_model_attrs(model)
         self._set_model_attrs(model)
 
         self.file_utils = FileUtils(model, self.config)
 
-        # Save files to dirs
-        self._save_files_to_dir(model)
+        # Save files to dirs, the original files are kept if this fails
+        self._save_files_to_dir(model, previous_attrs)
 
         # remove original files from directory
-        for f in original_file_names:
-            primary_key = _ModelUtils.get_primary_key(model)
-            model_id = getattr(model, primary_key, None)
+        self._remove_original_files(self._get_original_keys(model, original_file_names))
+
+        return _ModelUtils.commit_session(self.db, model, commit)
+
+    def _get_original_keys(self, model: Any, original_file_names: List[str]) -> List[str]:
+        """
+        Files replaced by a new file with the same name have already been
+        overwritten, so they are not returned
+        :param model:
+        :param original_file_names:
+        :return List[str]:
+        """
+        model_id = _ModelUtils.get_id_value(model)
+        new_file_names = {f.filename for f in self.files}
+        return [
+            self.file_utils.get_file_key(model_id, f)
+            for f in original_file_names
+            if f and f not in new_file_names
+        ]
+
+    def _remove_original_files(self, keys: List[str]) -> None:
+        """
+        :param keys:
+        :return None:
+        """
+        for key in keys:
             # If the model is updated later with file attributes the file path
             # then has not yet been created, so we do not have to remove the old
             # files etc:
             try:
-                os.remove(f"{self.file_utils.get_stream_path(model_id)}/{f}")
+                self.config.storage.delete(key)
             except FileNotFoundError:
                 pass
 
+    async def _run_in_executor(self, fn, *args) -> Any:
+        """
+        Runs the blocking ``fn`` on the async thread pool. The current context
+        is copied so the upload state is available. Flask's request context is
+        only carried over by Flask 2.0+, which keeps it in a ``ContextVar``, so
+        a ``RuntimeError`` is raised in a request on older versions.
+        :param fn:
+        :param args:
+        :return Any:
+        """
+        in_request = has_request_context()
+
+        def run():
+            if in_request and not has_request_context():
+                raise RuntimeError(
+                    "Flask-File-Upload: The async methods need Flask 2.0 or later "
+                    "to use the request context in the thread pool"
+                )
+            return fn(*args)
+
+        ctx = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._async_executor, functools.partial(ctx.run, run))
+
+    async def async_add_files(self, model, **kwargs) -> Any:
+        """
+        The coroutine version of ``file_upload.add_files``. The files are
+        written on a dedicated thread pool so the event loop is never blocked.
+        Example::
+
+            blog_post = await file_upload.async_add_files(blog_post, files={
+                "my_video": my_video,
+            })
+
+        :param model: The SqlAlchemy model instance
+        :key files: A *Dict of attribute name(s) defined in your SqlAlchemy model
+        :return: The updated SqlAlchemy model instance
+        """
+        self._set_file_data(model, **kwargs)
+        previous_attrs = self._get_model_attrs(model)
+        self._set_model_attrs(model)
+        self.file_utils = FileUtils(model, self.config)
+        await self._run_in_executor(self._save_files_to_dir, model, previous_attrs)
+        return model
+
+    async def async_save_files(self, model, **kwargs) -> Any:
+        """
+        The coroutine version of ``file_upload.save_files``. The session is
+        committed from the calling thread exactly as ``save_files`` does & only
+        the file writes run on the thread pool. Example::
+
+            blog_post = await file_upload.async_save_files(blog_post, files={
+                "my_video": my_video,
+                "placeholder_img": placeholder_img,
+            })
+
+        :param model: The SqlAlchemy model instance
+        :key files: A *Dict of attribute name(s) defined in your SqlAlchemy model
+        :key commit_session: Default is `True`
+        :return: The updated SqlAlchemy model instance
+        """
+        self._set_file_data(model, **kwargs)
+        previous_attrs = self._get_model_attrs(model)
+        self._set_model_attrs(model)
+
+        self.file_utils = FileUtils(model, self.config)
+
+        commit_session = kwargs.get("commit_session") or True
+        model = _ModelUtils.commit_session(self.db, model, commit_session)
+        try:
+            await self._run_in_executor(self._save_files_to_dir, model, previous_attrs)
+        except SaveFilesError:
+            _ModelUtils.commit_session(self.db, model, commit_session)
+            raise
+        self._commit_file_metadata(model, commit_session)
+        return model
+
+    async def async_update_files(self, model: Any, **kwargs) -> Any:
+        """
+        The coroutine version of ``file_upload.update_files``. Example::
+
+            blog_post = await file_upload.async_update_files(blog_post, files={
+                "my_video": new_my_video,
+            })
+
+        :param model: SqlAlchemy model instance.
+        :key files Dict[str, Any]: A dict with the key representing the model attr
+             name & file as value.
+        :key commit: Default is True
+        :return Any: Returns the model back
+        """
+        try:
+            files = kwargs["files"]
+        except KeyError:
+            warn("'files' is a Required Argument")
+            return None
+
+        commit = kwargs.get("commit", True)
+        original_file_names = [_ModelUtils.get_by_postfix(model, f, "file_name") for f in files]
+
+        self._set_file_data(model, **kwargs)
+        previous_attrs = self._get_model_attrs(model)
+        self._set_model_attrs(model)
+
+        self.file_utils = FileUtils(model, self.config)
+
+        await self._run_in_executor(self._save_files_to_dir, model, previous_attrs)
+        await self._run_in_executor(
+            self._remove_original_files,
+            self._get_original_keys(model, original_file_names),
+        )
         return _ModelUtils.commit_session(self.db, model, commit)
 
+    async def async_delete_files(self, model: Any, **kwargs) -> Union[Any, None]:
+        """
+        The coroutine version of ``file_upload.delete_files``. The files are
+        removed on the thread pool & the model is cleaned up & committed from
+        the calling thread. Example::
+
+            blog = await file_upload.async_delete_files(blog_result, files=["my_video"])
+
+        :param model: Instance of a SqlAlchemy Model
+        :key files: A list of the file names declared on your model.
+        :key commit: Default is set to True.
+        :key parent: Default is set to False.
+        :key clean_up: Default is None. Either ``files`` or ``model``.
+        :return: SqlAlchemy model object
+        """
+        self.file_utils = FileUtils(model, self.config)
+
+        clean_up = kwargs.get("clean_up")
+        commit = kwargs.get("commit", True)
+        parent = kwargs.get("parent") or False
+
+        try:
+            files: List[str] = kwargs["files"]
+        except KeyError:
+            raise TypeError("Flask-File-Upload: 'files' is a required argument")
+
+        await self._run_in_executor(
+            self._remove_files,
+            *self._get_delete_keys(model, files, clean_up, parent),
+        )
+        return self._clean_up_model(model, files, clean_up, commit)
+
+    async def async_stream_file(self, model, **kwargs) -> Any:
+        """
+        The coroutine version of ``file_upload.stream_file``. Example::
+
+            return await file_upload.async_stream_file(blog, filename="my_video")
+
+        :param model: SqlAlchemy model instance.
+        :key filename: The attribute name defined on your SqlAlchemy model
+        :return: Flask response object or None.
+        """
+        try:
+            filename = kwargs['filename']
+        except KeyError:
+            warn("'files' is a Required Argument")
+            return None
+
+        self.file_utils = FileUtils(model, self.config)
+        return await self._run_in_executor(self._send_file, model, filename)
+
+    @property
+    def file_data(self) -> List[Dict[str, str]]:
+        """
+        All the file related model attributes & values are stored
+        here as a list of dicts. Scoped to the current call.
+        """
+        file_data = _file_data.get()
+        if file_data is None:
+            file_data = []
+            _file_data.set(file_data)
+        return file_data
+
+    @file_data.setter
+    def file_data(self, file_data: List[Dict[str, str]]):
+        _file_data.set(file_data)
+
+    @property
+    def files(self) -> List[Any]:
+        """
+        A record of the original files used when saving files
+        to the server. Scoped to the current call.
+        """
+        files = _files.get()
+        if files is None:
+            files = []
+            _files.set(files)
+        return files
+
+    @files.setter
+    def files(self, files: List[Any]):
+        _files.set(files)
+
+    @property
+    def file_utils(self) -> FileUtils:
+        """
+        A class containing utility methods for working with files.
+        See :class:`~flask_file_upload.file_utils` for more information.
+        """
+        return _file_utils.get()
+
+    @file_utils.setter
+    def file_utils(self, file_utils: FileUtils):
+        _file_utils.set(file_utils)
+
     @property
     def db(self):
         if self._db:
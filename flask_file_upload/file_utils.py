@@ -2,10 +2,12 @@
     Helper class
 """
 import os
-import errno
+from datetime import datetime
+from typing import Any, Dict, Optional
 
 from ._config import Config
-from ._model_utils import _ModelUtils
+from ._model_utils import _ModelUtils, _FileRules, NO_RULES
+from ._stream import measure
 
 
 class FileUtils:
@@ -25,14 +27,30 @@ class FileUtils:
         self.table_name = _ModelUtils.get_table_name(model)
 
     @staticmethod
-    def allowed_file(filename, config: Config) -> bool:
+    def allowed_file(filename, config: Config, rules: _FileRules = NO_RULES) -> bool:
         """
         :param filename:
         :param config:
+        :param rules: The Column's rules. Its ``allowed_extensions`` replace the config's
         :return bool:
         """
-        return "." in filename and \
-            filename.rsplit(".", 1)[1].lower() in config.allowed_extensions
+        _, dot, ext = filename.rpartition(".")
+        return bool(dot) and rules.allows_extension(ext.lower(), config.allowed_extension_set)
+
+    @staticmethod
+    def get_size(file: Any) -> Optional[int]:
+        """
+        :param file: Werkzeug's FileStorage or any seekable file object
+        :return: The size in bytes or None if the file can not be seeked
+        """
+        stream = getattr(file, "stream", file)
+        try:
+            position = stream.tell()
+            size = stream.seek(0, os.SEEK_END)
+            stream.seek(position)
+        except (AttributeError, OSError, ValueError):
+            return None
+        return size
 
     def postfix_file_path(self, id: int, filename: str) -> str:
         """
@@ -40,7 +58,7 @@ class FileUtils:
         :param filename:
         :return str:
         """
-        return f"/{self.table_name}/{id}/{filename}"
+        return f"/{self.get_stream_key(id)}/{filename}"
 
     def get_file_path(self, model_id: int, filename: str) -> str:
         """
@@ -50,21 +68,44 @@ class FileUtils:
         """
         return os.path.join(f"{self.config.upload_folder}{self.postfix_file_path(model_id, filename)}")
 
-    def save_file(self, file, model_id: int) -> None:
+    def get_file_key(self, model_id: int, filename: str) -> str:
+        """
+        The key used by the storage backend, e.g. ``blogs/1/my_video.mp4``
+        :param model_id:
+        :param filename:
+        :return str:
+        """
+        return self.postfix_file_path(model_id, filename)[1:]
+
+    def get_stream_key(self, model_id: int) -> str:
+        """
+        The key prefix of every file stored for a model, e.g. ``blogs/1``
+        :param model_id:
+        :return str:
+        """
+        return self.config.layout.prefix(self.table_name, model_id)
+
+    def save_file(self, file, model_id: int) -> Dict[str, Any]:
         """
+        Writes the file through the configured storage backend.
+        If the file was streamed into the staging directory (see
+        ``stream_uploads``) the local backend moves it into place
+        with a rename, otherwise Werkzeug copies the file to ``file_path``.
+        If the model declares size or digest columns, these are computed
+        from the bytes as they are written.
         :param file:
         :param model_id:
-        :return None:
+        :return Dict[str, Any]: The ``size``, hex digests & ``uploaded_at`` time keyed
+            by column suffix, or an empty dict if the model has no such columns
         """
-        file_path = self.get_file_path(model_id, file.filename)
-        if not os.path.exists(os.path.dirname(file_path)):
-            try:
-                os.makedirs(os.path.dirname(file_path))
-            except OSError as err:
-                if err.errno != errno.EEXIST:
-                    raise OSError("[FLASK_FILE_UPLOAD_ERROR]: Couldn't create file path: "
-                                  f"{file_path}")
-        file.save(file_path)
+        key = self.get_file_key(model_id, file.filename)
+        columns = _ModelUtils.get_file_columns(self.model)
+        if not any(_ModelUtils.get_metadata_keys(c) for c in columns.values()):
+            self.config.storage.put(key, file)
+            return {}
+        file, metadata = measure(file, {c.digest for c in columns.values() if c.digest})
+        self.config.storage.put(key, file)
+        return {**metadata(), _ModelUtils.uploaded_at_key: datetime.utcnow()}
 
     def get_stream_path(self, model_id: int):
-        return os.path.join(f"{self.config.upload_folder}/{self.table_name}/{model_id}")
+        return os.path.join(f"{self.config.upload_folder}/{self.get_stream_key(model_id)}")
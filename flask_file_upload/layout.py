@@ -0,0 +1,301 @@
+"""
+Directory Layouts
+=================
+A layout decides the directory (or storage key prefix) each model's files
+are stored under. The default :class:`FlatLayout` stores files under
+``<table_name>/<id>/<filename>``, which leaves one directory per row in each
+table directory. For large tables use :class:`ShardedLayout`, which adds a
+2 level hex fan-out derived from a hash of the id, for example
+``blogs/c4/ca/1/my_video.mp4``. Set the layout with the ``layout`` kwarg or
+``app.config["FILE_UPLOAD_LAYOUT"]``. Example::
+
+    app.config["FILE_UPLOAD_LAYOUT"] = "sharded"
+
+Existing files can be moved to a new layout with the ``migrate-layout``
+command, which can be stopped & restarted at any point::
+
+    flask file-upload migrate-layout --source flat --target sharded
+"""
+import os
+import sys
+import hashlib
+from typing import Iterator, Tuple, Union, Callable
+
+
+class FlatLayout:
+    """
+    ``<table_name>/<id>``
+    """
+
+    name = "flat"
+
+    def prefix(self, table_name: str, model_id: Union[int, str]) -> str:
+        """
+        :param table_name:
+        :param model_id:
+        :return str: The key prefix the model's files are stored under
+        """
+        return f"{table_name}/{model_id}"
+
+    def iter_models(self, root: str) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the ``(table_name, id)`` of every model directory found under ``root``
+        :param root:
+        :return Iterator[Tuple[str, str]]:
+        """
+        for table_name in _list_dirs(root):
+            for model_id in _list_dirs(os.path.join(root, table_name)):
+                yield table_name, model_id
+
+
+def _md5(data: bytes) -> str:
+    """
+    md5 is only used to spread the ids, so it is marked as not used for
+    security. FIPS enabled builds refuse md5 otherwise.
+    :param data:
+    :return str: The hex digest
+    """
+    if sys.version_info >= (3, 9):
+        return hashlib.md5(data, usedforsecurity=False).hexdigest()
+    return hashlib.md5(data).hexdigest()
+
+
+class ShardedLayout(FlatLayout):
+    """
+    ``<table_name>/<xx>/<yy>/<id>``, where ``xx`` & ``yy`` are taken from
+    the md5 hex digest of the id, so each table directory holds at most
+    256 entries per level.
+
+    :param levels: The number of directory levels
+    :param width: The number of hex characters per level
+    """
+
+    name = "sharded"
+
+    def __init__(self, levels: int = 2, width: int = 2):
+        self.levels = levels
+        self.width = width
+
+    def prefix(self, table_name: str, model_id: Union[int, str]) -> str:
+        digest = _md5(str(model_id).encode())
+        shards = "/".join(digest[i * self.width:(i + 1) * self.width] for i in range(self.levels))
+        return f"{table_name}/{shards}/{model_id}"
+
+    def iter_models(self, root: str) -> Iterator[Tuple[str, str]]:
+        for table_name in _list_dirs(root):
+            dirs = [os.path.join(root, table_name)]
+            for _ in range(self.levels):
+                dirs = [os.path.join(d, s) for d in dirs for s in _list_dirs(d) if len(s) == self.width]
+            for d in dirs:
+                for model_id in _list_dirs(d):
+                    yield table_name, model_id
+
+
+#: The layouts that can be set by name
+LAYOUTS = {
+    FlatLayout.name: FlatLayout,
+    ShardedLayout.name: ShardedLayout,
+}
+
+
+def get_layout(layout: Union[str, FlatLayout, None]) -> FlatLayout:
+    """
+    :param layout: A layout name or instance
+    :return FlatLayout:
+    """
+    if layout is None:
+        return FlatLayout()
+    if isinstance(layout, str):
+        try:
+            return LAYOUTS[layout]()
+        except KeyError:
+            raise ValueError(f"Flask-File-Upload: Unknown layout '{layout}'. Choose from {list(LAYOUTS)}")
+    return layout
+
+
+def _list_dirs(path: str) -> Iterator[str]:
+    """
+    Skips hidden directories such as the ``.staging`` directory
+    :param path:
+    :return Iterator[str]:
+    """
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir() and not entry.name.startswith("."):
+            yield entry.name
+
+
+#: The journal recording the migration plan & progress of ``migrate_layout``
+MIGRATION_JOURNAL = ".layout-migration"
+
+#: Model directories are moved through this directory, as a directory in the
+#: target layout may have the same path as a directory in the source layout
+MIGRATION_FOLDER = ".layout-migration-tmp"
+
+
+def migrate_layout(root: str, source: FlatLayout, target: FlatLayout,
+                   progress: Callable[[int, int, str], None] = None) -> int:
+    """
+    Moves every model directory under ``root`` from the ``source`` layout to
+    the ``target`` layout. The directories to move are listed once & written
+    to a journal file. Each directory is then renamed into a temporary
+    directory & from there into the target layout, one directory at a time,
+    so the files of every other model stay where they are. A source directory
+    standing in the way of a target directory (e.g. ``blogs/12`` & the shard
+    ``blogs/12/ab``) is moved to the temporary directory first. An interrupted
+    migration carries on where it stopped when it is run again. The journal
+    is removed once the migration completes.
+
+    If a target directory already exists, e.g. because a worker using the new
+    layout saved files to it, the directories are merged. A file found in
+    both raises a ``FileExistsError`` & nothing is overwritten.
+    :param root: The ``UPLOAD_FOLDER``
+    :param source:
+    :param target:
+    :param progress: Called with the number of directories done, the total
+        & the new prefix after each directory is moved
+    :return int: The number of directories moved by this run
+    """
+    journal_path = os.path.join(root, MIGRATION_JOURNAL)
+    tmp_root = os.path.join(root, MIGRATION_FOLDER)
+    plan, done = _read_journal(journal_path)
+    if plan is None:
+        # The plan is written before anything is moved as the source tree
+        # can not be listed reliably once the migration has started
+        plan = list(source.iter_models(root))
+        with open(journal_path, "w") as journal:
+            journal.writelines(f"plan {table_name} {model_id}\n" for table_name, model_id in plan)
+            journal.write("planned\n")
+
+    #: The source prefixes of the directories not moved yet
+    pending = {
+        source.prefix(table_name, model_id): (table_name, model_id)
+        for table_name, model_id in plan
+        if f"{table_name}/{model_id}" not in done
+    }
+
+    def stage(prefix, table_name, model_id):
+        src = os.path.join(root, prefix)
+        tmp = os.path.join(tmp_root, table_name, model_id)
+        # Once staged, ``src`` may have become a directory of the target layout
+        if os.path.isdir(src) and not os.path.exists(tmp):
+            _move(src, tmp)
+            _remove_empty_dirs(os.path.dirname(src), os.path.join(root, table_name))
+
+    moved = 0
+    with open(journal_path, "a") as journal:
+        for table_name, model_id in plan:
+            if f"{table_name}/{model_id}" in done:
+                continue
+            src_prefix = source.prefix(table_name, model_id)
+            dest_prefix = target.prefix(table_name, model_id)
+            pending.pop(src_prefix, None)
+            stage(src_prefix, table_name, model_id)
+            for blocking in _blocking_prefixes(root, pending, dest_prefix):
+                stage(blocking, *pending.pop(blocking))
+            tmp = os.path.join(tmp_root, table_name, model_id)
+            if os.path.isdir(tmp):
+                _move(tmp, os.path.join(root, dest_prefix))
+                moved += 1
+            journal.write(f"done {table_name}/{model_id}\n")
+            journal.flush()
+            done.add(f"{table_name}/{model_id}")
+            if progress:
+                progress(len(done), len(plan), dest_prefix)
+    _remove_empty_dirs(tmp_root)
+    os.remove(journal_path)
+    return moved
+
+
+def _blocking_prefixes(root: str, pending: dict, dest_prefix: str) -> list:
+    """
+    :param root:
+    :param pending: The source prefixes not moved yet
+    :param dest_prefix:
+    :return list: The pending source directories ``dest_prefix`` would be
+        created in, or that are inside an existing ``dest_prefix``
+    """
+    parts = dest_prefix.split("/")
+    blocking = [p for p in ("/".join(parts[:i]) for i in range(2, len(parts) + 1)) if p in pending]
+    if os.path.isdir(os.path.join(root, dest_prefix)):
+        blocking += [p for p in pending if p.startswith(f"{dest_prefix}/")]
+    return blocking
+
+
+def _move(src: str, dest: str) -> None:
+    """
+    Renames ``src`` to ``dest`` or, if ``dest`` exists, moves the contents of
+    ``src`` into it
+    :param src: A directory
+    :param dest:
+    :raises FileExistsError: If a file exists in both directories
+    :return None:
+    """
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.rename(src, dest)
+        return
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dest_path = os.path.join(dest, name)
+        if os.path.isdir(src_path) and os.path.isdir(dest_path):
+            _move(src_path, dest_path)
+        elif os.path.exists(dest_path):
+            raise FileExistsError(
+                f"Flask-File-Upload: {dest_path} exists in the target layout. The source file "
+                f"was left at {src_path}. Remove one of them & run migrate-layout again"
+            )
+        else:
+            os.rename(src_path, dest_path)
+    os.rmdir(src)
+
+
+def _read_journal(journal_path: str) -> Tuple[Union[list, None], set]:
+    """
+    :param journal_path:
+    :return: The planned ``(table_name, id)`` list, or None if there is no complete
+        plan yet & the set of ``table_name/id`` already moved to the target layout
+    """
+    plan = []
+    done = set()
+    planned = False
+    try:
+        with open(journal_path) as f:
+            for line in f:
+                entry = line.rstrip("\n").split(" ")
+                if entry[0] == "plan" and len(entry) == 3:
+                    plan.append((entry[1], entry[2]))
+                elif entry[0] == "planned":
+                    planned = True
+                elif entry[0] == "done" and len(entry) == 2:
+                    done.add(entry[1])
+    except FileNotFoundError:
+        pass
+    return (plan if planned else None), done
+
+
+def _remove_empty_dirs(path: str, stop: str = None) -> None:
+    """
+    Removes the empty shard directories left behind by a move. If ``stop``
+    is not set, every empty directory inside ``path`` & ``path`` itself are
+    removed. Directories that are not empty are kept.
+    :param path:
+    :param stop: The directory to stop at, going up from ``path``
+    :return None:
+    """
+    if stop is None:
+        for dir_path, _, _ in os.walk(path, topdown=False):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass
+        return
+    while os.path.normpath(path) != os.path.normpath(stop):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
@@ -16,13 +16,45 @@ Full example::
        id = db.Column(db.Integer, primary_key=True)
        my_placeholder = file_upload.Column()
        my_video = file_upload.Column()
+
+Each ``file_upload.Column()`` also gets a ``<column>_url`` attribute that
+returns the file's url. It is computed the first time it is read &
+kept on the instance::
+
+   blog.my_video_url  # "http://localhost/static/blogs/1/my_video.mp4"
 """
+from typing import Any, Callable
+
 from ._model_utils import _ModelUtils
 
 
-def create_model(db):
+class _FileUrl:
+    """
+    A non data descriptor returning the url of a file attribute. The url is
+    stored in the instance's ``__dict__`` on first access, so later reads
+    (& urls set by ``add_file_urls_to_models``) never reach the descriptor.
+    """
+
+    def __init__(self, filename: str, get_file_url: Callable[[Any, str], str]):
+        self.filename = filename
+        self.name = _ModelUtils.get_url_key(filename)
+        self.get_file_url = get_file_url
+
+    def __get__(self, instance: Any, owner: Any = None) -> Any:
+        if instance is None:
+            return self
+        if _ModelUtils.get_original_file_name(self.filename, instance) is None:
+            # No file has been saved yet, so there is nothing to keep
+            return None
+        url = self.get_file_url(instance, self.filename)
+        instance.__dict__[self.name] = url
+        return url
+
+
+def create_model(db, get_file_url: Callable[[Any, str], str] = None):
     #: We pass the db instance here as ``_ModelUtils.get_attr_from_model``
-    #: requires access to the SQLAlchemy object.
+    #: requires access to the SQLAlchemy object. ``get_file_url`` builds
+    #: the urls returned by each ``<column>_url`` attribute.
     class Model:
 
         def __new__(cls, _class=None, *args, **kwargs):
@@ -48,6 +80,11 @@ def create_model(db):
             new_cols = []
             filenames = []
             new_cols_list, filenames_list = _ModelUtils.get_attr_from_model(instance, new_cols, filenames, db)
+            _ModelUtils.set_file_columns(instance, filenames_list)
+            if get_file_url:
+                for filename in filenames_list:
+                    if not hasattr(instance, _ModelUtils.get_url_key(filename)):
+                        setattr(instance, _ModelUtils.get_url_key(filename), _FileUrl(filename, get_file_url))
             # Add new attributes to the SQLAlchemy model
             _ModelUtils.set_columns(instance, new_cols_list)
             # The original model's attributes set by the user for files get removed here
@@ -0,0 +1,187 @@
+"""
+Signature Sniffing
+==================
+Finds the real type of an upload from the magic bytes at the start of the
+file, without any dependency on libmagic. Only the first :data:`SNIFF_LENGTH`
+bytes are looked at, so the type is known before the rest of the file is
+written. Set ``FILE_UPLOAD_SNIFF_MIME_TYPES`` to store the sniffed mime type &
+extension instead of the ones sent by the client::
+
+    app.config["FILE_UPLOAD_SNIFF_MIME_TYPES"] = True
+
+Files whose real type is not in ``ALLOWED_EXTENSIONS`` are not saved. Files
+without a known signature (e.g. text files) keep the client's values. Magic
+bytes short enough to start a text file (``BM``, ``MZ``, ``ID3``, ...) only
+match if the header after them is valid too, see :data:`CHECKS`.
+"""
+import io
+import mimetypes
+from typing import Any, NamedTuple, Optional, Tuple
+
+
+#: The number of bytes read from the start of a file. The ``tar`` header
+#: magic is the furthest signature, at offset 257.
+SNIFF_LENGTH = 512
+
+
+class Signature(NamedTuple):
+    #: The mime type of the file type
+    mime_type: str
+    #: The canonical extension, without a dot
+    ext: str
+    #: Other extensions used for the same content, e.g. ``docx`` for a zip
+    aliases: Tuple[str, ...] = ()
+
+
+#: ``(offset, magic bytes, signature)``, tried in order
+SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n", Signature("image/png", "png")),
+    (0, b"\xff\xd8\xff", Signature("image/jpeg", "jpg", ("jpeg", "jpe", "jfif"))),
+    (0, b"GIF87a", Signature("image/gif", "gif")),
+    (0, b"GIF89a", Signature("image/gif", "gif")),
+    (0, b"II*\x00", Signature("image/tiff", "tiff", ("tif",))),
+    (0, b"MM\x00*", Signature("image/tiff", "tiff", ("tif",))),
+    (0, b"\x00\x00\x01\x00", Signature("image/x-icon", "ico")),
+    (0, b"BM", Signature("image/bmp", "bmp")),
+    (0, b"%PDF-", Signature("application/pdf", "pdf")),
+    (0, b"PK\x03\x04", Signature("application/zip", "zip", (
+        "docx", "xlsx", "pptx", "odt", "ods", "odp", "epub", "jar", "apk", "whl",
+    ))),
+    (0, b"\x1f\x8b", Signature("application/gzip", "gz", ("tgz",))),
+    (0, b"BZh", Signature("application/x-bzip2", "bz2")),
+    (0, b"\xfd7zXZ\x00", Signature("application/x-xz", "xz")),
+    (0, b"7z\xbc\xaf\x27\x1c", Signature("application/x-7z-compressed", "7z")),
+    (0, b"Rar!\x1a\x07", Signature("application/vnd.rar", "rar")),
+    (257, b"ustar", Signature("application/x-tar", "tar")),
+    (0, b"ID3", Signature("audio/mpeg", "mp3")),
+    (0, b"OggS", Signature("audio/ogg", "ogg", ("oga", "ogv", "opus"))),
+    (0, b"fLaC", Signature("audio/flac", "flac")),
+    (0, b"\x00\x00\x01\xba", Signature("video/mpeg", "mpg", ("mpeg", "mpe"))),
+    (0, b"\x00\x00\x01\xb3", Signature("video/mpeg", "mpg", ("mpeg", "mpe"))),
+    (0, b"\x1a\x45\xdf\xa3", Signature("video/webm", "webm", ("mkv", "mka"))),
+    (0, b"MZ", Signature("application/x-msdownload", "exe", ("dll", "msi"))),
+    (0, b"\x7fELF", Signature("application/x-executable", "elf", ("so", "o"))),
+    (0, b"\x00asm", Signature("application/wasm", "wasm")),
+    (0, b"SQLite format 3\x00", Signature("application/vnd.sqlite3", "sqlite", ("sqlite3", "db"))),
+)
+
+#: The RIFF form types at offset 8
+RIFF_SIGNATURES = {
+    b"WEBP": Signature("image/webp", "webp"),
+    b"WAVE": Signature("audio/wav", "wav"),
+    b"AVI ": Signature("video/x-msvideo", "avi"),
+}
+
+#: The ISO base media (``ftyp`` box) major brands at offset 8. Any other brand is an mp4
+FTYP_SIGNATURES = {
+    b"qt  ": Signature("video/quicktime", "mov", ("qt",)),
+    b"M4A ": Signature("audio/mp4", "m4a"),
+    b"heic": Signature("image/heic", "heic"),
+    b"heix": Signature("image/heic", "heic"),
+    b"mif1": Signature("image/heif", "heif"),
+    b"avif": Signature("image/avif", "avif"),
+    b"3gp4": Signature("video/3gpp", "3gp"),
+    b"3gp5": Signature("video/3gpp", "3gp"),
+}
+
+MP4_SIGNATURE = Signature("video/mp4", "mp4", ("m4v",))
+
+#: The DIB header sizes a BMP file starts its header with at offset 14
+BMP_HEADER_SIZES = {12, 16, 40, 52, 56, 64, 108, 124}
+
+#: The bzip2 block & end of stream magics after the ``BZh<level>`` header
+BZIP2_BLOCK_MAGICS = (b"1AY&SY", b"\x17rE8P\x90")
+
+
+def _is_bmp(head: bytes) -> bool:
+    return int.from_bytes(head[14:18], "little") in BMP_HEADER_SIZES
+
+
+def _is_pe(head: bytes) -> bool:
+    """
+    The DOS header's ``e_lfanew`` at offset 60 points to the ``PE`` header.
+    """
+    if len(head) < 64:
+        return False
+    offset = int.from_bytes(head[60:64], "little")
+    return offset >= 64 and head[offset:offset + 4] == b"PE\x00\x00"
+
+
+def _is_id3(head: bytes) -> bool:
+    """
+    ID3v2.2 - 2.4, with a syncsafe tag size.
+    """
+    return len(head) >= 10 and head[3] in (2, 3, 4) and head[4] != 0xff \
+        and all(byte < 0x80 for byte in head[6:10])
+
+
+def _is_gzip(head: bytes) -> bool:
+    """
+    Deflate, the only compression method, & no reserved flags.
+    """
+    return len(head) > 3 and head[2] == 0x08 and not head[3] & 0xe0
+
+
+def _is_bzip2(head: bytes) -> bool:
+    return len(head) > 3 and head[3:4] in b"123456789" and head[4:10] in BZIP2_BLOCK_MAGICS
+
+
+#: Header checks for the signatures with short magic bytes, by extension
+CHECKS = {
+    "bmp": _is_bmp,
+    "exe": _is_pe,
+    "mp3": _is_id3,
+    "gz": _is_gzip,
+    "bz2": _is_bzip2,
+}
+
+
+def sniff(head: bytes) -> Optional[Signature]:
+    """
+    :param head: The first bytes of a file, see :data:`SNIFF_LENGTH`
+    :return: The file's signature or None if it is not known
+    """
+    if head[4:8] == b"ftyp":
+        return FTYP_SIGNATURES.get(head[8:12], MP4_SIGNATURE)
+    if head[:4] == b"RIFF":
+        return RIFF_SIGNATURES.get(head[8:12])
+    for offset, magic, signature in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            check = CHECKS.get(signature.ext)
+            if check is None or check(head):
+                return signature
+    return None
+
+
+def sniff_file(file: Any) -> Optional[Signature]:
+    """
+    Reads the first :data:`SNIFF_LENGTH` bytes of a seekable file & moves
+    back to where the file was.
+    :param file: Werkzeug's FileStorage or any readable file object
+    :return: The file's signature or None if it is not known or the file
+        can not be rewound
+    """
+    stream = getattr(file, "stream", file)
+    try:
+        position = stream.tell()
+        head = stream.read(SNIFF_LENGTH)
+        stream.seek(position)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return sniff(head)
+
+
+def resolve(signature: Signature, filename: str) -> Tuple[str, str]:
+    """
+    The filename's own extension is kept if it is one of the signature's
+    extensions, e.g. ``report.docx`` is a zip file but stays a ``docx``.
+    :param signature:
+    :param filename:
+    :return Tuple[str, str]: The mime type & extension to store
+    """
+    ext = filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+    if ext == signature.ext:
+        return signature.mime_type, ext
+    if ext in signature.aliases:
+        return mimetypes.guess_type(filename)[0] or signature.mime_type, ext
+    return signature.mime_type, signature.ext
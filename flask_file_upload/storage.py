@@ -0,0 +1,686 @@
+"""
+Storage Backends
+================
+Flask-File-Upload (FFU) writes, reads & removes files through a storage backend.
+By default files are stored on the local filesystem under ``UPLOAD_FOLDER``
+(:class:`LocalStorage`). Pass a different backend to ``FileUpload`` or
+``file_upload.init_app`` with the ``storage`` kwarg. Example::
+
+    from flask_file_upload.storage import S3Storage
+
+    file_upload = FileUpload(
+        app,
+        db,
+        storage=S3Storage(bucket="my-uploads", base_url="https://cdn.example.com"),
+    )
+
+Every file is addressed by a key, which is the file's path relative to
+``UPLOAD_FOLDER``, for example ``blogs/1/my_video.mp4``.
+
+Set ``FILE_UPLOAD_DEDUPLICATE = True`` to store every distinct file once.
+:class:`LocalStorage` then keeps one blob per sha256 digest under
+``<UPLOAD_FOLDER>/.cas`` & hardlinks it to ``<table_name>/<id>/<filename>``,
+so the paths used by ``stream_file`` & ``get_file_url`` stay the same.
+
+:class:`LocalStorage` remembers the directories it has created or found in a
+process-wide LRU, :data:`directory_cache`, so saving another file to a known
+directory costs no ``stat`` or ``mkdir`` call. Its hit rate is kept for
+monitoring::
+
+    from flask_file_upload.storage import directory_cache
+
+    directory_cache.stats()
+    # {"hits": 9800, "misses": 200, "size": 200, "max_size": 4096, "hit_rate": 0.98}
+"""
+import os
+import errno
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Tuple, Union
+
+from ._stream import is_staged, mkstemp
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+    class ClientError(Exception):
+        """
+        Never raised, so clients passed to ``S3Storage`` without boto3
+        installed surface their own errors.
+        """
+
+
+#: The size of the chunks read from & written to a backend
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_chunks(stream: Any, length: int = None) -> Iterator[bytes]:
+    """
+    :param stream: A readable file object
+    :param length: The number of bytes to read, reads to the end of the stream if not set
+    :return Iterator[bytes]:
+    """
+    while length is None or length > 0:
+        chunk = stream.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+        if not chunk:
+            break
+        if length is not None:
+            length -= len(chunk)
+        yield chunk
+
+
+class DirectoryCache:
+    """
+    A bounded LRU of the directories known to exist. ``os.makedirs`` is only
+    called for a directory that is not cached, so saving many files to the
+    same directories does not ``stat`` each one again. A directory removed
+    by another process stays cached until :meth:`LocalStorage.put` fails
+    to write to it, which drops it & creates it again.
+
+    :param max_size: The number of directories kept. ``0`` disables the cache
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._dirs: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def makedirs(self, path: str) -> None:
+        """
+        Creates ``path`` & its parents unless it is cached
+        :param path: A directory path
+        :return None:
+        """
+        with self._lock:
+            if path in self._dirs:
+                self._dirs.move_to_end(path)
+                self.hits += 1
+                return
+            self.misses += 1
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as err:
+            raise OSError(f"[FLASK_FILE_UPLOAD_ERROR]: Couldn't create file path: {path}") from err
+        with self._lock:
+            self._dirs[path] = None
+            while len(self._dirs) > self.max_size:
+                self._dirs.popitem(last=False)
+
+    def discard(self, path: str) -> None:
+        """
+        Forgets ``path`` & every cached directory inside it
+        :param path: A removed directory
+        :return None:
+        """
+        path = os.path.normpath(path)
+        inside = path + os.sep
+        with self._lock:
+            for cached in [d for d in self._dirs if d == path or d.startswith(inside)]:
+                del self._dirs[cached]
+
+    def clear(self) -> None:
+        """
+        Forgets every directory & resets the stats
+        :return None:
+        """
+        with self._lock:
+            self._dirs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        :return Dict[str, Union[int, float]]: The hits, misses, size, max_size
+            & hit_rate (0.0 if there was no lookup yet) of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._dirs),
+                "max_size": self.max_size,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+#: The directories created or found by every :class:`LocalStorage` in this process
+directory_cache = DirectoryCache()
+
+
+class StorageBackend:
+    """
+    The interface every storage backend implements. ``start`` & ``end``
+    byte offsets follow Python's slice semantics (``end`` is exclusive).
+    """
+
+    #: The configuration class used for this library.
+    #: Set by ``FileUpload.init_app``
+    config = None
+
+    def init_config(self, config) -> None:
+        """
+        :param config: See :class:`~flask_file_upload._config`
+        :return None:
+        """
+        self.config = config
+
+    def put(self, key: str, file: Any) -> None:
+        """
+        Stores a file, reading it in chunks.
+        :param key:
+        :param file: Werkzeug's FileStorage or any readable file object
+        :return None:
+        """
+        raise NotImplementedError
+
+    def get(self, key: str, start: int = None, end: int = None) -> Iterator[bytes]:
+        """
+        :param key:
+        :param start: The first byte to return
+        :param end: The byte to stop at (exclusive)
+        :return Iterator[bytes]:
+        """
+        raise NotImplementedError
+
+    def size(self, key: str) -> int:
+        """
+        :param key:
+        :return int: The file size in bytes
+        """
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """
+        :param key:
+        :raises FileNotFoundError: If the key does not exist
+        :return None:
+        """
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> None:
+        """
+        Removes every file stored under ``prefix``, e.g. ``blogs/1``
+        :param prefix:
+        :return None:
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        """
+        :param key:
+        :return bool:
+        """
+        raise NotImplementedError
+
+    def url(self, key: str) -> Union[str, None]:
+        """
+        :param key:
+        :return: The public url of the file or None if files are served
+            from Flask's static folder
+        """
+        return None
+
+
+#: The content addressed store directory name, created inside the ``LocalStorage`` root
+CAS_FOLDER = ".cas"
+
+#: The directory inside :data:`CAS_FOLDER` mapping each blob's inode number to
+#: its digest, so the blob of a model path is found without hashing the file
+INODE_FOLDER = "ino"
+
+#: ``"none"`` leaves flushing to the OS, ``"file"`` fsyncs each file before it
+#: is renamed into place & ``"full"`` also fsyncs the directory after the rename
+FSYNC_POLICIES = ("none", "file", "full")
+
+
+class LocalStorage(StorageBackend):
+    """
+    Stores files on the local filesystem. This is the default backend &
+    keeps the ``<UPLOAD_FOLDER>/<table_name>/<id>/<filename>`` layout.
+
+    Every file is written to a temporary file in the destination directory
+    & moved into place with ``os.replace``, so a reader sees either the old
+    or the new file, never a partially written one.
+
+    With ``deduplicate`` set, each file is hashed while it is written & stored
+    once as ``.cas/<xx>/<sha256>``. The model path is a hardlink to that blob,
+    so the blob's link count is its reference count: a blob is removed when
+    the last model path linking to it is deleted or replaced.
+    ``.cas/ino/<inode>`` links to the digest of each blob, so the blob of the
+    last reference is found without reading the file again.
+
+    :param root: The directory files are stored in. Defaults to ``UPLOAD_FOLDER``
+    :param deduplicate: Defaults to ``FILE_UPLOAD_DEDUPLICATE``
+    :param fsync: One of :data:`FSYNC_POLICIES`. Defaults to ``FILE_UPLOAD_FSYNC``
+    """
+
+    def __init__(self, root: str = None, deduplicate: bool = None, fsync: str = None):
+        if fsync is not None and fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Flask-File-Upload: fsync must be one of {FSYNC_POLICIES}")
+        self._root = root
+        self._deduplicate = deduplicate
+        self._fsync = fsync
+
+    @property
+    def root(self) -> str:
+        return self._root or self.config.upload_folder
+
+    @property
+    def deduplicate(self) -> bool:
+        if self._deduplicate is not None:
+            return self._deduplicate
+        return bool(self.config and self.config.deduplicate)
+
+    @property
+    def fsync(self) -> str:
+        if self._fsync is not None:
+            return self._fsync
+        return self.config.fsync if self.config else "none"
+
+    def path(self, key: str) -> str:
+        """
+        :param key:
+        :return str: The filesystem path of the key
+        """
+        return os.path.join(self.root, key)
+
+    def put(self, key: str, file: Any) -> None:
+        file_path = self.path(key)
+        dir_path = os.path.normpath(os.path.dirname(file_path))
+        directory_cache.makedirs(dir_path)
+        try:
+            self._put(file_path, file)
+        except FileNotFoundError:
+            if os.path.isdir(dir_path):
+                raise
+            # The cached directory was removed outside of this process
+            directory_cache.discard(dir_path)
+            directory_cache.makedirs(dir_path)
+            getattr(file, "stream", file).seek(0)
+            self._put(file_path, file)
+
+    def _put(self, file_path: str, file: Any) -> None:
+        """
+        :param file_path: A path in an existing directory
+        :param file:
+        :return None:
+        """
+        if self.deduplicate:
+            self._put_blob(file_path, file)
+            return
+        if is_staged(file) and file.stream.on_disk:
+            staged = file.stream
+            try:
+                if not staged.published:
+                    self._sync_file(staged)
+                # A rename, or a hardlink if the file was already saved once
+                staged.publish(file_path)
+                self._sync_dir(file_path)
+                return
+            except OSError as err:
+                # The staging directory is on another filesystem than ``root``
+                if err.errno != errno.EXDEV:
+                    raise
+            staged.seek(0)
+        fd, tmp_path = mkstemp(os.path.dirname(file_path), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as dest:
+                shutil.copyfileobj(getattr(file, "stream", file), dest, CHUNK_SIZE)
+                self._sync_file(dest)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._sync_dir(file_path)
+
+    def get(self, key: str, start: int = None, end: int = None) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            if start:
+                f.seek(start)
+            length = None if end is None else end - (start or 0)
+            yield from _iter_chunks(f, length)
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key: str) -> None:
+        if self.deduplicate:
+            self._release(self.path(key))
+        else:
+            os.remove(self.path(key))
+
+    def delete_prefix(self, prefix: str) -> None:
+        if self.deduplicate:
+            for dir_path, _, filenames in os.walk(self.path(prefix)):
+                for filename in filenames:
+                    self._release(os.path.join(dir_path, filename))
+        directory_cache.discard(self.path(prefix))
+        shutil.rmtree(self.path(prefix))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def blob_path(self, digest: str) -> str:
+        """
+        :param digest: A sha256 hex digest
+        :return str: The path of the blob storing the content with this digest
+        """
+        return os.path.join(self.root, CAS_FOLDER, digest[:2], digest)
+
+    def inode_path(self, st_ino: int) -> str:
+        """
+        :param st_ino: The inode number of a blob
+        :return str: The path of the symlink whose target is the blob's digest
+        """
+        return os.path.join(self.root, CAS_FOLDER, INODE_FOLDER, str(st_ino))
+
+    def _sync_file(self, f: Any) -> None:
+        """
+        :param f: An open file object
+        :return None:
+        """
+        f.flush()
+        if self.fsync != "none":
+            os.fsync(f.fileno())
+
+    def _sync_dir(self, file_path: str) -> None:
+        """
+        Makes the rename of ``file_path`` durable
+        :param file_path:
+        :return None:
+        """
+        if self.fsync == "full":
+            fd = os.open(os.path.dirname(file_path), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _put_blob(self, file_path: str, file: Any) -> None:
+        """
+        Links ``file_path`` to the blob of the file's content, storing the blob
+        first if this is the first copy. Streamed uploads were hashed as they
+        were staged & are linked into the store without being read again.
+        :param file_path:
+        :param file:
+        :return None:
+        """
+        if is_staged(file) and file.stream.on_disk:
+            staged = file.stream
+            if not staged.published:
+                self._sync_file(staged)
+                try:
+                    self._link_blob(staged.name, staged.hexdigest(), file_path)
+                    # The staged file is now a reference to the blob, so it
+                    # is dropped straight away rather than when the request ends
+                    os.remove(staged.name)
+                    staged.name = file_path
+                    staged.published = True
+                    return
+                except OSError as err:
+                    # The staging directory is on another filesystem than ``root``
+                    if err.errno != errno.EXDEV:
+                        raise
+            staged.seek(0)
+        tmp_folder = os.path.normpath(os.path.join(self.root, CAS_FOLDER, "tmp"))
+        directory_cache.makedirs(tmp_folder)
+        fd, tmp_path = mkstemp(tmp_folder)
+        try:
+            content_hash = hashlib.sha256()
+            with os.fdopen(fd, "wb") as dest:
+                for chunk in _iter_chunks(getattr(file, "stream", file)):
+                    content_hash.update(chunk)
+                    dest.write(chunk)
+                self._sync_file(dest)
+            self._link_blob(tmp_path, content_hash.hexdigest(), file_path)
+        finally:
+            os.remove(tmp_path)
+
+    def _link_blob(self, src: str, digest: str, file_path: str) -> None:
+        """
+        Links the blob to a temporary name next to ``file_path`` & renames it
+        over ``file_path``. The blob of the replaced file is released after.
+        :param src: A file with the content of the digest
+        :param digest:
+        :param file_path: The model path to link to the blob
+        :return None:
+        """
+        blob_path = self.blob_path(digest)
+        link_path = os.path.join(os.path.dirname(file_path), f".{os.path.basename(src)}.tmp")
+        while True:
+            directory_cache.makedirs(os.path.normpath(os.path.dirname(blob_path)))
+            try:
+                os.link(src, blob_path)
+                self._sync_dir(blob_path)
+                self._index_blob(blob_path, digest)
+            except FileExistsError:
+                pass
+            try:
+                os.link(blob_path, link_path)
+                break
+            except FileNotFoundError:
+                if os.path.exists(blob_path):
+                    # The directory of ``file_path`` is missing
+                    raise
+                # The last reference to the blob was deleted by a concurrent
+                # request after we found it, so store it again
+                continue
+        try:
+            replaced = self._find_blob(file_path)
+        except FileNotFoundError:
+            replaced = None
+        if replaced and replaced[0].st_ino == os.stat(link_path).st_ino:
+            # ``file_path`` already links to this blob. A rename between two
+            # links of the same file is a no-op, so drop the new link instead
+            os.remove(link_path)
+            return
+        os.replace(link_path, file_path)
+        self._sync_dir(file_path)
+        if replaced:
+            self._free_blob(*replaced)
+
+    def _find_blob(self, file_path: str) -> Tuple[os.stat_result, Union[str, None]]:
+        """
+        :param file_path: A model path
+        :return: The stat of ``file_path`` & the path of its blob if ``file_path``
+            is the last model path linking to it. The blob is looked up by its
+            inode number. Only blobs missing from the index are hashed.
+        """
+        stat = os.stat(file_path)
+        if stat.st_nlink != 2:
+            return stat, None
+        try:
+            blob_path = self.blob_path(os.readlink(self.inode_path(stat.st_ino)))
+            if os.stat(blob_path).st_ino == stat.st_ino:
+                return stat, blob_path
+        except OSError:
+            pass
+        with open(file_path, "rb") as f:
+            content_hash = hashlib.sha256()
+            for chunk in _iter_chunks(f):
+                content_hash.update(chunk)
+        blob_path = self.blob_path(content_hash.hexdigest())
+        try:
+            if os.stat(blob_path).st_ino == stat.st_ino:
+                self._index_blob(blob_path, content_hash.hexdigest())
+        except FileNotFoundError:
+            pass
+        return stat, blob_path
+
+    def _index_blob(self, blob_path: str, digest: str) -> None:
+        """
+        Records the blob's digest under its inode number
+        :param blob_path:
+        :param digest:
+        :return None:
+        """
+        index_path = self.inode_path(os.stat(blob_path).st_ino)
+        directory_cache.makedirs(os.path.normpath(os.path.dirname(index_path)))
+        try:
+            os.symlink(digest, index_path)
+        except FileExistsError:
+            # Left behind by a removed blob whose inode number was reused
+            os.remove(index_path)
+            os.symlink(digest, index_path)
+
+    def _free_blob(self, stat: os.stat_result, blob_path: Union[str, None]) -> None:
+        """
+        Removes the blob if it is the file ``stat`` was taken from & nothing links to it anymore
+        :param stat:
+        :param blob_path:
+        :return None:
+        """
+        if not blob_path:
+            return
+        try:
+            blob_stat = os.stat(blob_path)
+        except FileNotFoundError:
+            return
+        if blob_stat.st_ino == stat.st_ino and blob_stat.st_nlink == 1:
+            try:
+                os.remove(self.inode_path(stat.st_ino))
+            except FileNotFoundError:
+                pass
+            os.remove(blob_path)
+
+    def _release(self, file_path: str) -> None:
+        """
+        Removes a model path & its blob if no other model path links to it.
+        :param file_path:
+        :return None:
+        """
+        blob = self._find_blob(file_path)
+        os.remove(file_path)
+        self._free_blob(*blob)
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Stores files in a dict. Nothing touches the disk, which makes it
+    a fast backend for tests.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, file: Any) -> None:
+        stream = getattr(file, "stream", file)
+        data = b"".join(_iter_chunks(stream))
+        with self._lock:
+            self.files[key] = data
+
+    def get(self, key: str, start: int = None, end: int = None) -> Iterator[bytes]:
+        try:
+            data = self.files[key]
+        except KeyError:
+            raise FileNotFoundError(key)
+        yield data[start:end]
+
+    def size(self, key: str) -> int:
+        try:
+            return len(self.files[key])
+        except KeyError:
+            raise FileNotFoundError(key)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            try:
+                del self.files[key]
+            except KeyError:
+                raise FileNotFoundError(key)
+
+    def delete_prefix(self, prefix: str) -> None:
+        prefix = f"{prefix.rstrip('/')}/"
+        with self._lock:
+            for key in [k for k in self.files if k.startswith(prefix)]:
+                del self.files[key]
+
+    def exists(self, key: str) -> bool:
+        return key in self.files
+
+
+class S3Storage(StorageBackend):
+    """
+    Stores files in an S3 compatible object store (AWS S3, MinIO, Ceph etc.).
+    Requires ``boto3`` to be installed.
+
+    :param bucket: The bucket name
+    :param prefix: An optional key prefix, e.g. ``"uploads"``
+    :param base_url: The public url files are served from, e.g. a CDN. Defaults
+        to ``<endpoint_url>/<bucket>``
+    :param client: A boto3 S3 client. If not set one is created from ``client_kwargs``
+    :param client_kwargs: Passed to ``boto3.client("s3", **client_kwargs)``, e.g.
+        ``endpoint_url``, ``region_name``
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", base_url: str = None, client: Any = None,
+                 **client_kwargs):
+        if client is None and boto3 is None:
+            raise ImportError("Flask-File-Upload: S3Storage requires boto3. Install it with `pip install boto3`")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = client or boto3.client("s3", **client_kwargs)
+        self.base_url = (base_url or f"{self.client.meta.endpoint_url}/{bucket}").rstrip("/")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, file: Any) -> None:
+        extra_args = {}
+        content_type = getattr(file, "content_type", None)
+        if content_type:
+            extra_args["ContentType"] = content_type
+        self.client.upload_fileobj(getattr(file, "stream", file), self.bucket, self._key(key), ExtraArgs=extra_args)
+
+    def get(self, key: str, start: int = None, end: int = None) -> Iterator[bytes]:
+        kwargs = {}
+        if start is not None or end is not None:
+            kwargs["Range"] = f"bytes={start or 0}-{'' if end is None else end - 1}"
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(key), **kwargs)["Body"]
+        except ClientError as err:
+            if err.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise FileNotFoundError(key)
+            raise
+        yield from body.iter_chunks(CHUNK_SIZE)
+
+    def size(self, key: str) -> int:
+        return self._head(key)["ContentLength"]
+
+    def delete(self, key: str) -> None:
+        self._head(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def delete_prefix(self, prefix: str) -> None:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self._key(prefix).rstrip('/')}/"):
+            objects = [{"Key": o["Key"]} for o in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects})
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._head(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{self._key(key)}"
+
+    def _head(self, key: str) -> Dict[str, Any]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as err:
+            if err.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise FileNotFoundError(key)
+            raise
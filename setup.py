@@ -9,13 +9,16 @@ setup(
     description="Library that works with Flask & SqlAlchemy to store files in your database and server.",
     packages=["flask_file_upload"],
     py_modules=["flask_file_upload"],
+    python_requires=">=3.7",
     install_requires=[
         'flask',
-        'Flask-SQLAlchemy'
+        'Flask-SQLAlchemy',
     ],
+    extras_require={
+        "s3": ["boto3"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
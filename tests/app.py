@@ -1,6 +1,8 @@
 import pytest
 from flask import Flask, request, send_from_directory, current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from flask_file_upload.file_upload import FileUpload
 from flask_file_upload.file_utils import FileUtils
@@ -13,6 +15,19 @@ app.config["UPLOAD_FOLDER"] = "tests/test_path"
 app.config["ALLOWED_EXTENSIONS"] = ["jpg", "png", "mov", "mp4", "mpg"]
 app.config["MAX_CONTENT_LENGTH"] = 1000 * 1024 * 1024
 db = SQLAlchemy(app)
+
+
+# pysqlite does not emit BEGIN, which breaks savepoints. See the SQLAlchemy
+# docs "Serializable isolation / Savepoints / Transactional DDL"
+@event.listens_for(Engine, "connect")
+def _sqlite_connect(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, "begin")
+def _sqlite_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
 file_upload = FileUpload(app, db)
 
 
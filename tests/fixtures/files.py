@@ -4,6 +4,10 @@ import io
 import json
 
 
+#: A DOS header pointing to a PE header, the start of a Windows executable
+EXE_HEAD = b"MZ\x90\x00" + b"\x00" * 56 + b"\x40\x00\x00\x00" + b"PE\x00\x00"
+
+
 @pytest.fixture
 def video_file():
     mock_file = FileStorage(
@@ -5,12 +5,23 @@ import sqlalchemy
 from tests.app import db, file_upload
 
 
+@file_upload.Model
+class NewsAttachmentModel(db.Model):
+    __tablename__ = "news_attachments"
+    id = db.Column(db.Integer(), primary_key=True)
+    news_id = db.Column(db.Integer, db.ForeignKey("news.id"))
+
+    attachment = file_upload.Column()
+
+
 @file_upload.Model
 class NewsModel(db.Model):
     __tablename__ = "news"
     id = db.Column(db.Integer(), primary_key=True)
     title = db.Column(db.String(100))
     blog_id = db.Column(db.Integer, db.ForeignKey("blogs.id"))
+    # Relationships
+    attachments = db.relationship(NewsAttachmentModel, lazy="dynamic")
 
     news_image = file_upload.Column()
     news_video = file_upload.Column()
@@ -44,6 +55,25 @@ class MockBlogModel(db.Model):
     def get_blog_by_id():
         return 1
 
+@file_upload.Model
+class MockDocumentModel(db.Model):
+    __tablename__ = "documents"
+    id = db.Column(db.Integer(), primary_key=True)
+    # File attributes
+    my_document = file_upload.Column(
+        size=True,
+        digest="sha256",
+        timestamp=True,
+        cache_control="public, max-age=86400",
+        max_size=64 * 1024,
+    )
+    my_thumbnail = file_upload.Column(
+        allowed_extensions=["png", "jpg"],
+        allowed_mime_types=["image/*"],
+        max_size=2 * 1024,
+    )
+
+
 class MockModel:
     __tablename__ = "blogs"
     my_video__file_name = "video1"
@@ -63,7 +93,17 @@ def mock_news_model():
     return NewsModel
 
 
+@pytest.fixture
+def mock_news_attachment_model():
+    return NewsAttachmentModel
+
+
 @pytest.fixture
 def mock_blog_model():
     return MockBlogModel
 
+
+
+@pytest.fixture
+def mock_document_model():
+    return MockDocumentModel
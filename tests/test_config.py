@@ -1,3 +1,4 @@
+import pytest
 from flask import Flask
 
 
@@ -19,3 +20,52 @@ class TestConfig:
         assert config.upload_folder == "/test_path"
         assert config.allowed_extensions == ["jpg", "png", "mov", "mp4", "mpg"]
         assert config.max_content_length == 1048576000
+
+    def test_init_config_deduplicate(self):
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = "/test_path"
+        config = Config()
+        config.init_config(app, deduplicate=True)
+
+        assert config.deduplicate
+        assert config.storage.deduplicate
+
+    def test_init_config_sendfile(self):
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = "/test_path"
+        config = Config()
+        config.init_config(app, sendfile="nginx", sendfile_prefix="/protected")
+
+        assert config.sendfile == "nginx"
+        assert config.sendfile_prefix == "/protected"
+        with pytest.raises(ValueError):
+            config.init_config(app, sendfile="iis")
+
+    @pytest.mark.parametrize("server", ["nginx", "litespeed"])
+    def test_init_config_sendfile_needs_prefix(self, server):
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = "/test_path"
+        with pytest.raises(ValueError):
+            Config().init_config(app, sendfile=server)
+
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = "/test_path"
+        config = Config()
+        config.init_config(app, sendfile="lighttpd")
+        assert config.sendfile_prefix is None
+
+    def test_init_config_base_url(self):
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = "/test_path"
+        config = Config()
+        config.init_config(app, base_url="https://cdn.example.com")
+
+        assert config.base_url == "https://cdn.example.com"
+        assert app.config["FILE_UPLOAD_BASE_URL"] == "https://cdn.example.com"
+
+    def test_allowed_extension_set(self):
+        config = Config()
+        config.allowed_extensions = ["JPG", ".png"]
+
+        assert config.allowed_extensions == ["JPG", ".png"]
+        assert config.allowed_extension_set == frozenset({"jpg", "png"})
@@ -1,17 +1,26 @@
 import os
 import pytest
-from flask import Flask, current_app
+from flask import Flask, current_app, url_for
 from werkzeug.datastructures import FileStorage
 from shutil import copyfile
 from flask_sqlalchemy import SQLAlchemy
-import time
 import shutil
+import io
+import asyncio
+import threading
+import hashlib
+import sqlalchemy
+from datetime import datetime, timezone
 
 from flask_file_upload._config import Config
 from flask_file_upload.file_upload import FileUpload
-from tests.fixtures.models import mock_blog_model, mock_model, mock_news_model
+from flask_file_upload._exceptions import SaveFilesError
+from flask_file_upload.storage import MemoryStorage
+from tests.fixtures.models import (
+    mock_blog_model, mock_model, mock_news_model, mock_document_model, mock_news_attachment_model
+)
 from tests.app import create_app, flask_app, db, file_upload, app
-from tests.fixtures.files import video_file, png_file
+from tests.fixtures.files import video_file, png_file, EXE_HEAD
 
 
 class TestFileUploads:
@@ -133,6 +142,146 @@ class TestFileUploads:
         assert rv.get_json()["results"]["news_video_url_2"] == "http://localhost/static/news/2/news_video2.mp4"
 
 
+    def test_add_file_urls_to_models_eager_loads_backref(self, create_app, mock_blog_model, mock_news_model):
+        for i in range(1, 21):
+            db.session.add(mock_blog_model(id=i, name=f"blog_{i}", my_video__file_name="my_video.mp4"))
+            db.session.add_all([
+                mock_news_model(title=f"news_{i}_{n}", blog_id=i, news_image__file_name="news_image.png")
+                for n in range(2)
+            ])
+        db.session.commit()
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda *args: args[2] != "BEGIN" and statements.append(args[2])
+        sqlalchemy.event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            with app.test_request_context():
+                blogs = file_upload.add_file_urls_to_models(
+                    mock_blog_model.query,
+                    filenames=["my_video", "my_placeholder"],
+                    backref={"name": "news", "filenames": ["news_image", "news_video"]},
+                )
+        finally:
+            sqlalchemy.event.remove(db.engine, "before_cursor_execute", listener)
+
+        assert len(statements) == 2
+        assert len(blogs) == 20
+        assert blogs[19].news[1].news_image_url.endswith(f"/news/{blogs[19].news[1].id}/news_image.png")
+
+    def test_add_file_urls_to_models_relationships(self, create_app, mock_blog_model, mock_news_model,
+                                                   mock_news_attachment_model):
+        for i in range(1, 11):
+            db.session.add(mock_blog_model(id=i, name=f"blog_{i}", my_video__file_name="my_video.mp4"))
+            news = mock_news_model(id=i, title=f"news_{i}", blog_id=i, news_image__file_name="news_image.png")
+            db.session.add(news)
+            db.session.add_all([
+                mock_news_attachment_model(news_id=i, attachment__file_name="attachment.pdf")
+                for _ in range(3)
+            ])
+        db.session.commit()
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda *args: args[2] != "BEGIN" and statements.append(args[2])
+        sqlalchemy.event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            with app.test_request_context():
+                blogs = file_upload.add_file_urls_to_models(
+                    mock_blog_model.query,
+                    filenames="my_video",
+                    relationships={
+                        "news": {
+                            "filenames": ["news_image"],
+                            "relationships": {"attachments": {"filenames": ["attachment"]}},
+                        },
+                    },
+                )
+        finally:
+            sqlalchemy.event.remove(db.engine, "before_cursor_execute", listener)
+
+        # blogs, news & one IN query for the dynamic attachments relationship
+        assert len(statements) == 3
+        assert blogs[9].my_video_url.endswith("/blogs/10/my_video.mp4")
+        assert blogs[9].news[0].news_image_url.endswith("/news/10/news_image.png")
+        attachments = blogs[9].news[0].attachments_models
+        assert len(attachments) == 3
+        assert attachments[2].attachment_url.endswith(f"/news_attachments/{attachments[2].id}/attachment.pdf")
+
+    def test_iter_file_urls(self, create_app, mock_blog_model, mock_news_model, mock_news_attachment_model):
+        for i in range(1, 11):
+            db.session.add(mock_blog_model(id=i, name=f"blog_{i}", my_video__file_name="my_video.mp4"))
+            db.session.add(mock_news_model(id=i, title=f"news_{i}", blog_id=i, news_image__file_name="news_image.png"))
+            db.session.add(mock_news_attachment_model(news_id=i, attachment__file_name="attachment.pdf"))
+        db.session.commit()
+        db.session.expunge_all()
+        relationships = {"news": {"filenames": "news_image", "relationships": {"attachments": {"filenames": "attachment"}}}}
+
+        with app.test_request_context():
+            rows = file_upload.iter_file_urls(
+                mock_blog_model.query.order_by(mock_blog_model.id),
+                filenames="my_video",
+                relationships=relationships,
+                chunk_size=3,
+                as_dict=True,
+            )
+            assert not isinstance(rows, list)
+            rows = list(rows)
+            blogs = list(file_upload.iter_file_urls(mock_blog_model.query, filenames=["my_video"], chunk_size=4))
+
+        assert len(rows) == 10
+        assert rows[9]["id"] == 10
+        assert rows[9]["my_video_url"] == "http://localhost/static/blogs/10/my_video.mp4"
+        assert rows[9]["news"][0]["title"] == "news_10"
+        assert rows[9]["news"][0]["news_image_url"] == "http://localhost/static/news/10/news_image.png"
+        assert rows[9]["news"][0]["attachments"][0]["attachment_url"].endswith("/attachment.pdf")
+        assert [b.my_video_url for b in blogs] == [r["my_video_url"] for r in rows]
+
+    def test_add_file_urls_to_models_relationships_lazy_loads_once(self, create_app, mock_blog_model,
+                                                                   mock_news_model):
+        db.session.add_all([mock_blog_model(id=i, name=f"blog_{i}") for i in range(1, 6)])
+        db.session.add_all([
+            mock_news_model(title=f"news_{i}", blog_id=i, news_image__file_name="news_image.png")
+            for i in range(1, 6)
+        ])
+        db.session.commit()
+        db.session.expunge_all()
+        blogs = mock_blog_model.query.all()
+
+        statements = []
+        listener = lambda *args: args[2] != "BEGIN" and statements.append(args[2])
+        sqlalchemy.event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            with app.test_request_context():
+                file_upload.add_file_urls_to_models(blogs, relationships={"news": {"filenames": "news_image"}})
+        finally:
+            sqlalchemy.event.remove(db.engine, "before_cursor_execute", listener)
+
+        # Re-querying the blogs with ``selectinload`` rather than one query per blog
+        assert len(statements) == 2
+        assert blogs[4].news[0].news_image_url.endswith(f"/news/{blogs[4].news[0].id}/news_image.png")
+
+    def test_create_file_dict_sniffed(self, flask_app):
+        with open("tests/assets/my_placeholder.png", "rb") as f:
+            png = f.read()
+
+        file = FileStorage(io.BytesIO(png), "my.placeholder.jpg", content_type="image/jpeg")
+        assert file_upload._create_file_dict(file, "my_placeholder")["my_placeholder__ext"] == "jpg"
+
+        file_upload.config.sniff_mime_types = True
+        try:
+            file = FileStorage(io.BytesIO(png), "my.placeholder.jpg", content_type="image/jpeg")
+            file_dict = file_upload._create_file_dict(file, "my_placeholder")
+            assert file_dict["my_placeholder__mime_type"] == "image/png"
+            assert file_dict["my_placeholder__ext"] == "png"
+            assert file.stream.tell() == 0
+
+            file = FileStorage(io.BytesIO(EXE_HEAD), "my_video.mp4", content_type="video/mp4")
+            with pytest.warns(UserWarning):
+                assert file_upload._create_file_dict(file, "my_video") == {}
+        finally:
+            file_upload.config.sniff_mime_types = False
+
     def test_init_app(self, create_app, mock_blog_model, flask_app):
 
         file_upload = FileUpload()
@@ -159,6 +308,30 @@ class TestFileUploads:
         rv = create_app.get("/blog")
         assert "200" in rv.status
 
+    @pytest.mark.parametrize("server, header, prefix, location", [
+        ("nginx", "X-Accel-Redirect", "/protected", "/protected/blogs/1/my_video.mp4"),
+        ("apache", "X-Sendfile", None, os.path.abspath("tests/test_path/blogs/1/my_video.mp4")),
+        ("litespeed", "X-LiteSpeed-Location", "/protected/", "/protected/blogs/1/my_video.mp4"),
+    ])
+    def test_stream_file_sendfile(self, flask_app, mock_blog_model, server, header, prefix, location):
+        app.config["FILE_UPLOAD_SENDFILE"] = server
+        app.config["FILE_UPLOAD_SENDFILE_PREFIX"] = prefix
+        file_upload.init_app(app, db)
+        try:
+            blog_post = mock_blog_model(**self.attrs)
+            with flask_app.test_request_context():
+                rv = file_upload.stream_file(blog_post, filename="my_video")
+
+            assert rv.status_code == 200
+            assert rv.headers[header] == location
+            assert rv.mimetype == "video/mpeg"
+            assert rv.get_data() == b""
+            assert "Content-Length" not in rv.get_wsgi_headers(flask_app.test_request_context().request.environ)
+        finally:
+            app.config["FILE_UPLOAD_SENDFILE"] = None
+            app.config["FILE_UPLOAD_SENDFILE_PREFIX"] = None
+            file_upload.init_app(app, db)
+
     def test_get_file_url(self, mock_blog_model):
         db.init_app(app)
         db.create_all()
@@ -175,6 +348,138 @@ class TestFileUploads:
             assert url == "http://localhost/static/uploads/blogs/1/my_video.mp4"
 
 
+    def test_get_file_url_quoted(self, flask_app, mock_blog_model):
+        blog = mock_blog_model(**{**self.attrs, "my_video__file_name": "my vidéo #1.mp4"})
+        file_upload.config.upload_folder = "tests/test_path"
+        with app.test_request_context():
+            url = file_upload.get_file_url(blog, filename="my_video")
+            assert url == "http://localhost" + url_for("static", filename="blogs/1/my vidéo #1.mp4")
+            assert url == "http://localhost/static/blogs/1/my%20vid%C3%A9o%20%231.mp4"
+
+    def test_get_file_url_versioned(self, flask_app, mock_blog_model, mock_document_model):
+        app.config["FILE_UPLOAD_VERSIONED_URLS"] = True
+        file_upload.init_app(app, db)
+        try:
+            document = mock_document_model(
+                id=1,
+                my_document__file_name="my_document.png",
+                my_document__sha256=hashlib.sha256(b"123456").hexdigest(),
+                my_document__uploaded_at=datetime(2021, 12, 7, 10, 30),
+            )
+            with app.test_request_context():
+                url = file_upload.get_file_url(document, filename="my_document")
+                assert url == "http://localhost/static/documents/1/my_document.png?v=8d969eef6eca"
+
+                document.my_document__sha256 = None
+                url = file_upload.get_file_url(document, filename="my_document")
+                assert url == "http://localhost/static/documents/1/my_document.png?v=20211207103000000000"
+
+                # Columns without a digest or upload time column are not versioned
+                url = file_upload.get_file_url(mock_blog_model(**self.attrs), filename="my_video")
+                assert url == "http://localhost/static/blogs/1/my_video.mp4"
+        finally:
+            app.config["FILE_UPLOAD_VERSIONED_URLS"] = None
+            file_upload.init_app(app, db)
+
+    def test_get_file_url_versioned_saved(self, create_app, mock_document_model):
+        app.config["FILE_UPLOAD_VERSIONED_URLS"] = True
+        file_upload.init_app(app, db)
+        try:
+            document = file_upload.save_files(mock_document_model(), files={
+                "my_document": FileStorage(stream=io.BytesIO(b"123456"), filename="my_document.png",
+                                           content_type="image/png"),
+            })
+            # The version comes from the committed digest column
+            document_id = document.id
+            db.session.expire_all()
+            document = db.session.get(mock_document_model, document_id)
+            with app.test_request_context():
+                url = file_upload.get_file_url(document, filename="my_document")
+                assert url == f"http://localhost/static/documents/{document_id}/my_document.png?v=8d969eef6eca"
+        finally:
+            app.config["FILE_UPLOAD_VERSIONED_URLS"] = None
+            file_upload.init_app(app, db)
+            shutil.rmtree("tests/test_path/documents", ignore_errors=True)
+
+    def test_get_file_url_base_url(self, flask_app, mock_blog_model):
+        blog = mock_blog_model(**self.attrs)
+        with pytest.raises(RuntimeError):
+            file_upload.get_file_url(blog, filename="my_video")
+
+        app.config["FILE_UPLOAD_BASE_URL"] = "https://cdn.example.com/"
+        file_upload.init_app(app, db)
+        try:
+            # Outside of a request
+            assert file_upload.get_file_url(blog, filename="my_video") == "https://cdn.example.com/static/blogs/1/my_video.mp4"
+            assert mock_blog_model(**self.attrs).my_placeholder_url == "https://cdn.example.com/static/blogs/1/my_placeholder.png"
+            # The base url is also used inside a request
+            with app.test_request_context():
+                assert file_upload.get_file_url(blog, filename="my_video") == "https://cdn.example.com/static/blogs/1/my_video.mp4"
+        finally:
+            app.config["FILE_UPLOAD_BASE_URL"] = None
+        app.config["SERVER_NAME"] = "example.com"
+        app.config["PREFERRED_URL_SCHEME"] = "https"
+        file_upload.init_app(app, db)
+        try:
+            assert file_upload.get_file_url(blog, filename="my_video") == "https://example.com/static/blogs/1/my_video.mp4"
+        finally:
+            app.config["SERVER_NAME"] = None
+            app.config["PREFERRED_URL_SCHEME"] = "http"
+            file_upload.init_app(app, db)
+
+    def test_add_file_urls_to_models_matches_get_file_url(self, flask_app, mock_blog_model):
+        blogs = [mock_blog_model(**{**self.attrs, "id": i}) for i in range(1, 4)]
+        for upload_folder in ("tests/test_path", "static/uploads"):
+            file_upload.config.upload_folder = upload_folder
+            try:
+                with app.test_request_context():
+                    expected = [
+                        (file_upload.get_file_url(b, filename="my_video"), file_upload.get_file_url(b, filename="my_placeholder"))
+                        for b in blogs
+                    ]
+                    results = file_upload.add_file_urls_to_models(blogs, filenames=["my_video", "my_placeholder"])
+                assert [(b.my_video_url, b.my_placeholder_url) for b in results] == expected
+            finally:
+                file_upload.config.upload_folder = "tests/test_path"
+        assert expected[2][0] == "http://localhost/static/uploads/blogs/3/my_video.mp4"
+
+    def test_lazy_file_urls(self, flask_app, mock_blog_model, mock_document_model):
+        blog = mock_blog_model(**self.attrs)
+        calls = []
+        get_file_url_builder = file_upload._get_file_url_builder
+
+        def counting_builder(model_class):
+            build = get_file_url_builder(model_class)
+            return lambda model, filename: calls.append(filename) or build(model, filename)
+
+        file_upload._get_file_url_builder = counting_builder
+        try:
+            with app.test_request_context():
+                assert "my_video_url" not in blog.__dict__
+                assert blog.my_video_url == "http://localhost/static/blogs/1/my_video.mp4"
+                assert blog.my_video_url == file_upload.get_file_url(blog, filename="my_video")
+                # Only read columns are built & each is built once per instance
+                assert calls == ["my_video", "my_video"]
+                assert "my_placeholder_url" not in blog.__dict__
+                assert mock_document_model(id=1).my_document_url is None
+        finally:
+            del file_upload._get_file_url_builder
+
+        app.config["FILE_UPLOAD_VERSIONED_URLS"] = True
+        file_upload.init_app(app, db)
+        try:
+            document = mock_document_model(id=1, my_document__file_name="my_document.png")
+            file_upload.file_data = [{"my_document__sha256": hashlib.sha256(b"123456").hexdigest()}]
+            with app.test_request_context():
+                assert document.my_document_url == "http://localhost/static/documents/1/my_document.png"
+                # Setting new file data drops the kept url
+                file_upload._set_model_attrs(document)
+                assert document.my_document_url == "http://localhost/static/documents/1/my_document.png?v=8d969eef6eca"
+        finally:
+            file_upload.file_data = []
+            app.config["FILE_UPLOAD_VERSIONED_URLS"] = None
+            file_upload.init_app(app, db)
+
     def test_update_files(self, create_app, mock_blog_model):
         m = mock_blog_model(
             name="hello",
@@ -204,6 +509,114 @@ class TestFileUploads:
         assert "my_video_updated.mp4" in os.listdir("tests/test_path/blogs/1")
         assert "my_video.mp4" not in os.listdir("tests/test_path/blogs/1")
 
+    def test_update_files_same_name(self, create_app, mock_blog_model):
+        blog = file_upload.save_files(mock_blog_model(name="same_name"), files={
+            "my_video": FileStorage(stream=io.BytesIO(b"old"), filename="my_video.mp4", content_type="video/mpeg"),
+        })
+        blog_path = f"tests/test_path/blogs/{blog.id}"
+        try:
+            file_upload.update_files(blog, files={
+                "my_video": FileStorage(stream=io.BytesIO(b"new"), filename="my_video.mp4", content_type="video/mpeg"),
+            })
+
+            assert os.listdir(blog_path) == ["my_video.mp4"]
+            with open(f"{blog_path}/my_video.mp4", "rb") as f:
+                assert f.read() == b"new"
+        finally:
+            shutil.rmtree(blog_path)
+
+    def test_save_files_metadata_columns(self, create_app, mock_document_model):
+        data = b"0123456789" * 1000
+        document = file_upload.save_files(mock_document_model(), files={
+            "my_document": FileStorage(stream=io.BytesIO(data), filename="my_document.png", content_type="image/png"),
+        })
+        try:
+            assert document.my_document__size == len(data)
+            assert document.my_document__sha256 == hashlib.sha256(data).hexdigest()
+            assert document.my_document__uploaded_at is not None
+
+            # The metadata is committed, not only set on the instance
+            document_id = document.id
+            db.session.expire_all()
+            document = db.session.get(mock_document_model, document_id)
+            assert document.my_document__size == len(data)
+            assert document.my_document__sha256 == hashlib.sha256(data).hexdigest()
+            assert document.my_document__uploaded_at is not None
+
+            file_upload.delete_files(document, files=["my_document"])
+            assert document.my_document__size is None
+            assert document.my_document__sha256 is None
+            assert document.my_document__uploaded_at is None
+        finally:
+            shutil.rmtree("tests/test_path/documents", ignore_errors=True)
+
+    def test_async_save_files_metadata_columns(self, create_app, mock_document_model):
+        document = asyncio.run(file_upload.async_save_files(mock_document_model(), files={
+            "my_document": FileStorage(stream=io.BytesIO(b"123456"), filename="my_document.png", content_type="image/png"),
+        }))
+        try:
+            document_id = document.id
+            db.session.expire_all()
+            document = db.session.get(mock_document_model, document_id)
+            assert document.my_document__size == 6
+            assert document.my_document__sha256 == hashlib.sha256(b"123456").hexdigest()
+        finally:
+            shutil.rmtree("tests/test_path/documents", ignore_errors=True)
+
+    def test_save_files_column_rules(self, create_app, mock_document_model):
+        with open("tests/assets/my_video.mp4", "rb") as f:
+            video = f.read()
+        with pytest.warns(UserWarning):
+            document = file_upload.save_files(mock_document_model(), files={
+                "my_thumbnail": FileStorage(stream=io.BytesIO(video[:1024]), filename="my_thumbnail.mp4", content_type="video/mp4"),
+            })
+        assert document.my_thumbnail__file_name is None
+
+        with pytest.warns(UserWarning):
+            document = file_upload.save_files(mock_document_model(), files={
+                "my_thumbnail": FileStorage(stream=io.BytesIO(video), filename="my_thumbnail.png", content_type="image/png"),
+            })
+        assert document.my_thumbnail__file_name is None
+        # Files that are not allowed are not written
+        assert not os.path.exists("tests/test_path/documents")
+
+    def test_stream_file_conditional(self, create_app, mock_document_model):
+        storage = MemoryStorage()
+        app.config["FILE_UPLOAD_STORAGE"] = storage
+        file_upload.init_app(app, db)
+        try:
+            document = file_upload.save_files(mock_document_model(), files={
+                "my_document": FileStorage(stream=io.BytesIO(b"123456"), filename="my_document.png",
+                                           content_type="image/png"),
+            })
+            etag = hashlib.sha256(b"123456").hexdigest()
+
+            # The validators come from the committed columns, not the saved instance
+            document_id = document.id
+            db.session.expire_all()
+            document = db.session.get(mock_document_model, document_id)
+            assert document.my_document__sha256 == etag
+
+            with app.test_request_context():
+                rv = file_upload.stream_file(document, filename="my_document")
+                assert rv.status_code == 200
+                assert rv.headers["ETag"] == f'"{etag}"'
+                assert rv.headers["Cache-Control"] == "public, max-age=86400"
+                assert rv.last_modified == document.my_document__uploaded_at.replace(microsecond=0, tzinfo=timezone.utc)
+                last_modified = rv.headers["Last-Modified"]
+
+            # A 304 is answered from the model alone
+            storage.files.clear()
+            for headers in ({"If-None-Match": f'"{etag}"'}, {"If-Modified-Since": last_modified}):
+                with app.test_request_context(headers=headers):
+                    rv = file_upload.stream_file(document, filename="my_document")
+                    assert rv.status_code == 304
+                    assert rv.headers["ETag"] == f'"{etag}"'
+                    assert rv.headers["Cache-Control"] == "public, max-age=86400"
+        finally:
+            app.config["FILE_UPLOAD_STORAGE"] = None
+            file_upload.init_app(app, db)
+
     def test_delete_files(self, create_app, mock_blog_model):
 
 
@@ -350,6 +763,314 @@ class TestFileUploads:
         assert result.my_video__mime_type == "video/mpeg"
         assert result.my_video__ext == "mp4"
 
+    def test_add_files_concurrent_threads(self, flask_app, mock_blog_model):
+        threads_count = 16
+        iterations = 10
+        barrier = threading.Barrier(threads_count)
+        errors = []
+
+        def upload(n):
+            try:
+                barrier.wait()
+                for i in range(iterations):
+                    model_id = 1000 + n
+                    content = f"{n}-{i}".encode()
+                    with flask_app.test_request_context():
+                        b = mock_blog_model(id=model_id, name=f"thread_{n}")
+                        file_upload.add_files(b, files={
+                            "my_video": FileStorage(
+                                stream=io.BytesIO(content),
+                                filename=f"video_{n}_{i}.mp4",
+                                content_type="video/mpeg",
+                            ),
+                        })
+                        assert b.my_video__file_name == f"video_{n}_{i}.mp4"
+                        assert b.my_placeholder__file_name is None
+                        assert len(file_upload.files) == 1
+                    with open(f"tests/test_path/blogs/{model_id}/video_{n}_{i}.mp4", "rb") as f:
+                        assert f.read() == content
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=upload, args=(n,)) for n in range(threads_count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for n in range(threads_count):
+            model_id = 1000 + n
+            assert len(os.listdir(f"tests/test_path/blogs/{model_id}")) == iterations
+            shutil.rmtree(f"tests/test_path/blogs/{model_id}")
+        assert errors == []
+
+    def test_add_files_max_workers(self, flask_app, mock_blog_model, video_file, png_file):
+        app.config["FILE_UPLOAD_MAX_WORKERS"] = 4
+        file_upload = FileUpload()
+        file_upload.init_app(app, db)
+        try:
+            with flask_app.test_request_context():
+                b = mock_blog_model(id=2, name="test_name")
+                file_upload.add_files(b, files={
+                    "my_video": video_file,
+                    "my_placeholder": png_file,
+                })
+            assert sorted(os.listdir("tests/test_path/blogs/2")) == ["my_png.png", "my_video.mp4"]
+        finally:
+            app.config["FILE_UPLOAD_MAX_WORKERS"] = None
+            file_upload.init_app(app, db)
+
+    def test_init_app_resizes_executors(self, flask_app):
+        file_upload = FileUpload()
+        try:
+            app.config["FILE_UPLOAD_MAX_WORKERS"] = 2
+            file_upload.init_app(app, db)
+            executor, async_executor = file_upload._executor, file_upload._async_executor
+            assert executor._max_workers == 2
+
+            file_upload.init_app(app, db)
+            assert file_upload._executor is executor
+            assert file_upload._async_executor is async_executor
+
+            app.config["FILE_UPLOAD_MAX_WORKERS"] = 3
+            app.config["FILE_UPLOAD_ASYNC_MAX_WORKERS"] = 8
+            file_upload.init_app(app, db)
+            assert file_upload._executor._max_workers == 3
+            assert file_upload._async_executor._max_workers == 8
+            assert executor._shutdown and async_executor._shutdown
+
+            app.config["FILE_UPLOAD_MAX_WORKERS"] = None
+            file_upload.init_app(app, db)
+            assert file_upload._executor is None
+
+            async_executor = file_upload._async_executor
+            file_upload.shutdown()
+            assert async_executor._shutdown
+            assert file_upload._async_executor is None
+        finally:
+            app.config["FILE_UPLOAD_MAX_WORKERS"] = None
+            app.config["FILE_UPLOAD_ASYNC_MAX_WORKERS"] = None
+            file_upload.init_app(app, db)
+            file_upload.shutdown()
+
+    def test_add_files_max_workers_failure(self, flask_app, mock_blog_model, video_file):
+        class BrokenStream(io.BytesIO):
+            def read(self, *args):
+                raise OSError("disconnected")
+
+        app.config["FILE_UPLOAD_MAX_WORKERS"] = 4
+        file_upload = FileUpload()
+        file_upload.init_app(app, db)
+        try:
+            with flask_app.test_request_context():
+                b = mock_blog_model(id=2, name="test_name")
+                with pytest.raises(SaveFilesError) as err:
+                    file_upload.add_files(b, files={
+                        "my_video": video_file,
+                        "my_placeholder": FileStorage(
+                            stream=BrokenStream(b"123456"),
+                            filename="my_png.png",
+                            content_type="image/png",
+                        ),
+                    })
+            assert list(err.value.errors) == ["my_png.png"]
+            assert os.listdir("tests/test_path/blogs/2") == []
+            assert b.my_video__file_name is None
+            assert b.my_placeholder__file_name is None
+        finally:
+            app.config["FILE_UPLOAD_MAX_WORKERS"] = None
+            file_upload.init_app(app, db)
+
+    def test_async_add_files_concurrent(self, flask_app, mock_blog_model):
+        # Every upload waits on the barrier, so it is only passed if all 4 are written at once
+        barrier = threading.Barrier(4, timeout=5)
+
+        class SlowStream(io.BytesIO):
+            waited = False
+
+            def read(self, *args):
+                if not self.waited:
+                    self.waited = True
+                    barrier.wait()
+                return super().read(*args)
+
+        async def upload_all():
+            return await asyncio.gather(*[
+                file_upload.async_add_files(mock_blog_model(id=1100 + n, name="async"), files={
+                    "my_video": FileStorage(
+                        stream=SlowStream(b"123456"),
+                        filename=f"video_{n}.mp4",
+                        content_type="video/mpeg",
+                    ),
+                })
+                for n in range(4)
+            ])
+
+        with flask_app.test_request_context():
+            blogs = asyncio.run(upload_all())
+
+        try:
+            assert not barrier.broken
+            for n, b in enumerate(blogs):
+                assert b.my_video__file_name == f"video_{n}.mp4"
+                assert os.listdir(f"tests/test_path/blogs/{1100 + n}") == [f"video_{n}.mp4"]
+        finally:
+            for n in range(4):
+                shutil.rmtree(f"tests/test_path/blogs/{1100 + n}", ignore_errors=True)
+
+    def test_async_save_files(self, create_app, mock_blog_model, video_file, png_file):
+        blog = asyncio.run(file_upload.async_save_files(mock_blog_model(name="async"), files={
+            "my_video": video_file,
+            "my_placeholder": png_file,
+        }))
+
+        result = blog.get_blog(blog.id)
+        assert result.my_video__file_name == "my_video.mp4"
+        assert sorted(os.listdir(f"tests/test_path/blogs/{blog.id}")) == ["my_png.png", "my_video.mp4"]
+
+    def test_async_update_files(self, create_app, mock_blog_model):
+        m = mock_blog_model(
+            name="hello",
+            my_video__file_name="my_video.mp4",
+            my_video__mime_type="video/mpeg",
+            my_video__ext="mp4",
+        )
+        db.session.add(m)
+        db.session.commit()
+
+        new_file = FileStorage(
+            stream=open(self.my_video_update, "rb"),
+            filename="my_video_updated.mp4",
+            content_type="video/mpeg",
+        )
+        result = asyncio.run(file_upload.async_update_files(m.get_blog(), files={"my_video": new_file}))
+
+        assert result.my_video__file_name == "my_video_updated.mp4"
+        assert "my_video_updated.mp4" in os.listdir("tests/test_path/blogs/1")
+        assert "my_video.mp4" not in os.listdir("tests/test_path/blogs/1")
+
+    def test_async_delete_files(self, create_app, mock_blog_model):
+        m = mock_blog_model(
+            name="hello",
+            my_video__file_name="my_video.mp4",
+            my_video__mime_type="video/mpeg",
+            my_video__ext="mp4",
+        )
+        db.session.add(m)
+        db.session.commit()
+
+        asyncio.run(file_upload.async_delete_files(m.get_blog(), files=["my_video"]))
+        result = m.get_blog()
+
+        assert "my_video.mp4" not in os.listdir("tests/test_path/blogs/1")
+        assert result.my_video__file_name is None
+
+    def test_delete_files_without_commit(self, create_app, mock_blog_model):
+        m = mock_blog_model(
+            name="hello",
+            my_video__file_name="my_video.mp4",
+            my_video__mime_type="video/mpeg",
+            my_video__ext="mp4",
+        )
+        db.session.add(m)
+        db.session.commit()
+
+        with pytest.raises(TypeError):
+            file_upload.delete_files(m.get_blog())
+        with pytest.raises(TypeError):
+            asyncio.run(file_upload.async_delete_files(m.get_blog()))
+
+        blog = asyncio.run(file_upload.async_delete_files(m.get_blog(), files=["my_video"], commit=False))
+        assert blog.my_video__file_name is None
+        db.session.rollback()
+        assert m.get_blog().my_video__file_name == "my_video.mp4"
+
+    def test_async_request_context_lost(self, flask_app, mock_blog_model, monkeypatch):
+        # Flask < 2.0 keeps the request context per thread, so the worker has none
+        monkeypatch.setattr(
+            "flask_file_upload.file_upload.has_request_context",
+            lambda: threading.current_thread() is threading.main_thread(),
+        )
+        with flask_app.test_request_context():
+            with pytest.raises(RuntimeError):
+                asyncio.run(file_upload.async_stream_file(mock_blog_model(**self.attrs), filename="my_video"))
+
+    def test_async_stream_file(self, flask_app, mock_blog_model):
+        blog_post = mock_blog_model(**self.attrs)
+        # send_from_directory resolves relative paths from the app's root path
+        file_upload.config.upload_folder = "test_path"
+        try:
+            with flask_app.test_request_context():
+                rv = asyncio.run(file_upload.async_stream_file(blog_post, filename="my_video"))
+                assert rv.status_code == 200
+                assert rv.mimetype == "video/mp4"
+                rv.close()
+        finally:
+            file_upload.config.upload_folder = "tests/test_path"
+
+    def test_save_files_bulk(self, create_app, mock_blog_model):
+        class BrokenStream(io.BytesIO):
+            def read(self, *args):
+                raise OSError("disconnected")
+
+        def video(n, stream_class=io.BytesIO):
+            return FileStorage(
+                stream=stream_class(f"{n}".encode()),
+                filename=f"video_{n}.mp4",
+                content_type="video/mpeg",
+            )
+
+        items = [(mock_blog_model(name=f"bulk_{n}"), {"my_video": video(n)}) for n in range(10)]
+        items[3] = (mock_blog_model(name="bulk_3"), {"bananas": video(3)})
+        items[7] = (mock_blog_model(name="bulk_7"), {"my_video": video(7, BrokenStream)})
+        items.append((mock_blog_model(id=500, name="bulk_10"), {"my_video": video(10)}))
+        items.append((mock_blog_model(id=500, name="bulk_11"), {"my_video": video(11)}))
+        # Pending state of the caller is not rolled back by a failing item
+        db.session.add(mock_blog_model(name="unrelated"))
+
+        saved, errors = file_upload.save_files_bulk(items, batch_size=5)
+
+        try:
+            assert len(saved) == 9
+            assert [model.name for model, _ in errors] == ["bulk_3", "bulk_7", "bulk_11"]
+            assert isinstance(errors[0][1], AttributeError)
+            assert isinstance(errors[1][1], SaveFilesError)
+            for model in saved:
+                assert model.my_video__file_name in os.listdir(f"tests/test_path/blogs/{model.id}")
+            failed = errors[1][0]
+            assert failed.my_video__file_name is None
+            # The row of a new model whose files failed is removed, so it can be retried
+            assert not os.path.exists(f"tests/test_path/blogs/{failed.id}")
+            assert mock_blog_model.query.filter_by(name="bulk_7").count() == 0
+            assert mock_blog_model.query.filter_by(name="unrelated").count() == 1
+            assert mock_blog_model.query.count() == 10
+        finally:
+            for model in mock_blog_model.query.all():
+                shutil.rmtree(f"tests/test_path/blogs/{model.id}", ignore_errors=True)
+
+    def test_save_files_bulk_failed_commit(self, create_app, mock_blog_model, monkeypatch):
+        def fail():
+            raise sqlalchemy.exc.OperationalError("COMMIT", {}, Exception("database is locked"))
+
+        items = [
+            (mock_blog_model(name=f"commit_{n}"), {"my_video": FileStorage(
+                stream=io.BytesIO(b"123456"),
+                filename=f"video_{n}.mp4",
+                content_type="video/mpeg",
+            )})
+            for n in range(3)
+        ]
+        monkeypatch.setattr(db.session, "commit", fail, raising=False)
+        saved, errors = file_upload.save_files_bulk(items)
+        monkeypatch.undo()
+
+        assert saved == []
+        assert [model.name for model, _ in errors] == ["commit_0", "commit_1", "commit_2"]
+        assert all(isinstance(err, sqlalchemy.exc.OperationalError) for _, err in errors)
+        for model, _ in errors:
+            assert not os.path.exists(f"tests/test_path/blogs/{model.id}")
+        assert mock_blog_model.query.filter(mock_blog_model.name.like("commit_%")).count() == 0
+
     def test_add_files(self, flask_app, mock_blog_model, video_file, png_file):
 
         with flask_app.test_request_context() as conn:
@@ -0,0 +1,155 @@
+import io
+import os
+import shutil
+import pytest
+from flask import Flask, request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.formparser import FormDataParser
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from flask_file_upload._config import Config
+from flask_file_upload._form_parser import create_reject_early_request_class
+from flask_file_upload._stream import create_request_class, get_staging_folder
+from tests.fixtures.models import MockDocumentModel
+from tests.fixtures.files import EXE_HEAD
+
+
+class CountingStream(io.BytesIO):
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, *args):
+        data = super().read(*args)
+        self.bytes_read += len(data)
+        return data
+
+
+class TestFormParser:
+
+    upload_folder = "tests/test_path/form_parser"
+
+    def teardown_method(self):
+        shutil.rmtree(self.upload_folder, ignore_errors=True)
+
+    def _create_app(self, **config_values):
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = self.upload_folder
+        app.config["ALLOWED_EXTENSIONS"] = ["png", "mp4"]
+        app.config.update(config_values)
+        config = Config()
+        config.init_config(app)
+        if config.stream_uploads:
+            app.request_class = create_request_class(app.request_class, config)
+        app.request_class = create_reject_early_request_class(app.request_class, config)
+
+        @app.route("/upload", methods=["POST"])
+        def upload():
+            return {"files": sorted(request.files)}
+
+        return app, config
+
+    def test_allowed_files(self):
+        app, _ = self._create_app()
+        rv = app.test_client().post("/upload", data={
+            "my_video": (io.BytesIO(b"123456"), "my_video.mp4"),
+            "my_document": (io.BytesIO(b"0" * 64 * 1024), "my_document.png"),
+        })
+
+        assert rv.status_code == 200
+        assert rv.get_json()["files"] == ["my_document", "my_video"]
+
+    def test_disallowed_extension(self):
+        app, _ = self._create_app()
+        rv = app.test_client().post("/upload", data={"my_video": (io.BytesIO(b"123456"), "virus.exe")})
+
+        assert rv.status_code == 415
+
+    def test_sniffed_type(self):
+        app, config = self._create_app(FILE_UPLOAD_STREAM_UPLOADS=True, FILE_UPLOAD_SNIFF_MIME_TYPES=True)
+        client = app.test_client()
+        with open("tests/assets/my_placeholder.png", "rb") as f:
+            png = f.read()
+
+        rv = client.post("/upload", data={"my_placeholder": (io.BytesIO(png), "my_placeholder.png")})
+        assert rv.status_code == 200
+
+        rv = client.post("/upload", data={
+            "my_placeholder": (io.BytesIO(png), "my_placeholder.png"),
+            "my_video": (io.BytesIO(EXE_HEAD + b"0" * 4096), "my_video.mp4"),
+        })
+        assert rv.status_code == 415
+        # The staged parts, including the complete png, are removed
+        assert os.listdir(get_staging_folder(config)) == []
+
+    def test_other_fields_are_not_checked(self):
+        app, _ = self._create_app(FILE_UPLOAD_SNIFF_MIME_TYPES=True)
+        rv = app.test_client().post("/upload", data={
+            "installer": (io.BytesIO(EXE_HEAD + b"0" * 4096), "setup.exe"),
+            "backup": (io.BytesIO(EXE_HEAD + b"0" * 4096), "backup.png"),
+        })
+
+        assert rv.status_code == 200
+        assert rv.get_json()["files"] == ["backup", "installer"]
+
+        app, _ = self._create_app(MAX_CONTENT_LENGTH=1024)
+        rv = app.test_client().post("/upload", data={"installer": (io.BytesIO(b"0" * 2048), "setup.exe")})
+        assert rv.status_code == 413
+
+    def test_column_max_size(self):
+        assert MockDocumentModel.__file_upload_columns__["my_document"].max_size == 64 * 1024
+        app, config = self._create_app(FILE_UPLOAD_STREAM_UPLOADS=True)
+        rv = app.test_client().post("/upload", data={
+            "my_document": (io.BytesIO(b"0" * (64 * 1024 + 1)), "my_document.png"),
+        })
+
+        assert rv.status_code == 413
+        # The staged part is removed
+        assert os.listdir(get_staging_folder(config)) == []
+
+    @pytest.mark.parametrize("filename, content_type, size, status_code", [
+        ("my_thumbnail.png", "image/png", 1024, 200),
+        ("my_thumbnail.mp4", "video/mp4", 1024, 415),
+        ("my_thumbnail.png", "video/mp4", 1024, 415),
+        ("my_thumbnail.png", "image/png", 4096, 413),
+    ])
+    def test_column_rules(self, filename, content_type, size, status_code):
+        app, _ = self._create_app()
+        rv = app.test_client().post("/upload", data={
+            "my_thumbnail": (io.BytesIO(b"0" * size), filename, content_type),
+        })
+
+        assert rv.status_code == status_code
+
+    def test_max_content_length(self):
+        app, _ = self._create_app(MAX_CONTENT_LENGTH=1024)
+        rv = app.test_client().post("/upload", data={"my_video": (io.BytesIO(b"0" * 2048), "my_video.mp4")})
+
+        assert rv.status_code == 413
+
+    @pytest.mark.parametrize("filename, max_content_length, error", [
+        ("virus.exe", None, UnsupportedMediaType),
+        ("my_video.mp4", 1024, RequestEntityTooLarge),
+    ])
+    def test_rest_of_body_is_not_read(self, filename, max_content_length, error):
+        config = Config()
+        config.upload_folder = self.upload_folder
+        config.allowed_extensions = ["png", "mp4"]
+        request_class = create_reject_early_request_class(Request, config)
+        size = 8 * 1024 * 1024
+        environ = EnvironBuilder(method="POST", data={"my_video": (io.BytesIO(b"0" * size), filename)}).get_environ()
+        environ["wsgi.input"] = stream = CountingStream(environ["wsgi.input"].read())
+        req = request_class(environ)
+        req.max_content_length = max_content_length
+
+        with pytest.raises(error):
+            req.files
+
+        assert stream.bytes_read < size / 2
+
+    def test_incompatible_werkzeug(self, monkeypatch):
+        monkeypatch.delattr(FormDataParser, "parse_functions")
+        with pytest.raises(RuntimeError):
+            create_reject_early_request_class(Request, Config())
@@ -0,0 +1,179 @@
+import os
+import hashlib
+import pytest
+from flask import Flask
+
+from flask_file_upload._config import Config
+from flask_file_upload.file_upload import FileUpload
+from flask_file_upload.file_utils import FileUtils
+from flask_file_upload.layout import (
+    FlatLayout, ShardedLayout, get_layout, migrate_layout, MIGRATION_JOURNAL, MIGRATION_FOLDER,
+)
+from tests.app import app, db, file_upload
+from tests.fixtures.models import MockBlogModel
+
+
+def create_tree(root, layout, ids):
+    for model_id in ids:
+        path = os.path.join(root, layout.prefix("blogs", model_id))
+        os.makedirs(path)
+        with open(os.path.join(path, "my_video.mp4"), "w") as f:
+            f.write(str(model_id))
+
+
+def assert_tree(root, layout, ids):
+    for model_id in ids:
+        with open(os.path.join(root, layout.prefix("blogs", model_id), "my_video.mp4")) as f:
+            assert f.read() == str(model_id)
+    assert sorted(m for _, m in layout.iter_models(str(root))) == sorted(str(m) for m in ids)
+
+
+class TestLayout:
+
+    ids = list(range(1, 40))
+
+    def test_get_layout(self):
+        assert isinstance(get_layout(None), FlatLayout)
+        assert isinstance(get_layout("sharded"), ShardedLayout)
+        with pytest.raises(ValueError):
+            get_layout("bananas")
+
+    def test_sharded_prefix(self):
+        assert FlatLayout().prefix("blogs", 1) == "blogs/1"
+        assert ShardedLayout().prefix("blogs", 1) == "blogs/c4/ca/1"
+        assert ShardedLayout(levels=1, width=3).prefix("blogs", 1) == "blogs/c4c/1"
+
+    def test_sharded_prefix_fips(self, monkeypatch):
+        md5 = hashlib.md5
+
+        def fips_md5(data=b"", **kwargs):
+            if kwargs.get("usedforsecurity", True):
+                raise ValueError("[digital envelope routines] unsupported")
+            return md5(data, **kwargs)
+
+        monkeypatch.setattr(hashlib, "md5", fips_md5)
+        assert ShardedLayout().prefix("blogs", 1) == "blogs/c4/ca/1"
+
+    def test_file_utils_sharded(self):
+        config = Config()
+        config.upload_folder = "tests/test_path"
+        config.layout = ShardedLayout()
+        file_utils = FileUtils(MockBlogModel(id=1), config)
+
+        assert file_utils.get_file_path(1, "my_video.mp4") == "tests/test_path/blogs/c4/ca/1/my_video.mp4"
+        assert file_utils.get_stream_path(1) == "tests/test_path/blogs/c4/ca/1"
+        assert file_utils.get_file_key(1, "my_video.mp4") == "blogs/c4/ca/1/my_video.mp4"
+
+    def test_get_file_url_sharded(self):
+        app.config["FILE_UPLOAD_LAYOUT"] = "sharded"
+        file_upload.init_app(app, db)
+        try:
+            blog = MockBlogModel(id=1, my_video__file_name="my_video.mp4")
+            with app.test_request_context():
+                url = file_upload.get_file_url(blog, filename="my_video")
+            assert url == "http://localhost/static/blogs/c4/ca/1/my_video.mp4"
+        finally:
+            app.config["FILE_UPLOAD_LAYOUT"] = None
+            file_upload.init_app(app, db)
+
+    def test_migrate_layout(self, tmp_path):
+        create_tree(tmp_path, FlatLayout(), self.ids)
+
+        assert migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout()) == len(self.ids)
+        assert_tree(tmp_path, ShardedLayout(), self.ids)
+        assert sorted(os.listdir(tmp_path)) == ["blogs"]
+
+        assert migrate_layout(str(tmp_path), ShardedLayout(), FlatLayout()) == len(self.ids)
+        assert_tree(tmp_path, FlatLayout(), self.ids)
+        assert sorted(os.listdir(tmp_path / "blogs")) == sorted(str(i) for i in self.ids)
+
+    def test_migrate_layout_resume(self, tmp_path):
+        create_tree(tmp_path, FlatLayout(), self.ids)
+
+        def interrupt(done, total, prefix):
+            if done == 10:
+                raise KeyboardInterrupt()
+
+        with pytest.raises(KeyboardInterrupt):
+            migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout(), interrupt)
+        assert os.path.exists(tmp_path / MIGRATION_JOURNAL)
+
+        assert migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout()) == len(self.ids) - 10
+        assert_tree(tmp_path, ShardedLayout(), self.ids)
+        assert not os.path.exists(tmp_path / MIGRATION_JOURNAL)
+
+    def test_migrate_layout_moves_one_directory_at_a_time(self, tmp_path):
+        create_tree(tmp_path, FlatLayout(), self.ids)
+        left = []
+
+        def count_source_dirs(done, total, prefix):
+            if done == 10:
+                left.extend(i for i in self.ids[10:] if os.path.isfile(tmp_path / "blogs" / str(i) / "my_video.mp4"))
+
+        migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout(), count_source_dirs)
+
+        # Only the directories in the way of a shard directory were moved early
+        assert len(left) > len(self.ids) // 2
+        assert_tree(tmp_path, ShardedLayout(), self.ids)
+
+    def _save_during_migration(self, tmp_path, filename, content):
+        """
+        :return: A progress callback saving ``filename`` to the sharded directory
+            of a model that is not moved yet, like a worker using the new layout
+        """
+        saved = []
+
+        def save(done, total, prefix):
+            if saved:
+                return
+            model_id = next(i for i in self.ids if os.path.isfile(tmp_path / "blogs" / str(i) / "my_video.mp4"))
+            dest = tmp_path / ShardedLayout().prefix("blogs", model_id)
+            os.makedirs(dest, exist_ok=True)
+            (dest / filename).write_text(content)
+            saved.append(model_id)
+
+        return save, saved
+
+    def test_migrate_layout_merges_existing_target(self, tmp_path):
+        create_tree(tmp_path, FlatLayout(), self.ids)
+        save, saved = self._save_during_migration(tmp_path, "my_placeholder.png", "new")
+
+        migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout(), save)
+
+        assert_tree(tmp_path, ShardedLayout(), self.ids)
+        dest = tmp_path / ShardedLayout().prefix("blogs", saved[0])
+        assert (dest / "my_placeholder.png").read_text() == "new"
+        assert not os.path.exists(tmp_path / MIGRATION_FOLDER)
+
+    def test_migrate_layout_file_clash(self, tmp_path):
+        create_tree(tmp_path, FlatLayout(), self.ids)
+        save, saved = self._save_during_migration(tmp_path, "my_video.mp4", "new")
+
+        with pytest.raises(FileExistsError):
+            migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout(), save)
+
+        # Nothing is overwritten or removed
+        dest = tmp_path / ShardedLayout().prefix("blogs", saved[0])
+        assert (dest / "my_video.mp4").read_text() == "new"
+        staged = tmp_path / MIGRATION_FOLDER / "blogs" / str(saved[0]) / "my_video.mp4"
+        assert staged.read_text() == str(saved[0])
+
+        staged.unlink()
+        migrate_layout(str(tmp_path), FlatLayout(), ShardedLayout())
+        assert sorted(m for _, m in ShardedLayout().iter_models(str(tmp_path))) == sorted(str(i) for i in self.ids)
+        assert not os.path.exists(tmp_path / MIGRATION_FOLDER)
+
+    def test_migrate_layout_command(self, tmp_path):
+        create_tree(tmp_path, FlatLayout(), self.ids)
+        cli_app = Flask(__name__)
+        cli_app.config["UPLOAD_FOLDER"] = str(tmp_path)
+        cli_app.config["FILE_UPLOAD_LAYOUT"] = "sharded"
+        FileUpload().init_app(cli_app, db)
+        try:
+            result = cli_app.test_cli_runner().invoke(args=["file-upload", "migrate-layout"])
+
+            assert result.exit_code == 0
+            assert f"Moved {len(self.ids)} directories to the sharded layout" in result.output
+            assert_tree(tmp_path, ShardedLayout(), self.ids)
+        finally:
+            file_upload.init_app(app, db)
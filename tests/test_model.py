@@ -53,3 +53,13 @@ class TestModel:
         blog = mock_blog_model(name="test_name")
         assert hasattr(blog, "get_name")
         assert blog.get_name() == "joe"
+
+    def test_model_metadata_columns(self):
+        from tests.fixtures.models import MockDocumentModel
+
+        assert hasattr(MockDocumentModel, "my_document__size")
+        assert hasattr(MockDocumentModel, "my_document__sha256")
+        assert hasattr(MockDocumentModel, "my_document__uploaded_at")
+        assert not hasattr(MockBlogModel, "my_video__size")
+        assert list(_ModelUtils.get_file_columns(MockDocumentModel)) == ["my_document", "my_thumbnail"]
+        assert "sha256" in _ModelUtils.digests
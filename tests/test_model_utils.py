@@ -1,8 +1,9 @@
 import pytest
 from sqlalchemy import Column, String
 
-from flask_file_upload._model_utils import _ModelUtils
-from tests.fixtures.models import MockModel
+from flask_file_upload._model_utils import _ModelUtils, _FileRules, NO_RULES
+from flask_file_upload.column import Column as FileColumn
+from tests.fixtures.models import MockModel, MockDocumentModel
 
 
 class Test_ModelUtils:
@@ -28,3 +29,44 @@ class Test_ModelUtils:
         # TODO remove 'in' from assertion
 
         assert "mp4" in _ModelUtils.get_by_postfix(MockModel, "my_video", _ModelUtils.column_suffix.EXT.value)
+
+    def test_file_rules(self):
+        rules = _FileRules.compile(FileColumn(allowed_extensions=[".PNG"], allowed_mime_types=["image/*", "application/pdf"]))
+
+        assert rules.extensions == frozenset({"png"})
+        assert rules.allows_extension("png", frozenset())
+        assert not rules.allows_extension("mp4", frozenset({"mp4"}))
+        assert NO_RULES.allows_extension("mp4", frozenset({"mp4"}))
+        assert rules.allows_mime_type("image/png; charset=binary")
+        assert rules.allows_mime_type("application/pdf")
+        assert not rules.allows_mime_type("video/mp4")
+        assert not rules.allows_mime_type(None)
+        assert NO_RULES.allows_mime_type(None)
+
+        merged = rules.merge(_FileRules.compile(FileColumn(allowed_extensions=["jpg"], max_size=10)))
+        assert merged.extensions == frozenset({"png", "jpg"})
+        assert merged.mime_types is None
+        assert merged.max_size is None
+
+    def test_file_rules_merge_default_extensions(self):
+        default = frozenset({"png", "jpg"})
+        svg = _FileRules.compile(FileColumn(allowed_extensions=["svg"]))
+
+        # A field name shared by a Column using ALLOWED_EXTENSIONS & one allowing svg
+        for merged in (NO_RULES.merge(svg), svg.merge(NO_RULES)):
+            assert merged.allows_extension("svg", default)
+            assert merged.allows_extension("png", default)
+            assert not merged.allows_extension("exe", default)
+        assert not svg.allows_extension("png", default)
+        assert NO_RULES.merge(NO_RULES) == NO_RULES
+
+        merged = NO_RULES.merge(svg).merge(_FileRules.compile(FileColumn(allowed_extensions=["pdf"])))
+        assert merged.extensions == frozenset({"svg", "pdf"})
+        assert merged.allows_extension("png", default)
+
+    def test_get_file_rules(self):
+        rules = _ModelUtils.get_file_rules(MockDocumentModel, "my_thumbnail")
+
+        assert rules.max_size == 2 * 1024
+        assert _ModelUtils.get_file_rules(None, "my_thumbnail") == rules
+        assert _ModelUtils.get_file_rules(MockDocumentModel, "my_video") == NO_RULES
@@ -0,0 +1,57 @@
+import bz2
+import gzip
+import io
+
+from flask_file_upload.sniff import SNIFF_LENGTH, Signature, sniff, sniff_file, resolve
+from tests.fixtures.files import EXE_HEAD
+
+
+class TestSniff:
+
+    def test_sniff(self):
+        with open("tests/assets/my_placeholder.png", "rb") as f:
+            assert sniff(f.read(SNIFF_LENGTH)).mime_type == "image/png"
+        with open("tests/assets/my_video.mp4", "rb") as f:
+            assert sniff(f.read(SNIFF_LENGTH)) == Signature("video/mp4", "mp4", ("m4v",))
+
+        assert sniff(b"\xff\xd8\xff\xe0\x00\x10JFIF").ext == "jpg"
+        assert sniff(b"RIFF\x00\x00\x00\x00WEBPVP8 ").mime_type == "image/webp"
+        assert sniff(b"\x00\x00\x00\x14ftypqt  ").ext == "mov"
+        assert sniff(EXE_HEAD).ext == "exe"
+        assert sniff(b"\x00" * 257 + b"ustar\x0000").ext == "tar"
+        assert sniff(b"hello world") is None
+        assert sniff(b"") is None
+
+    def test_sniff_short_magics(self):
+        assert sniff(b"BM" + b"\x00" * 12 + b"\x28\x00\x00\x00").ext == "bmp"
+        assert sniff(b"ID3\x04\x00\x00\x00\x00\x02\x01").ext == "mp3"
+        assert sniff(gzip.compress(b"hello")).ext == "gz"
+        assert sniff(bz2.compress(b"hello")).ext == "bz2"
+        assert sniff(bz2.compress(b"")).ext == "bz2"
+
+        # Text starting with the same bytes is not matched
+        assert sniff(b"BMW, Mercedes & Audi are German car makers") is None
+        assert sniff(b"MZ Holdings Ltd. Annual report\n" + b"=" * 64) is None
+        assert sniff(b"MZ\x90\x00") is None
+        assert sniff(b"ID3 tags store the title & artist of an mp3") is None
+        assert sniff(b"BZh hello") is None
+        assert sniff(b"\x1f\x8bhello") is None
+
+    def test_sniff_file_rewinds(self):
+        stream = io.BytesIO(b"%PDF-1.7\n" + b"0" * 4096)
+        stream.read(3)
+
+        assert sniff_file(stream) is None
+        stream.seek(0)
+        assert sniff_file(stream).mime_type == "application/pdf"
+        assert stream.tell() == 0
+
+    def test_resolve(self):
+        jpeg = sniff(b"\xff\xd8\xff")
+        zip_file = sniff(b"PK\x03\x04")
+
+        assert resolve(jpeg, "my.photo.jpg") == ("image/jpeg", "jpg")
+        assert resolve(jpeg, "photo.JPEG") == ("image/jpeg", "jpeg")
+        assert resolve(jpeg, "photo.png") == ("image/jpeg", "jpg")
+        assert resolve(zip_file, "report.docx")[1] == "docx"
+        assert resolve(zip_file, "archive") == ("application/zip", "zip")
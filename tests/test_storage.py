@@ -0,0 +1,277 @@
+import io
+import os
+import sys
+import importlib.util
+import shutil
+import hashlib
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from flask_file_upload._config import Config
+from flask_file_upload._stream import _StagingFile, get_staging_folder
+from flask_file_upload import storage as storage_module
+from flask_file_upload.storage import (
+    LocalStorage, MemoryStorage, S3Storage, DirectoryCache, CAS_FOLDER, INODE_FOLDER,
+)
+from tests.app import app, db, file_upload, create_app
+from tests.fixtures.models import mock_blog_model
+
+
+@pytest.fixture
+def s3_storage():
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    mock_aws = getattr(moto, "mock_aws", None) or getattr(moto, "mock_s3")
+    with mock_aws():
+        client = boto3.client(
+            "s3",
+            region_name="us-east-1",
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+        )
+        client.create_bucket(Bucket="uploads")
+        yield S3Storage(bucket="uploads", prefix="media", client=client)
+
+
+@pytest.fixture(params=["local", "memory", "s3"])
+def storage(request, tmp_path):
+    if request.param == "local":
+        return LocalStorage(str(tmp_path))
+    if request.param == "memory":
+        return MemoryStorage()
+    return request.getfixturevalue("s3_storage")
+
+
+class TestStorage:
+
+    def _file(self, data=b"0123456789"):
+        return FileStorage(stream=io.BytesIO(data), filename="my_video.mp4", content_type="video/mpeg")
+
+    def test_put_get(self, storage):
+        storage.put("blogs/1/my_video.mp4", self._file())
+
+        assert storage.exists("blogs/1/my_video.mp4")
+        assert not storage.exists("blogs/1/my_placeholder.png")
+        assert storage.size("blogs/1/my_video.mp4") == 10
+        assert b"".join(storage.get("blogs/1/my_video.mp4")) == b"0123456789"
+        assert b"".join(storage.get("blogs/1/my_video.mp4", 2, 5)) == b"234"
+        assert b"".join(storage.get("blogs/1/my_video.mp4", 7)) == b"789"
+
+    def test_delete(self, storage):
+        storage.put("blogs/1/my_video.mp4", self._file())
+        storage.delete("blogs/1/my_video.mp4")
+
+        assert not storage.exists("blogs/1/my_video.mp4")
+        with pytest.raises(FileNotFoundError):
+            storage.delete("blogs/1/my_video.mp4")
+
+    def test_delete_prefix(self, storage):
+        storage.put("blogs/1/my_video.mp4", self._file())
+        storage.put("blogs/1/my_placeholder.png", self._file())
+        storage.put("blogs/10/my_video.mp4", self._file())
+        storage.delete_prefix("blogs/1")
+
+        assert not storage.exists("blogs/1/my_video.mp4")
+        assert not storage.exists("blogs/1/my_placeholder.png")
+        assert storage.exists("blogs/10/my_video.mp4")
+
+    @pytest.mark.parametrize("deduplicate", [False, True])
+    @pytest.mark.parametrize("fsync", ["none", "full"])
+    def test_local_put_is_atomic(self, tmp_path, deduplicate, fsync):
+        class BrokenStream(io.BytesIO):
+            def read(self, *args):
+                if self.tell():
+                    raise OSError("disconnected")
+                return super().read(4)
+
+        storage = LocalStorage(str(tmp_path), deduplicate=deduplicate, fsync=fsync)
+        storage.put("blogs/1/my_video.mp4", self._file())
+        with pytest.raises(OSError):
+            storage.put("blogs/1/my_video.mp4", FileStorage(stream=BrokenStream(b"abcdefgh"), filename="my_video.mp4"))
+
+        assert os.listdir(tmp_path / "blogs/1") == ["my_video.mp4"]
+        assert b"".join(storage.get("blogs/1/my_video.mp4")) == b"0123456789"
+        # The permissions open() gives a new file
+        with open(tmp_path / "expected", "w"):
+            pass
+        assert os.stat(storage.path("blogs/1/my_video.mp4")).st_mode & 0o777 == os.stat(tmp_path / "expected").st_mode & 0o777
+
+    def test_directory_cache(self, tmp_path):
+        cache = DirectoryCache(max_size=2)
+        paths = [str(tmp_path / "blogs" / str(i)) for i in range(3)]
+        cache.makedirs(paths[0])
+        cache.makedirs(paths[1])
+        cache.makedirs(paths[0])
+        cache.makedirs(paths[2])
+
+        assert all(os.path.isdir(p) for p in paths)
+        assert cache.stats() == {"hits": 1, "misses": 3, "size": 2, "max_size": 2, "hit_rate": 0.25}
+        # paths[1] was the least recently used
+        cache.makedirs(paths[1])
+        assert cache.misses == 4
+
+        cache.discard(str(tmp_path / "blogs"))
+        assert cache.stats()["size"] == 0
+        cache.clear()
+        assert cache.stats()["hit_rate"] == 0.0
+
+    @pytest.mark.parametrize("deduplicate", [False, True])
+    def test_local_put_caches_directories(self, tmp_path, monkeypatch, deduplicate):
+        cache = DirectoryCache()
+        monkeypatch.setattr(storage_module, "directory_cache", cache)
+        storage = LocalStorage(str(tmp_path), deduplicate=deduplicate)
+        storage.put("blogs/1/my_video.mp4", self._file())
+        misses = cache.misses
+        storage.put("blogs/1/my_placeholder.png", self._file())
+
+        assert cache.misses == misses
+        assert cache.hits >= 1
+
+        # Removed by another process
+        shutil.rmtree(tmp_path / "blogs")
+        storage.put("blogs/1/my_video.mp4", self._file())
+        assert b"".join(storage.get("blogs/1/my_video.mp4")) == b"0123456789"
+
+        storage.delete_prefix("blogs/1")
+        storage.put("blogs/1/my_video.mp4", self._file())
+        assert storage.exists("blogs/1/my_video.mp4")
+
+    def test_local_storage_fsync_policy(self):
+        with pytest.raises(ValueError):
+            LocalStorage(fsync="sometimes")
+
+    def test_local_storage_defaults_to_upload_folder(self):
+        config = Config()
+        config.upload_folder = "tests/test_path"
+        storage = LocalStorage()
+        storage.init_config(config)
+
+        assert storage.path("blogs/1/my_video.mp4") == "tests/test_path/blogs/1/my_video.mp4"
+
+    def test_s3_storage_url(self, s3_storage):
+        assert s3_storage.url("blogs/1/my_video.mp4").endswith("/uploads/media/blogs/1/my_video.mp4")
+
+    def test_file_upload_with_memory_storage(self, create_app, mock_blog_model):
+        storage = MemoryStorage()
+        app.config["FILE_UPLOAD_STORAGE"] = storage
+        file_upload.init_app(app, db)
+        try:
+            blog = file_upload.save_files(mock_blog_model(name="memory"), files={
+                "my_video": self._file(),
+            })
+            key = f"blogs/{blog.id}/my_video.mp4"
+            assert storage.files[key] == b"0123456789"
+
+            with app.test_request_context(headers={"Range": "bytes=2-4"}):
+                rv = file_upload.stream_file(blog, filename="my_video")
+                assert rv.status_code == 206
+                assert rv.mimetype == "video/mpeg"
+                assert rv.headers["Content-Range"] == "bytes 2-4/10"
+                assert b"".join(rv.response) == b"234"
+
+            with app.test_request_context():
+                rv = file_upload.stream_file(blog, filename="my_video")
+                assert rv.status_code == 200
+                assert rv.content_length == 10
+
+            file_upload.delete_files(blog, files=["my_video"])
+            assert key not in storage.files
+        finally:
+            app.config["FILE_UPLOAD_STORAGE"] = None
+            file_upload.init_app(app, db)
+
+    def test_deduplicated_put_links_one_blob(self, tmp_path):
+        storage = LocalStorage(str(tmp_path), deduplicate=True)
+        storage.put("blogs/1/my_video.mp4", self._file())
+        storage.put("blogs/2/my_video.mp4", self._file())
+        storage.put("blogs/3/my_video.mp4", self._file(b"abc"))
+
+        first = os.stat(storage.path("blogs/1/my_video.mp4"))
+        assert first.st_ino == os.stat(storage.path("blogs/2/my_video.mp4")).st_ino
+        assert first.st_nlink == 3
+        assert os.stat(storage.path("blogs/3/my_video.mp4")).st_nlink == 2
+        assert b"".join(storage.get("blogs/2/my_video.mp4")) == b"0123456789"
+        assert len(os.listdir(tmp_path / CAS_FOLDER / "tmp")) == 0
+
+    def test_deduplicated_delete_frees_last_reference(self, tmp_path):
+        storage = LocalStorage(str(tmp_path), deduplicate=True)
+        blob_path = storage.blob_path(hashlib.sha256(b"0123456789").hexdigest())
+        storage.put("blogs/1/my_video.mp4", self._file())
+        storage.put("blogs/2/my_video.mp4", self._file())
+
+        storage.delete("blogs/1/my_video.mp4")
+        assert os.stat(blob_path).st_nlink == 2
+        storage.delete_prefix("blogs/2")
+        assert not os.path.exists(blob_path)
+
+    def test_deduplicated_put_replaces_file(self, tmp_path):
+        storage = LocalStorage(str(tmp_path), deduplicate=True)
+        old_blob_path = storage.blob_path(hashlib.sha256(b"0123456789").hexdigest())
+        storage.put("blogs/1/my_video.mp4", self._file())
+        storage.put("blogs/1/my_video.mp4", self._file(b"abc"))
+
+        assert not os.path.exists(old_blob_path)
+        assert b"".join(storage.get("blogs/1/my_video.mp4")) == b"abc"
+
+    def test_deduplicated_delete_does_not_hash(self, tmp_path, monkeypatch):
+        storage = LocalStorage(str(tmp_path), deduplicate=True)
+        blob_path = storage.blob_path(hashlib.sha256(b"0123456789").hexdigest())
+        storage.put("blogs/1/my_video.mp4", self._file())
+        storage.put("blogs/2/my_video.mp4", self._file(b"abc"))
+        inode = os.stat(blob_path).st_ino
+        assert os.readlink(storage.inode_path(inode)) == hashlib.sha256(b"0123456789").hexdigest()
+
+        def read(*args):
+            raise AssertionError("The file was hashed")
+
+        monkeypatch.setattr(storage_module, "_iter_chunks", read)
+        storage.delete("blogs/1/my_video.mp4")
+        monkeypatch.undo()
+
+        assert not os.path.exists(blob_path)
+        assert not os.path.lexists(storage.inode_path(inode))
+
+        # Blobs missing from the index are hashed
+        os.remove(storage.inode_path(os.stat(storage.path("blogs/2/my_video.mp4")).st_ino))
+        storage.delete("blogs/2/my_video.mp4")
+        assert os.listdir(tmp_path / CAS_FOLDER / INODE_FOLDER) == []
+
+    def test_deduplicated_staged_file_is_linked(self, tmp_path):
+        config = Config()
+        config.upload_folder = str(tmp_path)
+        storage = LocalStorage(deduplicate=True)
+        storage.init_config(config)
+        staged = _StagingFile(get_staging_folder(config))
+        staged.write(b"0123456789")
+        inode = os.stat(staged.name).st_ino
+        file = FileStorage(stream=staged, filename="my_video.mp4")
+        storage.put("blogs/1/my_video.mp4", file)
+        storage.put("blogs/2/my_video.mp4", file)
+        staged.close()
+
+        assert os.stat(storage.path("blogs/1/my_video.mp4")).st_ino == inode
+        assert os.stat(storage.path("blogs/2/my_video.mp4")).st_ino == inode
+        assert os.stat(storage.path("blogs/2/my_video.mp4")).st_nlink == 3
+        assert os.listdir(get_staging_folder(config)) == []
+
+    def test_s3_client_errors_surface(self, monkeypatch):
+        # A client passed in without boto3 installed
+        monkeypatch.setitem(sys.modules, "boto3", None)
+        spec = importlib.util.spec_from_file_location("flask_file_upload._storage_no_boto3", storage_module.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        class Client:
+            class meta:
+                endpoint_url = "http://localhost:9000"
+
+            def head_object(self, **kwargs):
+                raise ConnectionError("unreachable")
+
+            get_object = head_object
+
+        storage = module.S3Storage(bucket="uploads", client=Client())
+        with pytest.raises(ConnectionError):
+            storage.exists("blogs/1/my_video.mp4")
+        with pytest.raises(ConnectionError):
+            list(storage.get("blogs/1/my_video.mp4"))
@@ -0,0 +1,181 @@
+import io
+import os
+import errno
+import shutil
+import hashlib
+from flask import Flask, request
+from werkzeug.datastructures import FileStorage
+
+from flask_file_upload._config import Config
+from flask_file_upload._model_utils import _ModelUtils
+from flask_file_upload._stream import _StagingFile, create_request_class, get_staging_folder, is_staged, measure
+from flask_file_upload.file_utils import FileUtils
+from flask_file_upload.storage import LocalStorage
+from tests.fixtures.models import MockBlogModel
+
+
+class TestStream:
+
+    upload_folder = "tests/test_path/stream"
+    my_video = os.path.join("tests/assets/my_video.mp4")
+
+    def teardown_method(self):
+        shutil.rmtree(self.upload_folder, ignore_errors=True)
+
+    def _create_app(self):
+        app = Flask(__name__)
+        app.config["UPLOAD_FOLDER"] = self.upload_folder
+        app.config["SERVER_NAME"] = None
+        app.config["FILE_UPLOAD_STREAM_UPLOADS"] = True
+        config = Config()
+        config.init_config(app)
+        app.request_class = create_request_class(app.request_class, config)
+        return app, config
+
+    def test_staging_file_publish_is_rename(self):
+        config = Config()
+        config.upload_folder = self.upload_folder
+        staged = _StagingFile(get_staging_folder(config))
+        staged.write(b"123456")
+        inode = os.stat(staged.name).st_ino
+        staged.publish(f"{self.upload_folder}/my_video.mp4")
+        staged.close()
+
+        assert os.stat(f"{self.upload_folder}/my_video.mp4").st_ino == inode
+        assert os.listdir(get_staging_folder(config)) == []
+
+    def test_unpublished_staging_file_is_removed(self):
+        config = Config()
+        config.upload_folder = self.upload_folder
+        staged = _StagingFile(get_staging_folder(config))
+        staged.write(b"123456")
+        staged.close()
+
+        assert os.listdir(get_staging_folder(config)) == []
+
+    def test_streamed_upload(self):
+        app, config = self._create_app()
+
+        @app.route("/stream", methods=["POST"])
+        def stream():
+            file = request.files["file"]
+            assert is_staged(file)
+            FileUtils(MockBlogModel(name="test_stream"), config).save_file(file, 1)
+            return {"data": "hello"}, 200
+
+        with open(self.my_video, "rb") as f:
+            rv = app.test_client().post("/stream", data={"file": (f, "my_video.mp4")})
+
+        assert "200" in rv.status
+        with open(self.my_video, "rb") as src, open(f"{self.upload_folder}/blogs/1/my_video.mp4", "rb") as dest:
+            assert src.read() == dest.read()
+        assert os.listdir(get_staging_folder(config)) == []
+
+    def test_measure(self):
+        file, metadata = measure(FileStorage(stream=io.BytesIO(b"123456"), filename="my_video.mp4"), ["sha256", "md5"])
+        assert file.read() == b"123456"
+
+        assert metadata() == {
+            "size": 6,
+            "sha256": hashlib.sha256(b"123456").hexdigest(),
+            "md5": hashlib.md5(b"123456").hexdigest(),
+        }
+
+    def test_sha256_only_with_deduplicate(self, monkeypatch):
+        # No digest columns are declared
+        monkeypatch.setattr(_ModelUtils, "digests", set())
+        for deduplicate in (False, True):
+            app, config = self._create_app()
+            config.storage = LocalStorage(deduplicate=deduplicate)
+            config.storage.init_config(config)
+
+            @app.route("/upload", methods=["POST"])
+            def upload():
+                return {"hashes": sorted(request.files["my_video"].stream._hashes)}
+
+            rv = app.test_client().post("/upload", data={"my_video": (io.BytesIO(b"123456"), "my_video.mp4")})
+            assert ("sha256" in rv.get_json()["hashes"]) is deduplicate
+
+    def test_measure_staged_file(self):
+        config = Config()
+        config.upload_folder = self.upload_folder
+        staged = _StagingFile(get_staging_folder(config), ["md5"])
+        staged.write(b"123456")
+        _, metadata = measure(FileStorage(stream=staged, filename="my_video.mp4"), ["md5", "sha1"])
+
+        assert metadata() == {
+            "size": 6,
+            "md5": hashlib.md5(b"123456").hexdigest(),
+            "sha1": hashlib.sha1(b"123456").hexdigest(),
+        }
+        staged.close()
+
+    def test_spool_threshold(self):
+        staging_folder = f"{self.upload_folder}/staging"
+        staged = _StagingFile(staging_folder, spool_threshold=8)
+        staged.write(b"1234")
+        assert not staged.on_disk
+        assert not os.path.exists(staging_folder)
+
+        staged.write(b"56789")
+        assert staged.on_disk
+        assert os.path.dirname(staged.name) == os.path.abspath(staging_folder)
+        staged.seek(0)
+        assert staged.read() == b"123456789"
+        assert staged.hexdigest("md5") == hashlib.md5(b"123456789").hexdigest()
+        staged.close()
+        assert os.listdir(staging_folder) == []
+
+    def test_staging_folder_upload(self):
+        staging_folder = f"{self.upload_folder}/staging"
+        app, config = self._create_app()
+        app.config["FILE_UPLOAD_STREAM_UPLOADS"] = None
+        config.init_config(app, staging_folder=staging_folder, spool_threshold=1024)
+        assert config.stream_uploads
+        assert get_staging_folder(config) == staging_folder
+
+        @app.route("/stream", methods=["POST"])
+        def stream():
+            small, large = request.files["small"], request.files["large"]
+            assert not small.stream.on_disk
+            assert os.path.dirname(large.stream.name) == os.path.abspath(staging_folder)
+            inode = os.stat(large.stream.name).st_ino
+            file_utils = FileUtils(MockBlogModel(name="test_stream"), config)
+            file_utils.save_file(small, 1)
+            file_utils.save_file(large, 1)
+            # Saving the same file again is a hardlink
+            file_utils.save_file(FileStorage(large.stream, "my_video_copy.mp4"), 2)
+            assert os.stat(f"{self.upload_folder}/blogs/1/my_video.mp4").st_ino == inode
+            assert os.stat(f"{self.upload_folder}/blogs/2/my_video_copy.mp4").st_ino == inode
+            return {"data": "hello"}, 200
+
+        with open(self.my_video, "rb") as f:
+            rv = app.test_client().post("/stream", data={
+                "small": (io.BytesIO(b"123456"), "small.mp4"),
+                "large": (f, "my_video.mp4"),
+            })
+
+        assert "200" in rv.status
+        with open(f"{self.upload_folder}/blogs/1/small.mp4", "rb") as f:
+            assert f.read() == b"123456"
+        assert os.listdir(staging_folder) == []
+
+    def test_staged_file_on_other_filesystem(self, monkeypatch):
+        config = Config()
+        config.upload_folder = self.upload_folder
+        staged = _StagingFile(get_staging_folder(config))
+        staged.write(b"123456")
+        replace = os.replace
+
+        def cross_device_replace(src, dst):
+            if src == staged.name:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return replace(src, dst)
+
+        monkeypatch.setattr(os, "replace", cross_device_replace)
+        storage = LocalStorage(root=self.upload_folder)
+        storage.put("blogs/1/my_video.mp4", FileStorage(staged, "my_video.mp4"))
+        staged.close()
+
+        with open(f"{self.upload_folder}/blogs/1/my_video.mp4", "rb") as f:
+            assert f.read() == b"123456"